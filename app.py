@@ -10,22 +10,38 @@ Features:
 - Sidebar menu for selecting manual and view mode (chat or full manual)
 - Conversational interface with possibility of viewing source pages for 
   answers
+- Answers are streamed as typed events from the assistant (answer tokens, end of
+  answer, sources, timings) and rendered at most every RENDER_INTERVAL seconds
+- If the vector databases were built with --layout, the source pages are shown as small
+  cropped snippets of the cited regions, with their words highlighted, and the full page
+  only on request
+
+Startup:
+
+- Heavy modules (torch, sentence_transformers, faiss, openai) are not imported when the
+  page is first rendered. A background warmup imports them, loads the embedder and the
+  vector databases of the most used manuals (see classes/warmup.py).
+- The assistant of a session is only created when the first question is asked.
+- The startup profile (import time per module, warmup stages, time to first render and
+  to first answer) is logged, exported as metrics and shown in the latency breakdown.
 """
 
 # Perform necessary imports
+from classes.startup_profile import StartupProfile
 import streamlit as st
 from streamlit_option_menu import option_menu
 from pathlib import Path
-from classes.manual_assistant import ManualAssistant
-import torch
+from classes.manual_assistant import ManualAssistant, ANY_MANUAL, reload_vector_dbs
+from classes.prompt_builder import NO_ANSWER
+from classes.manual_router import default_router_path
+from classes.snapshots import SnapshotWatcher, active_dir, current_snapshot
+from classes.metrics import start_metrics_server
+from classes.warmup import Warmup, record_manual_use, most_used_manuals
+from classes.page_layout import crop_snippet
 import joblib
 import os
-import pandas as pd
-import re
-import hashlib
-
-# Fix PyTorch + Streamlit crash
-torch.classes.__path__ = []
+import logging
+import time
 
 # Set layout, title and user instructions
 st.set_page_config(layout="wide")
@@ -33,22 +49,30 @@ st.title("📚 Welcome to the manual assistant!")
 st.markdown("⬅️ Choose a manual of interest on the left.")
 st.markdown("⬅️ You can also view the full manual by selecting the radio button on the left.")
 
+# The shortest time in seconds between two renders of a streamed answer
+RENDER_INTERVAL = 0.1
+
 ############ Utility functions ############
 @st.cache_data
-def get_manuals() -> list:
+def get_manuals(snapshot: str) -> list:
     """
     Returns a sorted list of available manual names based on subdirectories 
-    found in the 'vector_databases/' folder.
+    found in the folder of the vector databases in use.
+
+    Args:
+        snapshot (str): The name of the published snapshot (None for the old layout).
+            Only used as the cache key, so that the list is refreshed when a new
+            snapshot is published.
 
     Returns:
         list: Alphabetically sorted names of all manuals (as strings), 
-              where each name corresponds to a subdirectory in 'vector_databases/'.
+              where each name corresponds to a subdirectory with a vector database.
 
     Caching:
         Streamlit caches the result to avoid re-reading the filesystem on every rerun.
     """
-    vector_db_path = Path("vector_databases")
-    return sorted([d.name for d in vector_db_path.iterdir() if d.is_dir()])
+    vector_db_path = active_dir()
+    return sorted([d.name for d in vector_db_path.iterdir() if (d / 'vdb.pkl').exists()])
 
 @st.cache_data
 def get_evaluation_df():
@@ -64,12 +88,100 @@ def get_evaluation_df():
         Streamlit caches the result to avoid reloading and recomputing 
         on every rerun.
     """
+    import pandas as pd
     base_dir = Path('.')/'evaluation'
-    dfs=[joblib.load(base_dir/df) for df in os.listdir(base_dir)]
+    dfs=[joblib.load(path) for path in sorted(base_dir.glob('*.pkl'))]
     return pd.concat(dfs,axis=0).reset_index()
 
-# Get the manual names and the evaluation dataframe.
-manuals = get_manuals()
+@st.cache_data(max_entries=256)
+def get_snippet(path: str, regions: list) -> bytes:
+    """
+    Returns a cropped snippet of a page image with the regions of the cited chunks
+    highlighted (see classes/page_layout.py).
+
+    Args:
+        path (str): The path to the page image.
+        regions (list): The packed line boxes of the cited chunks on the page.
+
+    Returns:
+        bytes: The snippet as a JPEG image.
+
+    Caching:
+        Streamlit caches the snippets, so that they are not cropped again on every rerun.
+    """
+    return crop_snippet(path, regions)
+
+@st.cache_resource
+def setup_instrumentation():
+    """
+    Starts the Prometheus-style metrics endpoint if the environment variable
+    metrics_port is set, and writes the structured per-query logs to the file
+    given by the environment variable metrics_log, if set.
+
+    Returns:
+        ThreadingHTTPServer or None: The running metrics server, if any.
+
+    Caching:
+        Streamlit caches the resource so that this is only done once.
+    """
+    log_path = os.getenv('metrics_log')
+    if log_path:
+        handler = logging.FileHandler(log_path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        metrics_logger = logging.getLogger('manual_assistant.metrics')
+        metrics_logger.addHandler(handler)
+        metrics_logger.setLevel(logging.INFO)
+    port = os.getenv('metrics_port')
+    return start_metrics_server(int(port)) if port else None
+
+@st.cache_resource
+def start_warmup() -> Warmup:
+    """
+    Starts the background warmup of the heavy modules, the embedder and the vector databases
+    of the most used manuals (the number is read from the environment variable warm_manuals,
+    default 3).
+
+    The warmup creates the micro-batching scheduler shared by the assistants of all sessions,
+    so that the query embeddings and searches of simultaneous users run in batches. The batching
+    window and the batch size are read from the environment variables batch_max_latency_ms
+    (default 5) and batch_max_size (default 32).
+
+    Also starts a watcher that reloads the indexes in the background when a new snapshot of
+    the vector databases is published (polled every snapshot_poll_seconds, default 5).
+
+    Returns:
+        Warmup: The running warmup.
+
+    Caching:
+        Streamlit caches the resource so that all sessions share one warmup, scheduler and embedder.
+    """
+    manuals = get_manuals(current_snapshot())
+    warm_manuals = [m for m in most_used_manuals(int(os.getenv('warm_manuals', 3))) if m in manuals]
+    SnapshotWatcher(reload_vector_dbs, interval=float(os.getenv('snapshot_poll_seconds', 5))).start()
+    return Warmup(
+        StartupProfile(),
+        manuals=warm_manuals,
+        max_latency=float(os.getenv('batch_max_latency_ms', 5)) / 1000,
+        max_batch_size=int(os.getenv('batch_max_size', 32))
+    ).start()
+
+def get_assistant():
+    """
+    Returns the assistant of the session, creating it for the selected manual if needed.
+    Waits for the warmup to load the embedder, if it has not done so yet.
+
+    Returns:
+        ManualAssistant: The assistant.
+    """
+    if st.session_state.assistant is None:
+        st.session_state.assistant = ManualAssistant(st.session_state.manual, scheduler=warmup.scheduler())
+    return st.session_state.assistant
+
+# Set up the metrics endpoint and logs (if configured), get the manual
+# names, start the warmup and get the evaluation dataframe.
+setup_instrumentation()
+manuals = get_manuals(current_snapshot())
+warmup = start_warmup()
 evaluation_df = get_evaluation_df()
 
 ############ Web page creation ############
@@ -78,17 +190,21 @@ evaluation_df = get_evaluation_df()
 # and radio buttons for view mode (chatting or reading the manual)
 with st.sidebar:
     st.header("📁 Manual Settings")
-    selected_manual = st.selectbox("Select a manual:", manuals, key="manual_select")
+    # If the manual routing index has been built, questions can also be asked about any manual
+    manual_options = ([ANY_MANUAL] if default_router_path().exists() else []) + manuals
+    selected_manual = st.selectbox("Select a manual:", manual_options, key="manual_select")
     tab_selection = st.radio("View Mode", ["💬 Chat", "📖 View Manual"], key="tab_selection")
+    show_debug = st.checkbox("Show latency breakdown", key="show_debug")
 
-# If a new manual is selected, we create a new manual assistant object for the
-# new manual and reset the chat list and last_image_path list
+# If a new manual is selected, we reset the assistant (a new one is created for the
+# new manual when the first question is asked), the chat list and last_image_path list
 if "manual" not in st.session_state or st.session_state.manual != selected_manual:
-    st.session_state.assistant = ManualAssistant(selected_manual)
+    st.session_state.assistant = None
     st.session_state.manual = selected_manual
     st.session_state.chat = []
     st.session_state.last_image_paths = []
-assistant = st.session_state.assistant
+    if selected_manual != ANY_MANUAL:
+        record_manual_use(selected_manual)
 
 # Display which manual is currently under consideration
 st.markdown(f"**Currently helping with:** `{st.session_state.manual}`")
@@ -99,7 +215,7 @@ if tab_selection == "💬 Chat":
     with st.chat_message('assistant'):
         st.markdown("Don't know what to ask? Here are a few to get you started:")
         df = evaluation_df[evaluation_df['Manual']==selected_manual]
-        df = df[df['Local answer']!="I'm afraid I can't find that information in the manual."]
+        df = df[df['Local answer']!=NO_ANSWER]
         df = df[df['Reference answer']!="I'm afraid I can't find that in the manual."]
         for i in range(len(df)):
             st.markdown(f"  {i+1}. *{df.iloc[i,2]}*")
@@ -120,80 +236,85 @@ if tab_selection == "💬 Chat":
         with st.chat_message("assistant"):
             # Clear the response area
             response_area = st.empty()
-            # Initialize the response string
-            full_response = ""
-            # This is the marker for "end of message and start of sources enumeration"
-            # Naturally, a giraffe was chosen to be the end marker.
-            end_marker = "🦒"
-            # This is the part of the response string that we are going to show to the user
+            # This is the part of the response that we are going to show to the user
             visible_response = ""
-            # We want to stream the answer, chunk by chunk, to the user so that they
-            # don't have to wait for it and the have it presented all at once. But when
-            # we are done presenting the answer and instead focus on the sources for the
-            # answer, we will set this to false.
-            streaming_answer = True
-            # Placeholder string for the source pages of the manual
-            sources = ""
-            # Iterate over the reply from the call to the assistants stream_user_query method
-            # For each chunk, do the following:
-            for chunk in assistant.stream_user_query(user_input):
-                # Add the chunk to the full response
-                full_response += chunk
-                # If we are still streaming, do the following:
-                if streaming_answer:
-                    # If the end marker is in the current chunk, proceed as follows:
-                    if end_marker in chunk:
-                        # Split the chunk containing the end marker into a before-
-                        # and after part.
-                        before_marker, after_marker = chunk.split(end_marker, 1)
-                        # add the before part to the visible response
-                        visible_response += before_marker
-                        # Add the after part to the sources 
-                        sources += after_marker
-                        # From now on, we are no longer streaming
-                        streaming_answer = False
-                        # Display the visible response in the response area
-                        response_area.markdown(visible_response.strip())
-                    else:
-                        # Add the current chunk to the visible response and
-                        # display it in the response area
-                        visible_response += chunk
-                        response_area.markdown(visible_response)
-                else:
-                    # We are no longer streaming, so add the current chunk to
-                    # the sources
-                    sources += chunk
-            # Initialize a list that will (possibly) contain image paths
-            image_paths = []
-            # If the answer contained sources, do the following
-            if sources:
-                # Iterate over the lines in the source string
-                for line in sources.strip().splitlines():
-                    # If the word "Source" occurs in this line 
-                    if "Source" in line:
-                        # Extract the path part and add it to image_paths
-                        path = line.split(":")[-1].strip().replace("\\", "/")
-                        image_paths.append(path)
-            # Set the session state last_image_paths list to be equal to image_paths
-            st.session_state.last_image_paths = sorted(image_paths)
+            # The pages the answer is based on, as sent by the assistant
+            sources = []
+            # The answer is rendered at most once per RENDER_INTERVAL seconds, with the tokens
+            # received in between, so that long answers do not re-render on every token
+            last_render = 0.0
+            # Wait for the warmup to load the embedder, if this is the first question after startup
+            if not warmup.ready.is_set():
+                with st.spinner("⏳ Loading the embedding model..."):
+                    warmup.ready.wait()
+            # Iterate over the events streamed by the assistant
+            for event in get_assistant().stream_events(user_input):
+                if event['type'] == 'token':
+                    # Add the token to the visible response and render it if enough time has passed
+                    visible_response += event['text']
+                    if time.perf_counter() - last_render >= RENDER_INTERVAL:
+                        response_area.markdown(visible_response + "▌")
+                        last_render = time.perf_counter()
+                elif event['type'] == 'answer_end':
+                    # Render the full answer, without the cursor
+                    visible_response = event['text']
+                    response_area.markdown(visible_response)
+                elif event['type'] == 'sources':
+                    sources = event['sources']
+            # Set the session state last_image_paths list to the pages of the sources, in the
+            # order they are cited, with the citation numbers of each page as caption and the
+            # regions of the cited chunks on the page
+            st.session_state.last_image_paths = [
+                (
+                    source['path'].replace("\\", "/"),
+                    ", ".join(f"[{n}]" for n in source['numbers']),
+                    source.get('regions', [])
+                )
+                for source in sources
+            ]
             # Add the user_input and visible_response strings to the chat history
             st.session_state.chat.append((user_input, visible_response))
+            # Record the time to the first answer of the process
+            if warmup.profile.mark('first_answer'):
+                warmup.profile.report()
 
-            # We want to check if:
-            # 1. The last_image_paths list is not empty
-            # 2. The last response was one based on sources
-            check1 = st.session_state.get("last_image_paths")
-            check2 =  "I'm afraid I can't find that information in the manual" not in st.session_state.chat[-1][1]
-            # If this is the case, do the following
-            if check1 and check2:
-               # Display an expander for viewing the manual pages relevant to the answer
-               with st.expander("📄 View relevant pages"):
-                    # Iterate over the paths in last_image_paths
-                    for path in st.session_state["last_image_paths"]:
-                        # Show the image
-                        st.image(path, use_container_width=True)
-                    # When we are done, clear last_image_paths
-                    st.session_state.last_image_path = []
+    # If the last answer is based on sources, display an expander for viewing the manual
+    # pages relevant to it. It is shown outside of the answer, so that it stays on the page
+    # when a full page is requested (which reruns the script).
+    if st.session_state.get("last_image_paths"):
+        with st.expander("📄 View relevant pages", expanded=True):
+            # Iterate over the pages in last_image_paths
+            for i, (path, caption, regions) in enumerate(st.session_state["last_image_paths"]):
+                if not regions:
+                    # Without the layout of the chunks, show the full page
+                    st.image(path, caption=caption, use_container_width=True)
+                    continue
+                # Show the cited regions of the page, and the full page on request
+                try:
+                    st.image(get_snippet(path, regions), caption=caption)
+                except (OSError, ValueError):
+                    st.image(path, caption=caption, use_container_width=True)
+                    continue
+                if st.checkbox("Show full page", key=f"full_page_{i}_{path}"):
+                    st.image(path, use_container_width=True)
+
+    # If the debug panel is enabled, show the stage timings and token counts
+    # of the last answer, and the startup profile
+    assistant = st.session_state.assistant
+    if show_debug and assistant is not None and assistant.last_trace:
+        import pandas as pd
+        with st.expander("⏱️ Latency breakdown for the last answer", expanded=True):
+            stages = assistant.last_trace['stages']
+            st.dataframe(
+                pd.DataFrame(
+                    [{'Stage': stage, 'Milliseconds': round(seconds * 1000, 1)} for stage, seconds in stages.items()]
+                ),
+                hide_index=True
+            )
+            st.json(assistant.last_trace['counts'])
+    if show_debug:
+        with st.expander("🚀 Startup profile"):
+            st.json(warmup.profile.to_dict())
     
 
 # If instead the view mode is view manual, do the following
@@ -201,7 +322,9 @@ if tab_selection == "📖 View Manual":
     # Define the path to the manual pages
     manual_dir = Path("docs") / selected_manual / "images"
     # If this path exists, do the following
-    if manual_dir.exists():
+    if selected_manual == ANY_MANUAL:
+        st.info("Select a manual on the left to view it.")
+    elif manual_dir.exists():
         # Create a list of all the image file paths in the folder
         image_files = sorted(manual_dir.glob("*.[jp][pn]g"))
         # Iterate over the file paths
@@ -210,3 +333,6 @@ if tab_selection == "📖 View Manual":
             st.image(image_path, use_container_width=True)
     else:
         st.warning("No images found for this manual.")
+
+# Record the time to the first rendered page of the process
+warmup.profile.mark('first_render')
@@ -0,0 +1,159 @@
+"""
+Script: batching_benchmark.py
+
+This script measures the throughput and latency of query embedding plus vector search under
+concurrent load, with and without micro-batching (see classes/batch_scheduler.py).
+
+A number of simulated users (threads) each send queries back to back to one of several
+synthetic vector databases. Every query is embedded with the real embedder and searched for
+the top 5 chunks, either on its own ('direct') or through a BatchScheduler with the given
+batching window and batch size. For each configuration and number of users, queries/sec and
+the p50/p95/p99 latencies are reported.
+
+Usage:
+    python benchmarks/batching_benchmark.py
+    python benchmarks/batching_benchmark.py --users 1 8 32 --windows-ms 2 5 10 --batch-sizes 16 64
+
+Side Effects:
+    - Writes the results as JSON to benchmarks/results/batching_<timestamp>_<commit>.json.
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from microbenchmarks import RESULTS_DIR, synthetic_sentence, percentiles, git_commit, machine_info
+
+
+def build_indexes(n_indexes: int, size: int, seed: int, dim: int = 384) -> list:
+    """
+    Creates vector databases filled with random unit vectors.
+    """
+    from classes.vector_database import VectorDatabase
+    rng = np.random.default_rng(seed)
+    indexes = []
+    for n in range(n_indexes):
+        vdb = VectorDatabase(dim=dim)
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        records = [
+            {'manual': f'synthetic_{n}', 'path': f'page_{i // 4}.jpg', 'chunk': i % 4, 'text': f'chunk {i}'}
+            for i in range(size)
+        ]
+        vdb.add(vectors, records)
+        indexes.append(vdb)
+    return indexes
+
+
+def run_load(embedder, indexes: list, users: int, queries_per_user: int, seed: int, scheduler=None) -> dict:
+    """
+    Runs the simulated users and measures the latency of every query.
+
+    Args:
+        embedder (Embedder): The embedder used without a scheduler.
+        indexes (list): The vector databases the users search.
+        users (int): The number of concurrent users.
+        queries_per_user (int): The number of queries each user sends.
+        seed (int): The random seed of the queries.
+        scheduler (BatchScheduler): The scheduler to use, or None to embed and search directly.
+
+    Returns:
+        dict: Queries/sec and latency percentiles.
+    """
+    latencies = [[] for _ in range(users)]
+    barrier = threading.Barrier(users + 1)
+
+    def user(n: int):
+        rng = random.Random(seed + n)
+        vdb = indexes[n % len(indexes)]
+        queries = [synthetic_sentence(rng) for _ in range(queries_per_user)]
+        barrier.wait()
+        for query in queries:
+            start = time.perf_counter()
+            if scheduler is not None:
+                embedding = scheduler.embed(query)
+                scheduler.search(vdb, embedding, top_k=5)
+            else:
+                embedding, _ = embedder.encode([{'text': query}])
+                vdb.search_manual(np.asarray(embedding, dtype=np.float32), top_k=5)
+            latencies[n].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(users)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    all_latencies = [latency for user_latencies in latencies for latency in user_latencies]
+    return {
+        'queries': len(all_latencies),
+        'seconds': elapsed,
+        'qps': len(all_latencies) / elapsed,
+        **percentiles(all_latencies)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput vs latency of micro-batched embedding and search.')
+    parser.add_argument('--users', nargs='+', type=int, default=[1, 4, 16, 64])
+    parser.add_argument('--windows-ms', nargs='+', type=float, default=[1, 5, 20], help='Batching windows to test.')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[8, 32], help='Maximum batch sizes to test.')
+    parser.add_argument('--queries-per-user', type=int, default=50)
+    parser.add_argument('--indexes', type=int, default=4, help='Number of vector databases searched.')
+    parser.add_argument('--index-size', type=int, default=100_000, help='Vectors per vector database.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    args = parser.parse_args()
+
+    from classes.embedder import Embedder
+    from classes.batch_scheduler import BatchScheduler
+    print('🔄️ Preparing...')
+    embedder = Embedder()
+    # Warm up the model so that lazy initialization is not measured
+    embedder.encode([{'text': 'warm up'}])
+    indexes = build_indexes(args.indexes, args.index_size, args.seed)
+
+    configurations = [('direct', None, None)] + [
+        (f'batched_{window:g}ms_{size}', window, size)
+        for window in args.windows_ms for size in args.batch_sizes
+    ]
+    results = {}
+    print(f"\n{'configuration':<24}{'users':>6}{'qps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, window, size in configurations:
+        scheduler = None
+        if window is not None:
+            scheduler = BatchScheduler(embedder, max_latency=window / 1000, max_batch_size=size)
+        for users in args.users:
+            result = run_load(embedder, indexes, users, args.queries_per_user, args.seed, scheduler)
+            results[f'{name}_{users}_users'] = {'configuration': name, 'users': users, **result}
+            print(
+                f"{name:<24}{users:>6}{result['qps']:>10.1f}{result['p50_ms']:>10.1f}"
+                f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            )
+        if scheduler is not None:
+            scheduler.close()
+
+    # Save the results
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'settings': vars(args) | {'output': str(args.output) if args.output else None},
+        'results': results
+    }
+    output = args.output or RESULTS_DIR / f"batching_{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'\n🎉 Results saved to {output}')
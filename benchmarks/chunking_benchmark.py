@@ -0,0 +1,118 @@
+"""
+Script: chunking_benchmark.py
+
+This script compares per-page chunking with manual-level chunking, in which the pages of a
+manual are chunked in order as one text so that chunks may cross page breaks (see
+classes/semantic_chunker.py).
+
+The vector databases of the chosen manuals are built twice with the streaming build pipeline,
+once with each chunking mode, into a temporary folder. For each mode the number of vectors,
+the share of chunks spanning several pages, the size of the vector databases on disk and the
+retrieval quality on the stored evaluation questions (recall@k and MRR, see
+classes/retrieval_evaluator.py) are reported. The vector databases in use are not touched.
+
+Usage:
+    python benchmarks/chunking_benchmark.py [--manuals NAME ...] [--ocr-workers N] [--keep DIR]
+
+Side Effects:
+    - Writes the results as JSON to benchmarks/results/chunking_<timestamp>_<commit>.json.
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+from datetime import datetime
+from microbenchmarks import RESULTS_DIR, git_commit, machine_info
+
+
+def build(tasks: dict, output_dir: Path, chunking: str, ocr_workers: int) -> dict:
+    """
+    Builds the vector databases of the given tasks with one chunking mode.
+
+    Returns:
+        dict: The build time, the number of vectors, the share of chunks spanning several
+            pages and the size of the vector databases in bytes.
+    """
+    import joblib
+    from classes.build_pipeline import StreamingBuildPipeline
+    start = time.perf_counter()
+    StreamingBuildPipeline(tasks, output_dir, ocr_workers=ocr_workers, chunking=chunking).run()
+    seconds = time.perf_counter() - start
+    vectors, spanning, index_bytes = 0, 0, 0
+    for manual in tasks:
+        db_path = output_dir / manual / 'vdb.pkl'
+        vdb = joblib.load(db_path)
+        vectors += vdb.index.ntotal
+        spanning += sum('last_page' in record for record in vdb.metadata)
+        index_bytes += db_path.stat().st_size
+    return {
+        'build_seconds': seconds,
+        'vectors': vectors,
+        'spanning_share': spanning / max(vectors, 1),
+        'index_bytes': index_bytes
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-page vs manual-level chunking.')
+    parser.add_argument('--manuals', nargs='+', default=None, help='The manuals to build. Defaults to all evaluated manuals.')
+    parser.add_argument('--ocr-workers', type=int, default=None)
+    parser.add_argument('--keep', type=Path, default=None, help='Build into this folder and keep it, instead of a temporary folder.')
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    args = parser.parse_args()
+
+    from classes.task_generator import TaskGenerator
+    from classes.retrieval_evaluator import RetrievalEvaluator
+    from classes.embedder import Embedder
+    multiprocessing.set_start_method('spawn', force=True)
+
+    # Only manuals with evaluation questions can be compared on retrieval quality
+    evaluated = {path.stem for path in (base_folder / 'evaluation').glob('*.pkl')}
+    manuals = set(args.manuals) if args.manuals else evaluated
+    tasks = {manual: paths for manual, paths in TaskGenerator(base_folder / 'docs').get_tasks().items() if manual in manuals}
+
+    embedder = Embedder()
+    results = {}
+    with tempfile.TemporaryDirectory() as temporary:
+        root = args.keep or Path(temporary)
+        for chunking in ('page', 'manual'):
+            print(f'🔄️ Building {len(tasks)} manuals with {chunking} chunking...')
+            output_dir = root / chunking
+            result = build(tasks, output_dir, chunking, args.ocr_workers)
+            evaluator = RetrievalEvaluator(embedder=embedder, db_dir=output_dir)
+            result['retrieval'] = evaluator.evaluate(sorted(tasks))
+            results[chunking] = result
+
+    # Print the comparison
+    page, manual = results['page'], results['manual']
+    print(f"\n{'':<20}{'page':>12}{'manual':>12}{'change':>10}")
+    rows = [('vectors', 'vectors'), ('index_bytes', 'index bytes'), ('build_seconds', 'build seconds')]
+    rows += [(k, k) for k in page['retrieval'] if k.startswith('recall@') or k == 'mrr']
+    for key, label in rows:
+        a = page.get(key, page['retrieval'].get(key))
+        b = manual.get(key, manual['retrieval'].get(key))
+        change = f"{(b - a) / a * 100:+9.1f}%" if a else ''
+        print(f"{label:<20}{a:>12.3f}{b:>12.3f}{change:>10}")
+    print(f"Chunks spanning several pages: {manual['spanning_share']:.1%}")
+
+    # Save the results
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'manuals': sorted(tasks),
+        'results': results
+    }
+    output = args.output or RESULTS_DIR / f"chunking_{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f'\n🎉 Results saved to {output}')
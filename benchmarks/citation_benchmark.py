@@ -0,0 +1,132 @@
+"""
+Script: citation_benchmark.py
+
+This script measures what the numbered citations (see classes/prompt_builder.py) save
+compared to the older prompt, in which the model lists the path of every source after an
+end marker.
+
+The stored evaluation questions are answered twice by the configured LLM backend (see
+classes/llm_backend.py), once with each prompt. The answers are streamed (see
+ManualAssistant.stream_events), so that the time to first token is measured when the first
+token arrives, and the full reply of the model, sources listed after the end marker included,
+is counted in tokens with tiktoken. The output tokens, the time to first token and the total
+generation time of every answer are recorded. For each prompt the mean
+and the percentiles are reported, together with the savings of the citations. With the
+citations, the share of answers that cite at least one excerpt is reported as well, since
+uncited answers fall back to listing all retrieved pages.
+
+Usage:
+    python benchmarks/citation_benchmark.py [--manuals NAME ...] [--questions 20]
+
+Side Effects:
+    - Sends every question to the LLM backend twice.
+    - Writes the results as JSON to benchmarks/results/citations_<timestamp>_<commit>.json.
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import statistics
+from datetime import datetime
+from microbenchmarks import RESULTS_DIR, percentiles, git_commit, machine_info
+
+
+def answer_questions(questions, citations: bool, scheduler) -> list[dict]:
+    """
+    Answers the questions with one of the two prompts.
+
+    Args:
+        questions (pd.DataFrame): The evaluation rows of the questions.
+        citations (bool): Whether to use the numbered citations or the older prompt.
+        scheduler (BatchScheduler): The scheduler shared by the assistants.
+
+    Returns:
+        list[dict]: The output tokens, timings and citations of every answer sent to the LLM.
+    """
+    from classes.manual_assistant import ManualAssistant, CITATION, count_tokens
+    answers = []
+    for manual_name, manual_df in questions.groupby('Manual'):
+        assistant = ManualAssistant(manual_name, scheduler=scheduler, citations=citations)
+        for question in manual_df['Question']:
+            # Stream every answer without conversation history
+            forked = assistant.fork()
+            answer = ''
+            for event in forked.stream_events(question):
+                if event['type'] == 'answer_end':
+                    answer = event['text']
+            if not forked.last_trace['counts'].get('llm_called'):
+                continue
+            timing = forked.backend.last_timing
+            # The full reply of the model, including the sources it lists after the end marker
+            reply = forked.messages[-1]['content']
+            answers.append({
+                'manual': manual_name,
+                'output_tokens': count_tokens(reply, forked.model_name),
+                'ttft': timing['ttft'],
+                'total': timing['total'],
+                'cited': bool(CITATION.search(answer))
+            })
+    return answers
+
+
+def summarize(answers: list[dict]) -> dict:
+    """
+    Returns the mean output tokens and the latency percentiles of a list of answers.
+    """
+    return {
+        'answers': len(answers),
+        'mean_output_tokens': statistics.mean(a['output_tokens'] for a in answers),
+        'mean_ttft_ms': statistics.mean(a['ttft'] for a in answers) * 1000,
+        'mean_total_ms': statistics.mean(a['total'] for a in answers) * 1000,
+        'total': percentiles([a['total'] for a in answers]),
+        'cited_share': sum(a['cited'] for a in answers) / len(answers)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Output tokens and latency of cited vs listed sources.')
+    parser.add_argument('--manuals', nargs='+', default=None, help='The manuals to use. Defaults to all evaluated manuals.')
+    parser.add_argument('--questions', type=int, default=20, help='The largest number of questions per manual.')
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    args = parser.parse_args()
+
+    from classes.retrieval_evaluator import RetrievalEvaluator
+    from classes.batch_scheduler import BatchScheduler
+    scheduler = BatchScheduler()
+    questions = RetrievalEvaluator(embedder=scheduler.embedder).load_questions(args.manuals)
+    questions = questions.groupby('Manual').head(args.questions)
+
+    results = {}
+    for name, citations in (('listed_sources', False), ('citations', True)):
+        print(f'🔄️ Answering {len(questions)} questions with {name}...')
+        answers = answer_questions(questions, citations, scheduler)
+        results[name] = summarize(answers) | {'runs': answers}
+    scheduler.close()
+
+    # Print the savings
+    before, after = results['listed_sources'], results['citations']
+    print(f"\n{'':<24}{'listed sources':>16}{'citations':>12}{'change':>10}")
+    for key, label in (('mean_output_tokens', 'output tokens'), ('mean_ttft_ms', 'ttft ms'), ('mean_total_ms', 'total ms')):
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"{label:<24}{before[key]:>16.1f}{after[key]:>12.1f}{change:>9.1f}%")
+    print(f"{'p95 total ms':<24}{before['total']['p95_ms']:>16.1f}{after['total']['p95_ms']:>12.1f}")
+    print(f"Answers citing an excerpt: {after['cited_share']:.0%}")
+
+    # Save the results
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'settings': vars(args) | {'output': str(args.output) if args.output else None},
+        'results': results
+    }
+    output = args.output or RESULTS_DIR / f"citations_{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'\n🎉 Results saved to {output}')
@@ -0,0 +1,302 @@
+"""
+Script: load_test.py
+
+This script measures how many concurrent users one deployment of the assistant can handle, by
+replaying queries against ManualAssistant at a given concurrency and arrival rate.
+
+The queries are read from a query log, a JSON lines file with one {"manual": ..., "query": ...}
+object per line and optionally the arrival time of the query in seconds ("time"), or else taken
+from the questions stored in evaluation/. The LLM is replaced by the local stand-in server (see
+classes/local_llm_server.py), which streams tokens with a configurable time to first token and
+token rate, so that the load on the retrieval side is realistic without any API calls. The
+server runs in the main process, so that its CPU time is not counted for the workers.
+
+Each worker process plays one deployment of the app: it loads the assistants of the manuals
+once, optionally shares a micro-batching scheduler between them (like the app does), and answers
+its share of the queries in a thread pool of --concurrency threads, every query in a fresh
+conversation. Arrivals are:
+    - closed loop (the default): every thread sends its next query as soon as the last one is answered.
+    - open loop (--rate QPS): queries arrive as a Poisson process at the given total rate, or at
+      the times of the query log with --replay-times. Latencies are measured from the arrival
+      of the query, so time spent waiting for a free thread counts.
+
+The throughput, the p50/p95/p99 time to first token and total latency, the errors and the CPU
+time, CPU utilization and peak RSS of every worker are reported and saved, so that runs with
+different settings can be compared with --compare.
+
+Usage:
+    python benchmarks/load_test.py [--queries LOG.jsonl] [--requests 200] [--workers 1] [--concurrency 8]
+                                   [--rate QPS | --replay-times [--speedup 1]] [--batching]
+                                   [--llm-ttft 0.4] [--llm-tokens-per-second 60] [--llm-tokens 120]
+    python benchmarks/load_test.py --compare results/a.json results/b.json
+
+Side Effects:
+    - Writes the results as JSON to benchmarks/results/load_<timestamp>_<commit>.json.
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from microbenchmarks import RESULTS_DIR, percentiles, git_commit, machine_info
+
+
+def load_queries(log_path: Path = None, manuals: list[str] = None) -> list[dict]:
+    """
+    Loads the queries to replay, from a query log or from the stored evaluation questions.
+
+    Args:
+        log_path (Path): A JSON lines file with 'manual', 'query' and optionally 'time' keys.
+        manuals (list[str]): Only keep the queries of these manuals.
+
+    Returns:
+        list[dict]: The queries, with the keys 'manual', 'query' and 'time' (None if unknown).
+    """
+    if log_path is not None:
+        queries = []
+        for line in Path(log_path).read_text(encoding='utf-8').splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                queries.append({'manual': entry['manual'], 'query': entry['query'], 'time': entry.get('time')})
+    else:
+        import joblib
+        queries = []
+        for path in sorted((base_folder / 'evaluation').glob('*.pkl')):
+            df = joblib.load(path)
+            queries.extend({'manual': row['Manual'], 'query': row['Question'], 'time': None} for _, row in df.iterrows())
+    if manuals is not None:
+        queries = [query for query in queries if query['manual'] in set(manuals)]
+    if not queries:
+        raise SystemExit('There are no queries to replay.')
+    return queries
+
+
+def arrival_times(queries: list[dict], requests: int, rate: float, replay_times: bool, speedup: float, seed: int) -> list:
+    """
+    Picks the queries to send and their arrival times.
+
+    Returns:
+        list[tuple[dict, float]]: (query, arrival time in seconds from the start) pairs, or
+            (query, None) pairs for a closed loop.
+    """
+    rng = random.Random(seed)
+    if replay_times:
+        # Keep the order and the spacing of the log
+        timed = sorted((q for q in queries if q['time'] is not None), key=lambda q: q['time'])
+        if not timed:
+            raise SystemExit('The query log has no arrival times.')
+        first = timed[0]['time']
+        return [(q, (q['time'] - first) / speedup) for q in timed[:requests]]
+    picked = [queries[i % len(queries)] for i in range(requests)]
+    rng.shuffle(picked)
+    if not rate:
+        return [(query, None) for query in picked]
+    # A Poisson process: exponentially distributed gaps between arrivals
+    schedule, now = [], 0.0
+    for query in picked:
+        schedule.append((query, now))
+        now += rng.expovariate(rate)
+    return schedule
+
+
+def run_worker(schedule: list, concurrency: int, batching: bool, llm_url: str, barrier) -> dict:
+    """
+    Plays one deployment of the app and answers its share of the queries.
+    This function is run in its own process.
+
+    Args:
+        schedule (list): (query, arrival time) pairs, see arrival_times.
+        concurrency (int): The number of queries answered at a time.
+        batching (bool): Whether the assistants share a micro-batching scheduler.
+        llm_url (str): The base URL of the stand-in LLM server.
+        barrier: A barrier shared by the workers, so that they start together once they are loaded.
+
+    Returns:
+        dict: The result of every query, and the CPU time, wall time and peak RSS of the worker.
+    """
+    from classes.manual_assistant import ManualAssistant
+    from classes.llm_backend import OpenAICompatibleBackend
+    from classes.batch_scheduler import BatchScheduler
+    from classes.resource_usage import cpu_seconds, peak_rss_bytes
+    backend = OpenAICompatibleBackend('local-stand-in', llm_url)
+    scheduler = BatchScheduler() if batching else None
+    # Load the assistants and warm them up outside the measurement
+    assistants = {}
+    for query, _ in schedule:
+        if query['manual'] not in assistants:
+            assistant = ManualAssistant(query['manual'], backend=backend, scheduler=scheduler)
+            for _ in assistant.fork().stream_events(query['query']):
+                pass
+            assistants[query['manual']] = assistant
+
+    results = []
+    lock = threading.Lock()
+
+    def answer(query: dict, arrival: float):
+        # Answer one query in a fresh conversation, timing from its arrival
+        start = time.perf_counter()
+        arrival = start if arrival is None else arrival
+        result = {'manual': query['manual'], 'queue_wait': start - arrival, 'ttft': None, 'error': None}
+        try:
+            for event in assistants[query['manual']].fork().stream_events(query['query']):
+                if event['type'] in ('token', 'answer_end') and result['ttft'] is None:
+                    result['ttft'] = time.perf_counter() - arrival
+                elif event['type'] == 'timings':
+                    result['llm_called'] = bool(event['trace']['counts'].get('llm_called'))
+                    result['output_tokens'] = event['trace']['counts'].get('output_tokens', 0)
+        except Exception as e:
+            result['error'] = repr(e)
+        result['total'] = time.perf_counter() - arrival
+        with lock:
+            results.append(result)
+
+    # Start together with the other workers
+    barrier.wait()
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for query, offset in schedule:
+            if offset is None:
+                executor.submit(answer, query, None)
+                continue
+            # Open loop: submit every query at its arrival time, whether or not a thread is free
+            arrival = wall_start + offset
+            time.sleep(max(0.0, arrival - time.perf_counter()))
+            executor.submit(answer, query, arrival)
+    wall = time.perf_counter() - wall_start
+    cpu = cpu_seconds() - cpu_start
+    if scheduler is not None:
+        scheduler.close()
+    return {
+        'results': results,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'cpu_utilization': cpu / wall if wall else None,
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+
+
+def summarize(workers: list[dict]) -> dict:
+    """
+    Combines the results of the workers into throughput and latency percentiles.
+    """
+    results = [result for worker in workers for result in worker['results']]
+    answered = [result for result in results if result['error'] is None]
+    wall = max(worker['wall_seconds'] for worker in workers)
+    summary = {
+        'requests': len(results),
+        'errors': len(results) - len(answered),
+        'wall_seconds': wall,
+        'throughput_qps': len(answered) / wall if wall else None,
+        'llm_called_share': sum(r.get('llm_called', False) for r in answered) / max(len(answered), 1),
+        'workers': [{k: v for k, v in worker.items() if k != 'results'} for worker in workers]
+    }
+    if answered:
+        summary['ttft'] = percentiles([r['ttft'] for r in answered if r['ttft'] is not None])
+        summary['total'] = percentiles([r['total'] for r in answered])
+        summary['queue_wait'] = percentiles([r['queue_wait'] for r in answered])
+    return summary
+
+
+def print_summary(summary: dict):
+    """
+    Prints the throughput, the latency percentiles and the resource use of the workers.
+    """
+    print(f"\n{summary['requests']} requests, {summary['errors']} errors, {summary['throughput_qps']:.2f} queries/sec")
+    print(f"{'':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for key in ('ttft', 'total', 'queue_wait'):
+        if key in summary:
+            p = summary[key]
+            print(f"{key:<12}{p['p50_ms']:>10.1f}{p['p95_ms']:>10.1f}{p['p99_ms']:>10.1f}")
+    for i, worker in enumerate(summary['workers']):
+        rss = worker['peak_rss_bytes']
+        print(
+            f"worker {i}: {worker['cpu_seconds']:.1f} CPU s, {worker['cpu_utilization']:.0%} of a core, "
+            + (f"peak RSS {rss / 2**20:.0f} MiB" if rss else 'peak RSS unknown')
+        )
+
+
+def compare(path_a: Path, path_b: Path):
+    """
+    Prints the throughput and latency percentiles of two result files side by side.
+    """
+    a, b = (json.loads(Path(path).read_text()) for path in (path_a, path_b))
+    rows = [('throughput_qps', None, 'queries/sec')]
+    rows += [(key, p, f'{key} {p[:3]}') for key in ('ttft', 'total') for p in ('p50_ms', 'p95_ms', 'p99_ms')]
+    print(f"{'':<16}{Path(path_a).stem[:20]:>22}{Path(path_b).stem[:20]:>22}{'change':>10}")
+    for key, p, label in rows:
+        x = a['summary'][key] if p is None else a['summary'][key][p]
+        y = b['summary'][key] if p is None else b['summary'][key][p]
+        print(f"{label:<16}{x:>22.2f}{y:>22.2f}{(y - x) / x * 100 if x else 0.0:>9.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the assistant with replayed queries.')
+    parser.add_argument('--queries', type=Path, default=None, help='A JSON lines query log. Defaults to the evaluation questions.')
+    parser.add_argument('--manuals', nargs='+', default=None, help='Only replay the queries of these manuals.')
+    parser.add_argument('--requests', type=int, default=200, help='The number of queries to send.')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes, each playing one deployment.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Queries answered at a time, over all workers.')
+    parser.add_argument('--rate', type=float, default=None, help='Open loop: the total arrival rate in queries/sec.')
+    parser.add_argument('--replay-times', action='store_true', help='Open loop: replay the arrival times of the query log.')
+    parser.add_argument('--speedup', type=float, default=1.0, help='With --replay-times, replay this many times faster.')
+    parser.add_argument('--batching', action='store_true', help='Share a micro-batching scheduler between the assistants of a worker.')
+    parser.add_argument('--llm-ttft', type=float, default=0.4, help='Time to first token of the stand-in LLM, in seconds.')
+    parser.add_argument('--llm-tokens-per-second', type=float, default=60.0)
+    parser.add_argument('--llm-tokens', type=int, default=120, help='Tokens per reply of the stand-in LLM.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    parser.add_argument('--compare', nargs=2, type=Path, default=None, metavar=('A', 'B'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    from classes.local_llm_server import LocalLLMServer
+    multiprocessing.set_start_method('spawn', force=True)
+    queries = load_queries(args.queries, args.manuals)
+    schedule = arrival_times(queries, args.requests, args.rate, args.replay_times, args.speedup, args.seed)
+    server = LocalLLMServer(
+        port=0, ttft=args.llm_ttft, tokens_per_second=args.llm_tokens_per_second, max_tokens=args.llm_tokens
+    ).start()
+    concurrency = max(1, args.concurrency // args.workers)
+    mode = 'replayed times' if args.replay_times else f'{args.rate} queries/sec' if args.rate else 'closed loop'
+    print(f'🔄️ Sending {len(schedule)} queries ({mode}) to {args.workers} workers x {concurrency} threads...')
+
+    # Deal the queries out to the workers, and start them together once they are loaded
+    shares = [schedule[i::args.workers] for i in range(args.workers)]
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=args.workers) as executor:
+        barrier = manager.Barrier(args.workers)
+        futures = [
+            executor.submit(run_worker, share, concurrency, args.batching, server.base_url, barrier)
+            for share in shares
+        ]
+        workers = [future.result() for future in futures]
+    server.stop()
+    summary = summarize(workers)
+    print_summary(summary)
+
+    # Save the results
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'settings': {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        'summary': summary,
+        'results': [result for worker in workers for result in worker['results']]
+    }
+    output = args.output or RESULTS_DIR / f"load_{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f'\n🎉 Results saved to {output}')
@@ -0,0 +1,293 @@
+"""
+Script: microbenchmarks.py
+
+This script measures the performance of the three hot loops of the pipeline on synthetic
+corpora of different sizes:
+
+1. SemanticChunker.chunk: chunks/sec and pages/sec.
+2. Embedder.encode: embeddings/sec.
+3. VectorDatabase.search_manual: queries/sec and latency percentiles (p50/p95/p99)
+   for single-vector searches, the way the app searches.
+
+Each (benchmark, size) case runs in a fresh process so that the reported peak RSS
+belongs to that case only. The results are stored as JSON in benchmarks/results/,
+together with the git commit and a description of the machine, so that runs can be
+compared across commits on the same machine.
+
+Usage:
+    python benchmarks/microbenchmarks.py
+    python benchmarks/microbenchmarks.py --benchmarks search --sizes 1000 10000
+    python benchmarks/microbenchmarks.py --compare results/a.json results/b.json
+
+Note:
+    Chunking and embedding 1M chunks takes hours on a CPU, so by default the chunker is
+    only run up to 10k chunks and the embedder up to 100k chunks. Use --max-chunker-size
+    and --max-embedder-size to change this.
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# A small vocabulary for synthetic manual-like sentences
+VOCABULARY = (
+    "press hold the power button for seconds to turn on device screen battery charge "
+    "settings menu select option connect bluetooth wireless network volume display "
+    "warning do not expose water heat cable adapter remove cover insert card reset "
+    "factory default update software firmware restart pair headset speaker watch"
+).split()
+
+
+def synthetic_sentence(rng: random.Random) -> str:
+    """
+    Creates a synthetic, manual-like sentence.
+
+    Args:
+        rng (random.Random): The random generator to use.
+
+    Returns:
+        str: A sentence of 8 to 20 words.
+    """
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_page(rng: random.Random, n_sentences: int = 60) -> str:
+    """
+    Creates a synthetic page of text, roughly the size of an OCR:ed manual page.
+    """
+    return " ".join(synthetic_sentence(rng) for _ in range(n_sentences))
+
+
+def percentiles(values: list[float]) -> dict:
+    """
+    Computes latency percentiles in milliseconds.
+
+    Args:
+        values (list[float]): Latencies in seconds.
+
+    Returns:
+        dict: The p50, p95 and p99 latencies and the mean, in milliseconds.
+    """
+    ordered = sorted(values)
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'mean_ms': sum(ordered) / len(ordered) * 1000
+    }
+
+
+def bench_chunker(size: int, seed: int) -> dict:
+    """
+    Chunks synthetic pages until at least size chunks have been produced.
+    """
+    from classes.semantic_chunker import SemanticChunker
+    rng = random.Random(seed)
+    chunker = SemanticChunker()
+    n_chunks = 0
+    n_pages = 0
+    elapsed = 0.0
+    while n_chunks < size:
+        # Generate the page outside the timed region
+        page = synthetic_page(rng)
+        start = time.perf_counter()
+        n_chunks += len(chunker.chunk(page))
+        elapsed += time.perf_counter() - start
+        n_pages += 1
+    return {
+        'chunks': n_chunks,
+        'pages': n_pages,
+        'seconds': elapsed,
+        'chunks_per_sec': n_chunks / elapsed,
+        'pages_per_sec': n_pages / elapsed
+    }
+
+
+def bench_embedder(size: int, seed: int, batch_size: int = 32) -> dict:
+    """
+    Embeds size synthetic chunk-sized records.
+    """
+    from classes.embedder import Embedder
+    rng = random.Random(seed)
+    embedder = Embedder()
+    records = [{'text': synthetic_page(rng, n_sentences=8)} for _ in range(size)]
+    # Warm up the model so that lazy initialization is not measured
+    embedder.encode(records[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    embeddings, _ = embedder.encode(records, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return {
+        'embeddings': len(embeddings),
+        'batch_size': batch_size,
+        'seconds': elapsed,
+        'embeddings_per_sec': len(embeddings) / elapsed
+    }
+
+
+def bench_search(size: int, seed: int, n_queries: int = 1000, dim: int = 384, top_k: int = 5) -> dict:
+    """
+    Fills a VectorDatabase with size random unit vectors and runs single-vector searches.
+    """
+    import numpy as np
+    from classes.vector_database import VectorDatabase
+    rng = np.random.default_rng(seed)
+    vdb = VectorDatabase(dim=dim)
+    # Add the vectors in blocks to keep the temporary memory use down
+    block = 100_000
+    start = time.perf_counter()
+    for offset in range(0, size, block):
+        n = min(block, size - offset)
+        vectors = rng.standard_normal((n, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        records = [
+            {'manual': 'synthetic', 'path': f'page_{(offset + i) // 4}.jpg', 'chunk': (offset + i) % 4, 'text': f'chunk {offset + i}'}
+            for i in range(n)
+        ]
+        vdb.add(vectors, records)
+    build_seconds = time.perf_counter() - start
+    queries = rng.standard_normal((n_queries, dim), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    # Time each query on its own, the way the app searches
+    latencies = []
+    for i in range(n_queries):
+        start = time.perf_counter()
+        vdb.search_manual(queries[i:i + 1], top_k=top_k)
+        latencies.append(time.perf_counter() - start)
+    return {
+        'vectors': size,
+        'queries': n_queries,
+        'top_k': top_k,
+        'build_seconds': build_seconds,
+        'qps': n_queries / sum(latencies),
+        **percentiles(latencies)
+    }
+
+
+BENCHMARKS = {
+    'chunker': bench_chunker,
+    'embedder': bench_embedder,
+    'search': bench_search
+}
+
+
+def run_case(name: str, size: int, seed: int) -> dict:
+    """
+    Runs a single benchmark case and adds the peak RSS of the process to the result.
+    This function is run in a fresh worker process.
+    """
+    from classes.resource_usage import peak_rss_bytes
+    result = BENCHMARKS[name](size, seed)
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    return result
+
+
+def git_commit() -> str:
+    """
+    Returns the current git commit hash, or 'unknown' if it cannot be determined.
+    """
+    try:
+        output = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=base_folder, capture_output=True, text=True, check=True
+        )
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def machine_info() -> dict:
+    """
+    Returns a description of the machine, used to decide whether runs are comparable.
+    """
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'python': platform.python_version()
+    }
+
+
+def compare(path_a: Path, path_b: Path):
+    """
+    Prints the relative change of the throughput metrics between two result files.
+    """
+    a = json.loads(Path(path_a).read_text())
+    b = json.loads(Path(path_b).read_text())
+    if a['machine'] != b['machine']:
+        print('⚠️ The runs were made on different machines and may not be comparable.')
+    print(f"{'case':<22}{'metric':<22}{a['commit']:>14}{b['commit']:>14}{'change':>10}")
+    for case, result_a in a['results'].items():
+        result_b = b['results'].get(case)
+        if not result_b or 'error' in result_a or 'error' in result_b:
+            continue
+        for metric in ('chunks_per_sec', 'embeddings_per_sec', 'qps', 'p50_ms', 'p99_ms', 'peak_rss_bytes'):
+            if metric in result_a and metric in result_b and result_a[metric]:
+                change = (result_b[metric] - result_a[metric]) / result_a[metric] * 100
+                print(f"{case:<22}{metric:<22}{result_a[metric]:>14.1f}{result_b[metric]:>14.1f}{change:>+9.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the chunker, embedder and vector search.')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--max-chunker-size', type=int, default=10_000)
+    parser.add_argument('--max-embedder-size', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files instead of running the benchmarks.')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    limits = {'chunker': args.max_chunker_size, 'embedder': args.max_embedder_size}
+    commit = git_commit()
+    results = {}
+    # Run each case in a fresh spawned process, one at a time
+    multiprocessing.set_start_method('spawn', force=True)
+    for name in args.benchmarks:
+        for size in args.sizes:
+            case = f'{name}_{size}'
+            if size > limits.get(name, size):
+                results[case] = {'skipped': f'size exceeds --max-{name}-size'}
+                continue
+            print(f'🔄️ Running {case}...')
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    results[case] = executor.submit(run_case, name, size, args.seed).result()
+            except Exception as e:
+                results[case] = {'error': repr(e)}
+            print(f'   {results[case]}')
+
+    # Save the results
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'seed': args.seed,
+        'results': results
+    }
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'\n🎉 Results saved to {output}')
@@ -0,0 +1,174 @@
+"""
+Script: scheduling_benchmark.py
+
+This script measures the throughput gain of sizing the build's process pools and thread counts
+with a ResourcePlan (see classes/resource_plan.py) over the previous defaults.
+
+Two stages of the phased build are run, each with both configurations:
+
+1. Embedding: synthetic chunk-sized records, split into --manuals manuals, are embedded by a
+   process pool with one task per manual, like DbCreator does. The default configuration is
+   the previous fixed pool of 4 processes, each using torch's default number of threads.
+2. OCR and chunking (with --pages N): the first N page images of the manuals in docs/ are
+   processed like RecordCreator does. The default configuration is a pool with one process per
+   core and Tesseract's default number of OpenMP threads.
+
+Each configuration runs --runs times, in a fresh pool every time, and the median throughput is
+reported. Pool startup and model loading are included, as they are part of every build.
+
+Usage:
+    python benchmarks/scheduling_benchmark.py [--records 4000] [--manuals 8] [--pages 0] [--runs 3]
+                                              [--cores N] [--embed-workers N] [--embed-threads N]
+
+Side Effects:
+    - Writes the results as JSON to benchmarks/results/scheduling_<timestamp>_<commit>.json.
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import multiprocessing
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from microbenchmarks import RESULTS_DIR, git_commit, machine_info, synthetic_page
+
+
+def embed_manual(texts: list[str]) -> int:
+    """
+    Embeds the records of one manual. This function is run in a worker process.
+
+    Returns:
+        int: The number of embedded records.
+    """
+    from classes.embedder import Embedder
+    embeddings, _ = Embedder().encode([{'text': text} for text in texts])
+    return len(embeddings)
+
+
+def run_pool(function, items: list, workers: int, threads: int = None) -> float:
+    """
+    Runs function over items in a fresh process pool.
+
+    Args:
+        function: The function to run in the worker processes.
+        items (list): The arguments, one per task.
+        workers (int): The number of processes, or None for one per core.
+        threads (int): The threads per process (see resource_plan.limit_threads), or None for the library defaults.
+
+    Returns:
+        float: The wall time in seconds.
+    """
+    from classes.resource_plan import limit_threads
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_threads, initargs=(threads,)) as executor:
+        list(executor.map(function, items))
+    return time.perf_counter() - start
+
+
+def compare_configurations(name: str, function, items: list, n_items: int, configurations: dict, runs: int) -> dict:
+    """
+    Runs every configuration runs times and reports the median throughput.
+
+    Args:
+        name (str): The name of the stage, used in the output.
+        function: The function to run in the worker processes.
+        items (list): The arguments, one per task.
+        n_items (int): The number of items (records or pages) processed in total.
+        configurations (dict): Maps configuration names to (workers, threads) tuples.
+        runs (int): The number of runs per configuration.
+
+    Returns:
+        dict: Maps configuration names to their workers, threads, run times and median throughput.
+    """
+    results = {}
+    for label, (workers, threads) in configurations.items():
+        seconds = []
+        for run in range(runs):
+            seconds.append(run_pool(function, items, workers, threads))
+            print(f'   {name} {label} run {run + 1}: {seconds[-1]:.2f}s')
+        median = statistics.median(seconds)
+        results[label] = {
+            'workers': workers,
+            'threads': threads,
+            'seconds': seconds,
+            'median_seconds': median,
+            'items_per_sec': n_items / median
+        }
+    results['speedup'] = results['default']['median_seconds'] / results['planned']['median_seconds']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resource-planned vs default build pools.')
+    parser.add_argument('--records', type=int, default=4000, help='Synthetic records to embed.')
+    parser.add_argument('--manuals', type=int, default=8, help='The number of manuals the records are split into.')
+    parser.add_argument('--pages', type=int, default=0, help='Page images from docs/ to OCR. 0 skips the OCR stage.')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--embed-workers', type=int, default=None)
+    parser.add_argument('--embed-threads', type=int, default=None)
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    args = parser.parse_args()
+
+    from classes.resource_plan import ResourcePlan
+    multiprocessing.set_start_method('spawn', force=True)
+    plan = ResourcePlan(
+        'phased', cores=args.cores, embed_workers=args.embed_workers, embed_threads=args.embed_threads
+    )
+    print(f'⚙️ {plan}')
+    results = {}
+
+    # Embedding, one task per manual
+    rng = random.Random(args.seed)
+    texts = [synthetic_page(rng, n_sentences=8) for _ in range(args.records)]
+    manuals = [texts[i::args.manuals] for i in range(args.manuals)]
+    print(f'🔄️ Embedding {len(texts)} records in {len(manuals)} manuals...')
+    results['embed'] = compare_configurations(
+        'embed', embed_manual, manuals, len(texts),
+        {'default': (4, None), 'planned': (min(plan.embed_workers, len(manuals)), plan.embed_threads)},
+        args.runs
+    )
+
+    # OCR and chunking, one task per page
+    if args.pages:
+        from classes.task_generator import TaskGenerator
+        from classes.record_creator import _process_page_star
+        tasks = TaskGenerator(base_folder / 'docs').get_tasks()
+        pages = [(task, path, page) for task in tasks for page, path in enumerate(tasks[task])][:args.pages]
+        print(f'🔄️ Processing {len(pages)} pages...')
+        results['ocr'] = compare_configurations(
+            'ocr', _process_page_star, pages, len(pages),
+            {'default': (None, None), 'planned': (plan.ocr_workers, plan.ocr_threads)},
+            args.runs
+        )
+
+    # Print the comparison
+    print(f"\n{'':<8}{'default/s':>12}{'planned/s':>12}{'speedup':>10}")
+    for stage, result in results.items():
+        print(f"{stage:<8}{result['default']['items_per_sec']:>12.1f}{result['planned']['items_per_sec']:>12.1f}{result['speedup']:>9.2f}x")
+
+    # Save the results
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'plan': plan.to_dict(),
+        'records': args.records,
+        'manuals': args.manuals,
+        'pages': args.pages,
+        'results': results
+    }
+    output = args.output or RESULTS_DIR / f"scheduling_{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f'\n🎉 Results saved to {output}')
@@ -0,0 +1,124 @@
+"""
+Script: startup_benchmark.py
+
+This script measures the cold start of the assistant, so that cold-start regressions can be
+tracked across commits:
+
+1. The import time of the app's own modules and of each heavy module (torch,
+   sentence_transformers, faiss, openai).
+2. The warmup stages: loading the embedder and the first forward pass.
+3. The time to the first answer of a ManualAssistant, from the start of the process, using the
+   local stand-in LLM so that no network calls are made.
+
+Every run takes place in a fresh process, and the median over the runs is reported. The
+results are stored as JSON in benchmarks/results/, like those of microbenchmarks.py.
+
+Usage:
+    python benchmarks/startup_benchmark.py --manual NAME [--runs 5]
+    python benchmarks/startup_benchmark.py --compare results/a.json results/b.json
+"""
+
+# Perform necessary imports
+import sys
+from pathlib import Path
+base_folder = Path(__file__).resolve().parent.parent
+sys.path.append(str(base_folder))
+
+import argparse
+import json
+import multiprocessing
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from microbenchmarks import RESULTS_DIR, git_commit, machine_info
+
+
+def cold_start(manual_name: str) -> dict:
+    """
+    Starts the assistant the way the app does and answers one question.
+    This function is run in a fresh worker process.
+
+    Returns:
+        dict: The startup profile, flattened to {'<kind>:<name>': seconds}.
+    """
+    from classes.startup_profile import StartupProfile
+    import time
+    profile = StartupProfile(start=time.perf_counter())
+    # The modules the app imports before rendering its first page
+    for name in ('classes.manual_assistant', 'classes.warmup'):
+        profile.import_module(name)
+    profile.mark('first_render')
+    # The warmup, run in the foreground
+    from classes.warmup import Warmup
+    warmup = Warmup(profile).start()
+    warmup.done.wait()
+    if warmup.error is not None:
+        raise warmup.error
+    # The first answer
+    from classes.manual_assistant import ManualAssistant
+    from classes.llm_backend import LocalBackend
+    assistant = ManualAssistant(manual_name, backend=LocalBackend(ttft=0.0, tokens_per_second=1e6), scheduler=warmup.scheduler())
+    assistant.send_user_query('How do I turn the device on?')
+    profile.mark('first_answer')
+    warmup.scheduler().close()
+    result = profile.to_dict()
+    return {f'{kind}:{name}': seconds for kind, values in result.items() for name, seconds in values.items()}
+
+
+def compare(path_a: Path, path_b: Path):
+    """
+    Prints the change of each startup time between two result files.
+    """
+    a = json.loads(Path(path_a).read_text())
+    b = json.loads(Path(path_b).read_text())
+    if a['machine'] != b['machine']:
+        print('⚠️ The runs were made on different machines and may not be comparable.')
+    print(f"{'timing':<44}{a['commit']:>12}{b['commit']:>12}{'change':>10}")
+    for name, seconds_a in a['median_seconds'].items():
+        seconds_b = b['median_seconds'].get(name)
+        if seconds_b is None:
+            continue
+        change = f"{(seconds_b - seconds_a) / seconds_a * 100:+9.1f}%" if seconds_a else ''
+        print(f"{name:<44}{seconds_a:>12.3f}{seconds_b:>12.3f}{change:>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold-start profile of the assistant.')
+    parser.add_argument('--manual', type=str, default=None, help='The manual to answer a question about.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', type=Path, default=None, help='Where to write the JSON results.')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files instead of running the benchmark.')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    if args.manual is None:
+        parser.error('--manual is required unless --compare is given.')
+
+    # Run each cold start in a fresh spawned process, one at a time
+    multiprocessing.set_start_method('spawn', force=True)
+    runs = []
+    for run in range(args.runs):
+        print(f'🔄️ Cold start {run + 1}/{args.runs}...')
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            runs.append(executor.submit(cold_start, args.manual).result())
+    medians = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+    for name, seconds in medians.items():
+        print(f'   {name:<44}{seconds:.3f} s')
+
+    # Save the results
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'manual': args.manual,
+        'median_seconds': medians,
+        'runs': runs
+    }
+    output = args.output or RESULTS_DIR / f"startup_{datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'\n🎉 Results saved to {output}')
@@ -0,0 +1,168 @@
+"""
+This module provides the BatchScheduler class, which micro-batches concurrent query embedding
+and vector search requests.
+
+With many simultaneous users, every assistant embeds a single question and searches a single
+vector, which leaves most of the CPU idle: a forward pass over one sentence costs almost as
+much as one over a few dozen, and faiss searches many queries at once far more efficiently than
+one at a time. The scheduler lets the callers wait while it collects requests for at most
+max_latency seconds, or until max_batch_size requests have arrived, and then runs them as one
+batched forward pass, and one batched faiss search per index. The results are handed back to
+the waiting callers.
+
+A single caller pays at most max_latency extra; under load, throughput grows with the batch size.
+"""
+
+# Perform necessary imports
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from .embedder import Embedder
+from .metrics import METRICS
+
+
+class BatchScheduler:
+    """
+    Collects concurrent embedding and search requests and runs them in batches.
+
+    Requests are submitted from any thread with embed and search, which block until the
+    result is ready. Embedding and search requests are batched by two separate worker threads.
+
+    Attributes:
+        embedder (Embedder): The embedder used for the queries.
+        max_latency (float): The longest time, in seconds, a request waits for others to join its batch.
+        max_batch_size (int): The largest number of requests in a batch.
+    """
+    def __init__(self, embedder: Embedder = None, max_latency: float = 0.005, max_batch_size: int = 32):
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be greater than 0.")
+        self.embedder = embedder or Embedder()
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self._queues = {'embed': queue.Queue(), 'search': queue.Queue()}
+        self._threads = [
+            threading.Thread(target=self._run, args=('embed', self._embed_batch), daemon=True, name='batch-embed'),
+            threading.Thread(target=self._run, args=('search', self._search_batch), daemon=True, name='batch-search')
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embeds a query, batched with the queries submitted at about the same time.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            np.ndarray: A float32 array of shape (1, dim).
+        """
+        return self._submit('embed', text)
+
+    def search(self, vector_db, query_embedding: np.ndarray, top_k: int = 5, max_distance: float = None) -> list[dict]:
+        """
+        Searches a vector database, batched with the searches of the same database submitted
+        at about the same time.
+
+        Args:
+            vector_db (VectorDatabase): The vector database to search.
+            query_embedding (np.ndarray): The query embedding, of shape (1, dim).
+            top_k (int): The number of records to return.
+            max_distance (float): If given, hits farther from the query are dropped.
+
+        Returns:
+            list[dict]: The records, closest first (see VectorDatabase.search_manual).
+        """
+        if top_k <= 0:
+            raise ValueError("top_k must be greater than 0.")
+        return self._submit('search', (vector_db, query_embedding, top_k, max_distance))
+
+    def close(self):
+        """
+        Stops the worker threads once the submitted requests have been processed.
+        """
+        for request_queue in self._queues.values():
+            request_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _submit(self, kind: str, payload):
+        # Queue the request and wait for the worker to resolve its future
+        future = Future()
+        self._queues[kind].put((payload, future))
+        return future.result()
+
+    def _collect(self, request_queue: queue.Queue) -> tuple:
+        """
+        Waits for a request, then collects more until the batch is full or max_latency has
+        passed since the first one arrived.
+
+        Returns:
+            tuple[list, bool]: The collected (payload, future) pairs, and whether the
+                scheduler was closed.
+        """
+        first = request_queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = request_queue.get(timeout=remaining) if remaining > 0 else request_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self, kind: str, process):
+        """
+        The loop of a worker thread: collects batches and processes them until closed.
+        """
+        closed = False
+        while not closed:
+            batch, closed = self._collect(self._queues[kind])
+            if not batch:
+                continue
+            METRICS.inc('manual_assistant_batches_total', help='Number of micro-batches run.', kind=kind)
+            METRICS.inc('manual_assistant_batched_requests_total', len(batch),
+                        help='Number of requests run in micro-batches.', kind=kind)
+            payloads = [payload for payload, _ in batch]
+            try:
+                results = process(payloads)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _embed_batch(self, texts: list[str]) -> list[np.ndarray]:
+        # Embed all queries in a single forward pass
+        embeddings, _ = self.embedder.encode([{'text': text} for text in texts], batch_size=len(texts))
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        return [embeddings[i:i + 1] for i in range(len(texts))]
+
+    def _search_batch(self, requests: list[tuple]) -> list[list[dict]]:
+        # Group the requests by vector database and run one search per database,
+        # with the largest top_k of the group
+        results = [None] * len(requests)
+        groups = {}
+        for i, (vector_db, _, _, _) in enumerate(requests):
+            groups.setdefault(id(vector_db), []).append(i)
+        for positions in groups.values():
+            vector_db = requests[positions[0]][0]
+            queries = np.concatenate([requests[i][1] for i in positions]).astype(np.float32, copy=False)
+            top_k = max(requests[i][2] for i in positions)
+            hits = vector_db.search_manual(queries, top_k=top_k)
+            # Apply the top_k and max_distance of each request to its own hits
+            for i, query_hits in zip(positions, hits):
+                _, _, request_top_k, max_distance = requests[i]
+                if max_distance is not None:
+                    query_hits = [hit for hit in query_hits if hit['distance'] <= max_distance]
+                results[i] = query_hits[:request_top_k]
+        return results
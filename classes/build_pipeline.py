@@ -0,0 +1,423 @@
+"""
+This module provides a streaming build pipeline for the vector databases.
+
+Instead of running OCR and chunking for all manuals, storing all records and then embedding
+everything, the stages are overlapped:
+
+    OCR + chunking (process pool) -> embedding (process) -> index writing (thread)
+
+The stages are connected by bounded queues. When a queue is full, the stage feeding it
+blocks, so memory use is bounded by the queue sizes rather than by the size of the corpus.
+Pages are fed manual by manual, and a manual's vector database (and its records in the
+record store) is written as soon as the last of its pages has been embedded. Near-identical
+chunks can optionally be collapsed as the pages of a manual come out of OCR, so that duplicates
+are never embedded (see deduplicator.StreamingDeduplicator); they are still written to the
+record store, and the kept chunk stands for them in the vector database. Pages
+in other than the target languages can be skipped or routed to separate manuals before they
+are chunked and embedded (see record_creator.py). The representative vectors of every
+written manual are collected into the manual routing index (see manual_router.py), which
+is saved as router.pkl in the output folder when all manuals have been written. Manuals already
+in a saved router.pkl, but not built in this run, are kept.
+
+With chunking='manual', the OCR workers only extract the text of the pages. When all pages
+of a manual have been extracted, the manual is chunked as one text in a worker process (see
+record_creator._chunk_manual), so that chunks may cross page breaks, and its chunks are
+passed on to the embedder together.
+
+With a BuildProfile (see build_profile.py), the time, CPU time, item counts, IPC bytes and
+peak RSS of every stage (OCR, language detection, spaCy, tiktoken, pickling, embedding, index
+writing, ...) are recorded in all processes, per manual. The time the main process spends
+blocked on a full embedding queue is recorded as 'backpressure', and the time the embedder
+waits for pages as 'embed_idle'.
+
+The number of OCR processes and the threads of the OCR and embedding processes are taken from
+a ResourcePlan (see resource_plan.py), which gives the embedder a share of the cores and the
+OCR processes the rest, instead of letting every process claim all cores for its threads.
+
+With layout=True, the OCR workers capture the word and line boxes of the pages and every record
+carries the region of its chunk (see record_creator.py and page_layout.py).
+"""
+
+# Perform necessary imports
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from pathlib import Path
+import joblib
+import numpy as np
+from tqdm import tqdm
+from .record_creator import _process_page_star, _extract_page_star, _chunk_manual
+from .record_store import RecordStore
+from .deduplicator import StreamingDeduplicator
+from .vector_database import VectorDatabase
+from .manual_router import ManualRouter
+from . import build_profile
+from .build_profile import BuildProfile, profiled_call, stage
+from .resource_plan import ResourcePlan, limit_threads
+
+def _embed_worker(in_queue, out_queue, batch_size: int, profile_queue=None, cprofile_dir: str = None, threads: int = None):
+    """
+    Embeds the records of pages read from in_queue and puts them on out_queue.
+
+    Pages are taken from the queue until at least batch_size records have been collected
+    (or the queue is empty), so that the model runs on reasonably sized batches even
+    though most pages only hold a few chunks. Runs in its own process.
+
+    Args:
+        in_queue: A queue of (manual, page, records) tuples, ended by None.
+        out_queue: A queue receiving (manual, page, records, embeddings) tuples, ended by None.
+        batch_size (int): The number of records to aim for per batch.
+        profile_queue: If given, profiling is enabled and the stage records of the worker are
+            put on this queue before the end of out_queue.
+        cprofile_dir (str): If given, the folder the cProfile output of the worker is written to.
+        threads (int): The number of threads of the embedding model. None leaves them unlimited.
+    """
+    # Limit the threads before torch is imported
+    limit_threads(threads)
+    from .embedder import Embedder
+    import queue
+    import time
+    if profile_queue is not None:
+        build_profile.enable('embed')
+        if cprofile_dir:
+            build_profile.start_cprofile()
+    with stage('embedder_init'):
+        embedder = Embedder()
+    done = False
+    while not done:
+        # Block for the first page, then collect more pages without blocking
+        with stage('embed_idle', items=0):
+            pages = [in_queue.get()]
+        while pages[-1] is not None and sum(len(p[2]) for p in pages) < batch_size:
+            try:
+                pages.append(in_queue.get_nowait())
+            except queue.Empty:
+                break
+        if pages[-1] is None:
+            pages.pop()
+            done = True
+        records = [record for _, _, page_records in pages for record in page_records]
+        start_wall, start_cpu = time.perf_counter(), build_profile._process_cpu()
+        if records:
+            embeddings, _ = embedder.encode(records, batch_size=batch_size)
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        # Attribute the time of the batch to the manuals of its records
+        wall, cpu = time.perf_counter() - start_wall, build_profile._process_cpu() - start_cpu
+        for manual, _, page_records in pages:
+            share = len(page_records) / len(records) if records else 0.0
+            build_profile.record('embed', wall * share, cpu * share, len(page_records), manual=manual)
+        # Split the embeddings per page and pass them on
+        offset = 0
+        for manual, page, page_records in pages:
+            item = (manual, page, page_records, embeddings[offset:offset + len(page_records)])
+            build_profile.measure_ipc('ipc_to_writer', item, manual)
+            out_queue.put(item)
+            offset += len(page_records)
+    if profile_queue is not None:
+        if cprofile_dir:
+            build_profile.stop_cprofile(cprofile_dir)
+        profile_queue.put(build_profile.snapshot())
+    out_queue.put(None)
+
+
+class StreamingBuildPipeline:
+    """
+    Builds the vector databases with overlapping OCR, embedding and index writing stages.
+
+    Attributes:
+        tasks (dict): Maps manual names to lists of page paths (see task_generator.py).
+        output_dir (Path): The folder the vector databases are written to.
+        store (RecordStore): The record store the records are written to.
+        ocr_workers (int): The number of OCR and chunking processes.
+        plan (ResourcePlan): Sizes the OCR pool and the threads of the OCR and embedding processes.
+        queue_size (int): The maximum number of pages waiting between two stages.
+        batch_size (int): The number of records to aim for per embedding batch.
+        dim (int): The dimension of the embeddings.
+        dedup_threshold (float): The similarity at which chunks are collapsed, or None to keep all chunks.
+        dedup_reports (dict): Maps manual names to deduplication reports.
+        languages (tuple): The target language codes, or None to keep all languages.
+        route_languages (bool): Whether pages in other languages are written to separate
+            manuals ('<manual>__<language>') instead of being skipped.
+        router (ManualRouter): The manual routing index.
+        chunking (str): 'page' to chunk every page on its own, or 'manual' to chunk the pages
+            of a manual in order as one text.
+        profile (BuildProfile): The profile the stages are recorded in, or None to build
+            without profiling.
+        layout (bool): Whether to store the region of every chunk on its page(s) with its record.
+    """
+    def __init__(
+        self,
+        tasks: dict,
+        output_dir: Path,
+        store: RecordStore = None,
+        ocr_workers: int = None,
+        queue_size: int = 64,
+        batch_size: int = 64,
+        dim: int = 384,
+        dedup_threshold: float = None,
+        languages: tuple = None,
+        route_languages: bool = False,
+        chunking: str = 'page',
+        profile: BuildProfile = None,
+        plan: ResourcePlan = None,
+        layout: bool = False
+    ):
+        if chunking not in ('page', 'manual'):
+            raise ValueError(f"Unknown chunking mode {chunking}. Use 'page' or 'manual'.")
+        self.tasks = tasks
+        self.output_dir = Path(output_dir)
+        self.store = store or RecordStore(self.output_dir / 'records.sqlite')
+        self.plan = plan or ResourcePlan('streaming', ocr_workers=ocr_workers)
+        self.ocr_workers = ocr_workers or self.plan.ocr_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.dim = dim
+        self.dedup_threshold = dedup_threshold
+        self.dedup_reports = {}
+        # The deduplicators of the manuals being built, by manual name
+        self._deduplicators = {}
+        self.languages = tuple(languages) if languages is not None else None
+        self.route_languages = route_languages
+        self.router = ManualRouter(dim=dim)
+        self.chunking = chunking
+        self.profile = profile
+        self.layout = layout
+
+    def _write_manual(self, manual: str, pages: dict):
+        """
+        Writes the vector database and the records of a finished manual, and those
+        of the manuals its pages in other languages were routed to.
+
+        Args:
+            manual (str): The name of the manual.
+            pages (dict): Maps page numbers to (records, embeddings) tuples.
+        """
+        # Group the records by the manual they were assigned to
+        manuals = {manual: ([], [])}
+        for page in sorted(pages):
+            page_records, page_embeddings = pages[page]
+            names = dict.fromkeys(record['manual'] for record in page_records)
+            for name in names:
+                positions = [i for i, record in enumerate(page_records) if record['manual'] == name]
+                records, embeddings = manuals.setdefault(name, ([], []))
+                records.extend(page_records[i] for i in positions)
+                embeddings.append(page_embeddings[positions])
+        for name, (records, embeddings) in manuals.items():
+            self._write_index(name, records, embeddings)
+
+    def _write_index(self, manual: str, records: list[dict], embeddings: list[np.ndarray]):
+        """
+        Writes the records of a manual to the record store and its vector database to disk.
+
+        Args:
+            manual (str): The name of the manual.
+            records (list[dict]): The records, in page order.
+            embeddings (list[np.ndarray]): The embeddings of the records, one array per page.
+        """
+        # The records dropped as duplicates before embedding are stored as well
+        deduplicator = self._deduplicators.pop(manual, None)
+        stored = records + deduplicator.dropped if deduplicator is not None else records
+        with stage('record_store', items=len(stored), manual=manual):
+            self.store.add_records(stored)
+        if deduplicator is not None:
+            # Let the kept records stand for their duplicates
+            deduplicator.apply(records)
+            self.dedup_reports[manual] = deduplicator.report()
+        vdb = VectorDatabase(dim=self.dim)
+        if records:
+            embeddings = np.concatenate(embeddings)
+            with stage('index_add', items=len(records), manual=manual):
+                vdb.add(np.ascontiguousarray(embeddings, dtype=np.float32), records)
+                self.router.add_manual(manual, embeddings)
+        manual_dir = self.output_dir / manual
+        manual_dir.mkdir(parents=True, exist_ok=True)
+        with stage('index_write', manual=manual):
+            joblib.dump(vdb, manual_dir / 'vdb.pkl')
+        if manual in self.dedup_reports:
+            self.dedup_reports[manual]['index_bytes'] = (manual_dir / 'vdb.pkl').stat().st_size
+
+    def _writer(self, out_queue, progress: tqdm, errors: list):
+        """
+        Collects embedded pages and writes each manual when all of its pages have arrived
+        (or, with manual chunking, when its chunks have arrived). Runs in a thread of the
+        main process.
+        """
+        remaining = {
+            manual: 1 if self.chunking == 'manual' else len(paths)
+            for manual, paths in self.tasks.items()
+        }
+        pending = {}
+        while True:
+            item = out_queue.get()
+            if item is None:
+                break
+            # After an error, keep draining the queue so that the upstream
+            # stages never block on a full queue
+            if errors:
+                continue
+            try:
+                manual, page, records, embeddings = item
+                pending.setdefault(manual, {})[page] = (records, embeddings)
+                remaining[manual] -= 1
+                if remaining[manual] == 0:
+                    self._write_manual(manual, pending.pop(manual))
+                    progress.update(1)
+            except Exception as e:
+                errors.append(e)
+
+    def _deduplicate(self, manual: str, records: list[dict]) -> list[dict]:
+        """
+        Drops the records that duplicate records of the same manual kept earlier, before they
+        are embedded. Records routed to other manuals are compared within those manuals.
+
+        Args:
+            manual (str): The name of the manual the records were extracted for.
+            records (list[dict]): The records of a page (or of a whole manual).
+
+        Returns:
+            list[dict]: The kept records.
+        """
+        if self.dedup_threshold is None:
+            return records
+        with stage('dedup', items=len(records), manual=manual):
+            return [
+                record for record in records
+                if self._deduplicators.setdefault(
+                    record['manual'], StreamingDeduplicator(threshold=self.dedup_threshold)
+                ).keep(record)
+            ]
+
+    @staticmethod
+    def _put(target_queue, item, consumer):
+        """
+        Puts an item on a bounded queue, blocking while it is full, but raises if the
+        consuming process has died so that the pipeline never hangs.
+        """
+        import queue
+        while True:
+            try:
+                target_queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                if not consumer.is_alive():
+                    raise RuntimeError("The embedding process stopped unexpectedly.")
+
+    def _submit(self, executor, func, args, role: str, manual: str):
+        # Submit a worker task, through profiled_call if profiling
+        if self.profile is None:
+            return executor.submit(func, args)
+        cprofile_dir = str(self.profile.cprofile_dir) if self.profile.cprofile_dir else None
+        return executor.submit(profiled_call, func, args, role, manual, cprofile_dir)
+
+    def _result(self, future):
+        # The result of a worker task, merging its stage records if profiling
+        if self.profile is None:
+            return future.result()
+        result, records = future.result()
+        self.profile.merge(records)
+        return result
+
+    def run(self) -> "StreamingBuildPipeline":
+        """
+        Runs the pipeline until all manuals have been written.
+
+        Returns:
+            StreamingBuildPipeline: The instance itself, to allow for method chaining.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Merge with the saved routing index, so that manuals not built now are kept
+        router_path = self.output_dir / 'router.pkl'
+        self.router = ManualRouter.load(router_path) or self.router
+        ctx = multiprocessing.get_context('spawn')
+        embed_queue = ctx.Queue(maxsize=self.queue_size)
+        out_queue = ctx.Queue(maxsize=self.queue_size)
+        profile_queue = ctx.Queue() if self.profile is not None else None
+        cprofile_dir = str(self.profile.cprofile_dir) if self.profile is not None and self.profile.cprofile_dir else None
+        embedder = ctx.Process(
+            target=_embed_worker,
+            args=(embed_queue, out_queue, self.batch_size, profile_queue, cprofile_dir, self.plan.embed_threads),
+            daemon=True
+        )
+        embedder.start()
+
+        errors = []
+        progress = tqdm(total=len(self.tasks), desc='Manuals')
+        writer = threading.Thread(target=self._writer, args=(out_queue, progress, errors), daemon=True)
+        writer.start()
+
+        # Manuals without pages are written right away
+        for manual, paths in self.tasks.items():
+            if not paths:
+                self._write_manual(manual, {})
+                progress.update(1)
+
+        all_args = [(task, path, page) for task in self.tasks for page, path in enumerate(self.tasks[task])]
+        process = partial(
+            _process_page_star if self.chunking == 'page' else _extract_page_star,
+            languages=self.languages,
+            route_languages=self.route_languages,
+            layout=self.layout
+        )
+        max_in_flight = self.ocr_workers * 2
+        # The extracted pages of each manual, with manual chunking
+        extracted = {}
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.ocr_workers,
+                mp_context=ctx,
+                initializer=limit_threads,
+                initargs=(self.plan.ocr_threads,)
+            ) as executor:
+                in_flight = {}
+
+                def forward(done):
+                    # Pass finished pages on to the embedder. put blocks while the
+                    # embedding queue is full, which stops new OCR tasks from being submitted.
+                    for future in done:
+                        task, path, page = in_flight.pop(future)
+                        if self.chunking == 'page' or path is None:
+                            # A chunked page, or all chunks of a manual (page 0)
+                            item = (task, page or 0, self._deduplicate(task, self._result(future)))
+                            build_profile.measure_ipc('ipc_to_embedder', item, task)
+                            with stage('backpressure', items=0, manual=task):
+                                self._put(embed_queue, item, embedder)
+                            continue
+                        # An extracted page. Chunk the manual once all of its pages are in.
+                        pages = extracted.setdefault(task, {})
+                        pages[page] = self._result(future)
+                        if len(pages) == len(self.tasks[task]):
+                            pages = extracted.pop(task)
+                            future = self._submit(executor, _chunk_manual, [pages[p] for p in sorted(pages)], 'chunk', task)
+                            in_flight[future] = (task, None, None)
+
+                # Submit the pages in manual order, keeping a bounded number in flight
+                for args in all_args:
+                    if errors:
+                        raise errors[0]
+                    if len(in_flight) >= max_in_flight:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        forward(done)
+                    in_flight[self._submit(executor, process, args, 'page' if self.chunking == 'page' else 'extract', args[0])] = args
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    forward(done)
+            self._put(embed_queue, None, embedder)
+            # Wait for the writer, but do not hang if the embedder has crashed
+            while writer.is_alive():
+                writer.join(timeout=1.0)
+                if writer.is_alive() and embedder.exitcode not in (None, 0):
+                    raise RuntimeError("The embedding process stopped unexpectedly.")
+            # The stage records of the embedder are put on the queue before the end of its output
+            if profile_queue is not None:
+                self.profile.merge(profile_queue.get(timeout=60))
+            embedder.join()
+            if errors:
+                raise errors[0]
+            self.router.save(router_path)
+        finally:
+            progress.close()
+            if embedder.is_alive():
+                embedder.terminate()
+        return self
@@ -0,0 +1,374 @@
+"""
+This module provides the BuildProfile class, an opt-in profile of the vector database build
+(see build_pipeline.py and create_vector_databases.py --profile).
+
+The build code marks its stages with the stage context manager:
+
+    with stage('ocr'):
+        text = extractor.text
+
+which is a no-op unless profiling has been enabled in the process. When it is, the wall time,
+CPU time and number of items of every stage are recorded per manual. Worker tasks are run
+through profiled_call, which also measures the size of the pickled result sent back to the
+main process (the IPC bytes), and returns the stage records of the task along with its result,
+so that the main process can merge them into its BuildProfile. Each process reports its peak
+resident set size, and the stages report the largest peak of the processes they ran in.
+
+CPU time is measured per process in worker processes, including the CPU time of waited child
+processes such as tesseract, and per thread in the main process, whose writer thread runs
+alongside the main thread.
+
+Optionally, every worker process also records a cProfile profile of the tasks it runs, written
+to <cprofile_dir>/<role>_<pid>.prof, for example for snakeviz or pstats.
+"""
+
+# Perform necessary imports
+import contextlib
+import cProfile
+import json
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from .resource_usage import peak_rss_bytes
+
+# The recorder of the current process, None while profiling is disabled
+_recorder = None
+_null_stage = contextlib.nullcontext()
+# The cProfile profiler of the current worker process, if any
+_profiler = None
+
+
+def _process_cpu() -> float:
+    # User and system time of the process and of its waited child processes
+    return sum(os.times()[:4])
+
+
+class _Recorder:
+    """
+    Records the stages of one process.
+
+    Attributes:
+        role (str): The role of the process, e.g. 'main', 'ocr' or 'embed'.
+        manual (str): The manual stages are attributed to by default.
+        stages (dict): Maps stage names to dictionaries mapping manual names to
+            {'wall', 'cpu', 'items', 'bytes'} totals.
+    """
+    def __init__(self, role: str, cpu_clock=_process_cpu):
+        self.role = role
+        self.manual = None
+        self.stages = {}
+        self._cpu_clock = cpu_clock
+        self._lock = threading.Lock()
+
+    def add(self, name: str, wall: float = 0.0, cpu: float = 0.0, items: int = 0, nbytes: int = 0, manual: str = None):
+        with self._lock:
+            totals = self.stages.setdefault(name, {}).setdefault(manual or self.manual or '', {
+                'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes': 0
+            })
+            totals['wall'] += wall
+            totals['cpu'] += cpu
+            totals['items'] += items
+            totals['bytes'] += nbytes
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items: int = 1, manual: str = None):
+        start_wall, start_cpu = time.perf_counter(), self._cpu_clock()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_wall, self._cpu_clock() - start_cpu, items, 0, manual)
+
+    def snapshot(self, reset: bool = True) -> dict:
+        """
+        Returns the stage records of the process, with its pid, role and peak RSS.
+        """
+        with self._lock:
+            stages = self.stages
+            if reset:
+                self.stages = {}
+        return {'pid': os.getpid(), 'role': self.role, 'peak_rss_bytes': peak_rss_bytes(), 'stages': stages}
+
+
+def enable(role: str, cpu_clock=_process_cpu):
+    """
+    Enables profiling in the current process, if it is not already enabled.
+
+    Args:
+        role (str): The role of the process, e.g. 'ocr' or 'embed'.
+        cpu_clock (Callable): The CPU time clock of the stages. Defaults to the CPU time of
+            the process and its waited child processes.
+    """
+    global _recorder
+    if _recorder is None:
+        _recorder = _Recorder(role, cpu_clock)
+
+
+def enabled() -> bool:
+    """
+    Returns whether profiling is enabled in the current process.
+    """
+    return _recorder is not None
+
+
+def set_manual(manual: str):
+    """
+    Sets the manual that the following stages of the current process are attributed to.
+    """
+    if _recorder is not None:
+        _recorder.manual = manual
+
+
+def stage(name: str, items: int = 1, manual: str = None):
+    """
+    Returns a context manager timing a block of code as a stage, or a no-op context manager
+    if profiling is disabled.
+
+    Args:
+        name (str): The stage name.
+        items (int): The number of items processed in the block.
+        manual (str): The manual the block works on. Defaults to the one set with set_manual.
+    """
+    if _recorder is None:
+        return _null_stage
+    return _recorder.stage(name, items, manual)
+
+
+def record(name: str, wall: float = 0.0, cpu: float = 0.0, items: int = 0, nbytes: int = 0, manual: str = None):
+    """
+    Adds measurements to a stage directly, if profiling is enabled.
+    """
+    if _recorder is not None:
+        _recorder.add(name, wall, cpu, items, nbytes, manual)
+
+
+def measure_ipc(name: str, item, manual: str = None) -> int:
+    """
+    Pickles an item the way it is sent between processes and records the time and the number
+    of bytes under the stage name, if profiling is enabled.
+
+    Returns:
+        int: The pickled size in bytes, or 0 if profiling is disabled.
+    """
+    if _recorder is None:
+        return 0
+    start_wall, start_cpu = time.perf_counter(), _recorder._cpu_clock()
+    nbytes = len(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+    _recorder.add(name, time.perf_counter() - start_wall, _recorder._cpu_clock() - start_cpu, 1, nbytes, manual)
+    return nbytes
+
+
+def snapshot() -> dict:
+    """
+    Returns and resets the stage records of the current process, or None if profiling is disabled.
+    """
+    return _recorder.snapshot() if _recorder is not None else None
+
+
+def start_cprofile():
+    """
+    Starts (or resumes) the cProfile profiler of the current process.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+def stop_cprofile(cprofile_dir: Path):
+    """
+    Pauses the cProfile profiler of the current process and writes everything it has
+    recorded so far to <cprofile_dir>/<role>_<pid>.prof.
+    """
+    if _profiler is None:
+        return
+    _profiler.disable()
+    cprofile_dir = Path(cprofile_dir)
+    cprofile_dir.mkdir(parents=True, exist_ok=True)
+    role = _recorder.role if _recorder is not None else 'worker'
+    _profiler.dump_stats(cprofile_dir / f'{role}_{os.getpid()}.prof')
+
+
+def profiled_call(func, args, role: str, manual: str, cprofile_dir: str = None) -> tuple:
+    """
+    Runs a worker task with profiling enabled. Meant to be submitted to a process pool in
+    place of func.
+
+    Args:
+        func (Callable): The task function, called with args.
+        args: The argument of the task.
+        role (str): The role of the worker, e.g. 'ocr'. Also the name of the stage timing
+            the whole task.
+        manual (str): The manual the task works on.
+        cprofile_dir (str): If given, the folder the cProfile output of the worker is written to.
+
+    Returns:
+        tuple: The result of the task, and the stage records of the task (see snapshot).
+    """
+    enable(role)
+    set_manual(manual)
+    if cprofile_dir:
+        start_cprofile()
+    try:
+        with stage(f'{role}_task'):
+            result = func(args)
+        # The result is pickled again by the process pool, this measures what that costs
+        measure_ipc('ipc_to_main', result)
+    finally:
+        if cprofile_dir:
+            stop_cprofile(cprofile_dir)
+    return result, snapshot()
+
+
+class BuildProfile:
+    """
+    Collects the stage records of all processes of a build and turns them into a report.
+
+    Attributes:
+        cprofile_dir (Path): The folder the cProfile output of the workers is written to, or None.
+        stages (dict): Maps stage names to dictionaries mapping manual names to totals.
+        processes (dict): Maps pids to {'role', 'peak_rss_bytes'}.
+        stage_pids (dict): Maps stage names to the pids of the processes they ran in.
+        wall_seconds (float): The wall time of the build.
+        cpu_seconds (float): The CPU time of the main process.
+    """
+    def __init__(self, cprofile_dir: Path = None):
+        self.cprofile_dir = Path(cprofile_dir) if cprofile_dir else None
+        self.stages = {}
+        self.processes = {}
+        self.stage_pids = {}
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self._start = None
+        self._lock = threading.Lock()
+
+    def start(self) -> "BuildProfile":
+        """
+        Enables profiling in the main process and starts the clock.
+
+        Returns:
+            BuildProfile: The instance itself, to allow for method chaining.
+        """
+        # The writer thread runs next to the main thread, so CPU time is measured per thread
+        enable('main', cpu_clock=time.thread_time)
+        self._start = (time.perf_counter(), time.process_time())
+        return self
+
+    def finish(self) -> "BuildProfile":
+        """
+        Stops the clock and merges the stage records of the main process.
+
+        Returns:
+            BuildProfile: The instance itself, to allow for method chaining.
+        """
+        self.wall_seconds = time.perf_counter() - self._start[0]
+        self.cpu_seconds = time.process_time() - self._start[1]
+        self.merge(snapshot())
+        return self
+
+    def merge(self, records: dict):
+        """
+        Adds the stage records of a process (see snapshot).
+        """
+        if not records:
+            return
+        with self._lock:
+            process = self.processes.setdefault(records['pid'], {'role': records['role'], 'peak_rss_bytes': 0})
+            process['peak_rss_bytes'] = max(process['peak_rss_bytes'], records['peak_rss_bytes'] or 0)
+            for name, manuals in records['stages'].items():
+                self.stage_pids.setdefault(name, set()).add(records['pid'])
+                for manual, totals in manuals.items():
+                    target = self.stages.setdefault(name, {}).setdefault(manual, {
+                        'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes': 0
+                    })
+                    for key, value in totals.items():
+                        target[key] += value
+
+    def to_dict(self) -> dict:
+        """
+        Returns the report: the totals of every stage, the totals per manual and stage, and
+        the peak RSS of every process.
+        """
+        stages = {}
+        for name, manuals in self.stages.items():
+            totals = {key: sum(m[key] for m in manuals.values()) for key in ('wall', 'cpu', 'items', 'bytes')}
+            stages[name] = {
+                'wall_seconds': totals['wall'],
+                'cpu_seconds': totals['cpu'],
+                'items': totals['items'],
+                'items_per_second': totals['items'] / totals['wall'] if totals['wall'] else None,
+                'ipc_bytes': totals['bytes'],
+                'processes': len(self.stage_pids.get(name, ())),
+                'peak_rss_bytes': max(
+                    (self.processes[pid]['peak_rss_bytes'] for pid in self.stage_pids.get(name, ())), default=None
+                )
+            }
+        manuals = {}
+        for name, stage_manuals in self.stages.items():
+            for manual, totals in stage_manuals.items():
+                if manual:
+                    manuals.setdefault(manual, {})[name] = {
+                        'wall_seconds': totals['wall'],
+                        'cpu_seconds': totals['cpu'],
+                        'items': totals['items'],
+                        'ipc_bytes': totals['bytes']
+                    }
+        return {
+            'wall_seconds': self.wall_seconds,
+            'main_cpu_seconds': self.cpu_seconds,
+            'stages': stages,
+            'manuals': manuals,
+            'processes': {str(pid): info for pid, info in self.processes.items()},
+            'cprofile_dir': str(self.cprofile_dir) if self.cprofile_dir else None
+        }
+
+    def summary(self) -> str:
+        """
+        Returns a readable table of the stages, slowest first.
+
+        Stage wall times are summed over all processes, so they can add up to more than the
+        wall time of the build when stages run in parallel.
+        """
+        report = self.to_dict()
+        lines = [
+            f"Build wall time: {report['wall_seconds']:.1f} s, main process CPU time: {report['main_cpu_seconds']:.1f} s",
+            '',
+            f"{'stage':<18}{'procs':>6}{'wall s':>10}{'cpu s':>10}{'items':>9}{'items/s':>10}{'IPC MB':>9}{'peak RSS MB':>13}"
+        ]
+        ordered = sorted(report['stages'].items(), key=lambda item: item[1]['wall_seconds'], reverse=True)
+        for name, s in ordered:
+            rate = f"{s['items_per_second']:.1f}" if s['items_per_second'] else '-'
+            rss = f"{s['peak_rss_bytes'] / 2**20:.0f}" if s['peak_rss_bytes'] else '-'
+            lines.append(
+                f"{name:<18}{s['processes']:>6}{s['wall_seconds']:>10.2f}{s['cpu_seconds']:>10.2f}"
+                f"{s['items']:>9}{rate:>10}{s['ipc_bytes'] / 2**20:>9.1f}{rss:>13}"
+            )
+        # The slowest manuals, by the summed wall time of their stages. The worker task stages
+        # are left out, since they contain the other stages of the task.
+        totals = {
+            m: sum(s['wall_seconds'] for name, s in stages.items() if not name.endswith('_task'))
+            for m, stages in report['manuals'].items()
+        }
+        if totals:
+            lines += ['', 'Slowest manuals (summed stage wall time):']
+            for manual in sorted(totals, key=totals.get, reverse=True)[:10]:
+                lines.append(f"  {manual:<40}{totals[manual]:>10.2f} s")
+        return '\n'.join(lines)
+
+    def save(self, directory: Path) -> Path:
+        """
+        Writes the report as build_profile.json, and the summary as build_profile.txt.
+
+        Args:
+            directory (Path): The folder to write to.
+
+        Returns:
+            Path: The path of the JSON report.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / 'build_profile.json'
+        path.write_text(json.dumps(self.to_dict(), indent=2))
+        (directory / 'build_profile.txt').write_text(self.summary(), encoding='utf-8')
+        return path
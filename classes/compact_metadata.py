@@ -0,0 +1,163 @@
+"""
+This module provides the CompactMetadata class, a compact, array-backed replacement for the
+list of record dictionaries stored alongside a faiss index.
+
+Instead of one dictionary per chunk, with repeated 'manual' and 'path' strings, the metadata
+is stored as:
+
+- Interned lists of the distinct manual names, paths and languages, referenced by integer ids.
+- numpy arrays of manual ids, path ids, language ids, page numbers and chunk numbers.
+- All chunk texts in one contiguous bytes blob with an offset array. Each text can be
+  zlib-compressed on its own, so that single texts can be decoded without the rest.
+
+Records are only turned back into dictionaries, and texts only decoded, when they are
+accessed, for example for the top-k hits of a search.
+"""
+
+# Perform necessary imports
+import zlib
+import numpy as np
+
+# The standard record keys. Other keys are kept in a sparse dictionary.
+_STANDARD_KEYS = ('manual', 'path', 'page', 'chunk', 'language', 'text')
+
+
+class CompactMetadata:
+    """
+    An array-backed sequence of records.
+
+    Supports len(), indexing (returning record dictionaries), iteration and extend.
+
+    Attributes:
+        compress (bool): Whether texts are zlib-compressed.
+        manuals (list[str]): The distinct manual names.
+        paths (list[str]): The distinct paths.
+        languages (list[str]): The distinct languages.
+        manual_ids (np.ndarray): The manual id of each record.
+        path_ids (np.ndarray): The path id of each record.
+        language_ids (np.ndarray): The language id of each record, -1 if unknown.
+        pages (np.ndarray): The page number of each record, -1 if unknown.
+        chunks (np.ndarray): The chunk number of each record.
+        offsets (np.ndarray): The start of each text in text_blob, followed by the end of the last.
+        text_blob (bytes): All texts, utf-8 encoded and possibly compressed.
+        extras (dict): Maps record positions to dictionaries of non-standard keys.
+    """
+    def __init__(self, records: list[dict] = None, compress: bool = True):
+        self.compress = compress
+        self.manuals = []
+        self.paths = []
+        self.languages = []
+        self.manual_ids = np.empty(0, dtype=np.int32)
+        self.path_ids = np.empty(0, dtype=np.int32)
+        self.language_ids = np.empty(0, dtype=np.int16)
+        self.pages = np.empty(0, dtype=np.int32)
+        self.chunks = np.empty(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.text_blob = b''
+        self.extras = {}
+        self._manual_index = {}
+        self._path_index = {}
+        self._language_index = {}
+        if records:
+            self.extend(records)
+
+    def _intern(self, value: str, values: list, index: dict) -> int:
+        # Return the id of value, adding it to the list of distinct values if needed
+        value_id = index.get(value)
+        if value_id is None:
+            value_id = len(values)
+            values.append(value)
+            index[value] = value_id
+        return value_id
+
+    def extend(self, records: list[dict]):
+        """
+        Appends records.
+
+        Args:
+            records (list[dict]): Records with at least the keys 'manual', 'path', 'chunk' and 'text'.
+        """
+        start = len(self)
+        manual_ids, path_ids, language_ids, pages, chunks, texts = [], [], [], [], [], []
+        for i, record in enumerate(records):
+            manual_ids.append(self._intern(record['manual'], self.manuals, self._manual_index))
+            path_ids.append(self._intern(record['path'], self.paths, self._path_index))
+            language = record.get('language')
+            language_ids.append(-1 if language is None else self._intern(language, self.languages, self._language_index))
+            page = record.get('page')
+            pages.append(-1 if page is None else page)
+            chunks.append(record['chunk'])
+            text = record['text'].encode('utf-8')
+            texts.append(zlib.compress(text) if self.compress else text)
+            extra = {k: v for k, v in record.items() if k not in _STANDARD_KEYS}
+            if extra:
+                self.extras[start + i] = extra
+        # Append to the arrays and the text blob
+        lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+        self.manual_ids = np.concatenate([self.manual_ids, np.asarray(manual_ids, dtype=np.int32)])
+        self.path_ids = np.concatenate([self.path_ids, np.asarray(path_ids, dtype=np.int32)])
+        self.language_ids = np.concatenate([self.language_ids, np.asarray(language_ids, dtype=np.int16)])
+        self.pages = np.concatenate([self.pages, np.asarray(pages, dtype=np.int32)])
+        self.chunks = np.concatenate([self.chunks, np.asarray(chunks, dtype=np.int32)])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        self.text_blob = b''.join([self.text_blob, *texts])
+
+    def text(self, i: int) -> str:
+        """
+        Decodes the text of the record at position i.
+        """
+        raw = self.text_blob[self.offsets[i]:self.offsets[i + 1]]
+        return (zlib.decompress(raw) if self.compress else raw).decode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("CompactMetadata index out of range")
+        record = {
+            'manual': self.manuals[self.manual_ids[i]],
+            'path': self.paths[self.path_ids[i]]
+        }
+        # Records without a page number are returned without the 'page' key
+        page = int(self.pages[i])
+        if page >= 0:
+            record['page'] = page
+        record['chunk'] = int(self.chunks[i])
+        language_id = int(self.language_ids[i])
+        if language_id >= 0:
+            record['language'] = self.languages[language_id]
+        record['text'] = self.text(i)
+        record.update(self.extras.get(i, {}))
+        return record
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self) -> dict:
+        # The lookup dictionaries are rebuilt on unpickling
+        state = self.__dict__.copy()
+        del state['_manual_index']
+        del state['_path_index']
+        del state['_language_index']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        # Metadata pickled before languages were tracked has no language column
+        if 'language_ids' not in state:
+            self.languages = []
+            self.language_ids = np.full(len(self.chunks), -1, dtype=np.int16)
+        self._language_index = {value: i for i, value in enumerate(self.languages)}
+        self._manual_index = {value: i for i, value in enumerate(self.manuals)}
+        self._path_index = {value: i for i, value in enumerate(self.paths)}
+
+    def nbytes(self) -> int:
+        """
+        Returns the approximate number of bytes used by the arrays and the text blob.
+        """
+        arrays = (self.manual_ids, self.path_ids, self.language_ids, self.pages, self.chunks, self.offsets)
+        return sum(a.nbytes for a in arrays) + len(self.text_blob)
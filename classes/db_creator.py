@@ -1,64 +1,90 @@
 """
 This module provides tools for creating vector databases for document retrieval.
 
-It defines a DbCreator class that takes a list of preprocessed text chunks (records) 
-and organizes them by manual name. For each manual, it uses an Embedder to generate
-sentence embeddings and stores them in a VectorDatabase instance serialized to disk.
+It defines a DbCreator class that takes a record store of preprocessed text chunks (records),
+indexed by manual name. For each manual, it uses an Embedder to generate sentence embeddings
+and stores them in a VectorDatabase instance serialized to disk.
 
-The embedding and vector database creation is parallelized using ProcessPoolExecutor 
-for efficiency across multiple manuals.
+The embedding and vector database creation is parallelized using ProcessPoolExecutor
+for efficiency across multiple manuals. The number of worker processes and the torch threads of
+each worker are taken from a ResourcePlan (see resource_plan.py), so that the workers do not all
+claim every core for their intra-op threads. Each worker reads the records of its own manual
+from the record store, so the records are never shipped between processes.
+
+Optionally, near-identical chunks within a manual are collapsed before embedding
+(see deduplicator.py).
+
+Each worker also summarizes the embeddings of its manual by a few representative vectors,
+which are collected into the manual routing index (see manual_router.py).
 """
 
 # Perform necessary imports
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor
-from functools import partial
 from .vector_database import VectorDatabase
 from .embedder import Embedder
+from .record_store import RecordStore
+from .deduplicator import ChunkDeduplicator
+from .manual_router import ManualRouter, summarize_embeddings
+from .snapshots import active_dir
+from .resource_plan import ResourcePlan, limit_threads
 import joblib
 from pathlib import Path
 
-def _process_manual(manual_name: str,records: list[dict]) -> str:
+def _process_manual(manual_name: str, store_path: str, dedup_threshold: float = None, output_dir: str = None) -> tuple:
     """
     Processes all records associated with a given manual by generating embeddings
     and storing them in a vector database on disk.
 
     Args:
         manual_name (str): The name of the manual to process.
-        records (list[dict]): A list of all available records. Each record should
-                              be a dictionary containing at least a 'manual' key.
+        store_path (str): The path to the record store holding the records.
+        dedup_threshold (float): If given, near-identical chunks (by estimated Jaccard
+            similarity) are collapsed into one before embedding.
+        output_dir (str): The folder the vector database is written to, e.g. a new snapshot.
+            Defaults to the folder of the vector databases in use.
 
     Returns:
-        str: The path to the saved vector database file for the given manual.
+        tuple[str, dict, np.ndarray]: The path to the saved vector database file for the given manual,
+            the deduplication report (None if deduplication is disabled) and the representative
+            vectors of the manual for the routing index.
     """
-    # Filter out the records associated with the manual
-    manual_records = [record for record in records if record['manual'] == manual_name]
+    # Fetch the records associated with the manual and collapse near duplicates
+    manual_records = RecordStore(store_path).get_manual(manual_name)
+    report = None
+    if dedup_threshold is not None:
+        deduplicator = ChunkDeduplicator(threshold=dedup_threshold)
+        manual_records, _ = deduplicator.deduplicate(manual_records)
+        report = deduplicator.last_report
     # Create embeddings and initialize a VectorDatabase
     embeddings, manual_records = Embedder().encode(manual_records)
     vdb = VectorDatabase(dim=384)
     # Create the folder to store the vector database in and the path to the file to save.
-    base_dir = Path(__file__).resolve().parent.parent / "vector_databases" / manual_name
+    base_dir = Path(output_dir or active_dir()) / manual_name
     base_dir.mkdir(parents=True, exist_ok=True)
     output_path = base_dir / "vdb.pkl"
     # Add embeddings to the vector database, save the vector database and
     # return the path of the vector database as a string
     vdb.add(embeddings, manual_records)
     joblib.dump(vdb, output_path)
-    return str(output_path)
+    if report is not None:
+        report['index_bytes'] = output_path.stat().st_size
+    return str(output_path), report, summarize_embeddings(embeddings)
 
-def _process_manual_star(args: tuple) -> str:
+def _process_manual_star(args: tuple) -> tuple:
     """
     Unpacks arguments and delegates to the _process_manual function.
 
-    This helper is used to enable argument unpacking when using 
-    multiprocessing or concurrent execution patterns where the 
+    This helper is used to enable argument unpacking when using
+    multiprocessing or concurrent execution patterns where the
     mapping function only accepts a single argument.
 
     Parameters:
-        args (tuple): A tuple containing (manual_name, records).
+        args (tuple): A tuple containing (manual_name, store_path, dedup_threshold, output_dir).
 
     Returns:
-        str: Path to the saved vector database file for the manual.
+        tuple[str, dict, np.ndarray]: Path to the saved vector database file for the manual,
+            the deduplication report and the representative vectors of the manual.
     """
     return _process_manual(*args)
 
@@ -66,40 +92,63 @@ class DbCreator:
     """
     Creates and stores vector databases for each manual using parallel processing.
 
-    This class takes a list of records and a list of manual names, filters the records
-    by manual, generates embeddings using the Embedder, and stores them in
+    This class takes a record store and a list of manual names, fetches the records
+    of each manual, generates embeddings using the Embedder, and stores them in
     corresponding VectorDatabase instances serialized to disk.
 
     Attributes:
         manual_names (list of str): Names of the manuals to process.
-        records (list of dict): Record data, where each record contains at least a 'manual' field.
+        store (RecordStore): The record store holding the records of the manuals.
+        dedup_threshold (float): The similarity at which chunks are collapsed, or None to keep all chunks.
+        dedup_reports (dict): Maps manual names to deduplication reports, after create_databases.
+        router (ManualRouter): The manual routing index, after create_databases.
+        output_dir (Path): The folder the vector databases are written to.
+        plan (ResourcePlan): Sizes the process pool and the threads per process.
     """
-    def __init__(self,records,manual_names):
-        self.manual_names = manual_names
-        self.records = records
-    
+    def __init__(self,store,manual_names=None,dedup_threshold=None,output_dir=None,plan=None):
+        self.store = store
+        self.output_dir = Path(output_dir) if output_dir else active_dir()
+        self.manual_names = manual_names if manual_names is not None else store.manual_names()
+        self.dedup_threshold = dedup_threshold
+        self.dedup_reports = {}
+        self.router = None
+        self.plan = plan or ResourcePlan('phased')
+
     def create_databases(self):
         """
         Creates and saves vector databases for each manual in parallel.
 
-        For each unique manual name in the dataset, this method filters the 
-        relevant records, generates sentence embeddings, and stores them 
-        in a dedicated VectorDatabase instance. The resulting databases are 
-        saved as .pkl files under vector_databases/{manual_name}/vdb.pkl.
+        For each manual name, this method fetches the relevant records from the
+        record store, generates sentence embeddings, and stores them in a
+        dedicated VectorDatabase instance. The resulting databases are
+        saved as .pkl files under {output_dir}/{manual_name}/vdb.pkl.
+        If a dedup_threshold is set, near-identical chunks are collapsed first
+        and the resulting reduction is stored in dedup_reports.
+        The representative vectors of the manuals are added to the manual routing
+        index, which is saved as {output_dir}/router.pkl. Manuals already in
+        a saved router, but not processed now, are kept.
 
-        Uses a process pool to parallelize database creation across manuals.
+        Uses a process pool, sized by the plan, to parallelize database creation across manuals.
 
         Returns:
             DbCreator: The instance itself, to allow for method chaining.
         """
-        manual_to_records = {}
-        for record in self.records:            
-            manual_to_records.setdefault(record['manual'], []).append(record)
-        all_args = [(manual, records) for manual, records in manual_to_records.items()]
-
-        with ProcessPoolExecutor(max_workers=4) as executor:
+        all_args = [
+            (manual, str(self.store.path), self.dedup_threshold, str(self.output_dir))
+            for manual in self.manual_names
+        ]
+        router_path = self.output_dir / 'router.pkl'
+        self.router = ManualRouter.load(router_path) or ManualRouter()
+
+        workers = max(1, min(self.plan.embed_workers, len(all_args)))
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=limit_threads, initargs=(self.plan.embed_threads,)
+        ) as executor:
             futures = executor.map(_process_manual_star, all_args)
-            for result in tqdm(futures, total=len(all_args)):
-                continue
-    
-        return self
\ No newline at end of file
+            for manual, (_, report, representatives) in zip(self.manual_names, tqdm(futures, total=len(all_args))):
+                if report is not None:
+                    self.dedup_reports[manual] = report
+                self.router.add_representatives(manual, representatives)
+
+        self.router.save(router_path)
+        return self
@@ -0,0 +1,249 @@
+"""
+This module provides the ChunkDeduplicator class, which collapses near-identical chunks
+within a manual before they are embedded and indexed.
+
+Vendor manuals repeat safety notices, warranty text and boilerplate on page after page.
+Near duplicates are found with MinHash signatures over word shingles and locality
+sensitive hashing (LSH) over bands of the signatures. Candidate pairs whose estimated
+Jaccard similarity reaches the threshold are clustered with union-find, and each cluster
+is replaced by its first record. If the cluster has more than one record, the kept record
+gets a 'sources' key holding back-references ('path', 'page' and 'chunk') to every record of
+its cluster, itself included.
+
+StreamingDeduplicator does the same for records arriving one page at a time (see
+build_pipeline.py): each record is compared with the records kept so far, and duplicates are
+dropped before they are embedded.
+"""
+
+# Perform necessary imports
+import re
+import zlib
+import numpy as np
+
+# A Mersenne prime used as the modulus of the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+
+class ChunkDeduplicator:
+    """
+    Collapses near-duplicate records using MinHash and LSH.
+
+    Attributes:
+        threshold (float): The estimated Jaccard similarity at which two chunks count as duplicates.
+        shingle_size (int): The number of words per shingle.
+        num_perm (int): The number of MinHash permutations.
+        bands (int): The number of LSH bands. Must divide num_perm.
+        last_report (dict): Statistics of the most recent call to deduplicate.
+    """
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        shingle_size: int = 5,
+        num_perm: int = 64,
+        bands: int = 16,
+        seed: int = 0
+    ):
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm.")
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.last_report = None
+        # Draw the coefficients of the permutations. They are kept below 2**32 so that
+        # a * x + b, with 32-bit shingle hashes x, fits in an unsigned 64-bit integer.
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        # Hash the word n-grams of the normalized text to 32-bit integers
+        words = re.sub(r'\W+', ' ', text.lower()).split()
+        n = self.shingle_size
+        grams = [' '.join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))]
+        return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Computes the MinHash signature of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            np.ndarray: An array of num_perm unsigned integers.
+        """
+        shingles = self._shingles(text)
+        hashed = (np.outer(shingles, self._a) + self._b) % _PRIME
+        return hashed.min(axis=0)
+
+    def find_clusters(self, texts: list[str]) -> list[list[int]]:
+        """
+        Groups texts into clusters of near duplicates.
+
+        Args:
+            texts (list[str]): The texts.
+
+        Returns:
+            list[list[int]]: Clusters of positions in texts, in order of their first member.
+                Texts without duplicates form clusters of their own.
+        """
+        if not texts:
+            return []
+        signatures = np.stack([self.signature(text) for text in texts])
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # Bucket the texts by each band of their signatures and compare the
+        # texts sharing a bucket
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            buckets = {}
+            for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                first = members[0]
+                for other in members[1:]:
+                    root_a, root_b = find(first), find(other)
+                    if root_a == root_b:
+                        continue
+                    similarity = np.mean(signatures[first] == signatures[other])
+                    if similarity >= self.threshold:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+        clusters = {}
+        for i in range(len(texts)):
+            clusters.setdefault(find(i), []).append(i)
+        return sorted(clusters.values(), key=lambda cluster: cluster[0])
+
+    def deduplicate(self, records: list[dict], text_key: str = 'text') -> tuple:
+        """
+        Collapses near-duplicate records.
+
+        Args:
+            records (list[dict]): The records of a single manual.
+            text_key (str): The key of the text to compare. Defaults to 'text'.
+
+        Returns:
+            tuple[list[dict], list[int]]:
+                - The kept records. Records standing for duplicates get a 'sources' key listing
+                  the records they stand for.
+                - The positions of the kept records in the input list, for selecting
+                  precomputed embeddings.
+        """
+        clusters = self.find_clusters([record[text_key] for record in records])
+        kept_records = []
+        kept_positions = []
+        for cluster in clusters:
+            record = dict(records[cluster[0]])
+            # Only records standing for duplicates get back-references, which keeps the
+            # metadata of unique records compact
+            if len(cluster) > 1:
+                record['sources'] = [
+                    {key: records[i].get(key) for key in ('path', 'page', 'chunk')}
+                    for i in cluster
+                ]
+            kept_records.append(record)
+            kept_positions.append(cluster[0])
+        self.last_report = {
+            'records_before': len(records),
+            'records_after': len(kept_records),
+            'reduction': 1 - len(kept_records) / len(records) if records else 0.0
+        }
+        return kept_records, kept_positions
+
+
+def _reference(record: dict) -> dict:
+    # The back-reference of a record in the 'sources' of the record standing for it
+    return {key: record.get(key) for key in ('path', 'page', 'chunk')}
+
+
+class StreamingDeduplicator:
+    """
+    Collapses near-duplicate records of a single manual as they arrive, so that duplicates
+    can be dropped before they are embedded.
+
+    Each record is compared with the records kept so far, through the LSH buckets of their
+    signatures. A record whose estimated Jaccard similarity to a kept record reaches the
+    threshold is dropped, and the kept record stands for it. Unlike ChunkDeduplicator, chains
+    of records that are only similar through a dropped record are not merged.
+
+    Attributes:
+        deduplicator (ChunkDeduplicator): Computes the signatures and holds the settings.
+        records_before (int): The number of records seen.
+        dropped (list[dict]): The dropped records, e.g. to keep them in the record store.
+        sources (dict): Maps the keys (see key) of kept records standing for duplicates to
+            the back-references of their cluster, the kept record first.
+    """
+    def __init__(self, threshold: float = 0.9, **kwargs):
+        self.deduplicator = ChunkDeduplicator(threshold=threshold, **kwargs)
+        self.records_before = 0
+        self.dropped = []
+        self.sources = {}
+        self._buckets = [{} for _ in range(self.deduplicator.bands)]
+        self._signatures = []
+        self._kept = []
+
+    @staticmethod
+    def key(record: dict) -> tuple:
+        """
+        Returns the key identifying a record within its manual.
+        """
+        return record.get('path'), record.get('page'), record.get('chunk')
+
+    def keep(self, record: dict) -> bool:
+        """
+        Compares a record with the records kept so far.
+
+        Args:
+            record (dict): The record.
+
+        Returns:
+            bool: Whether the record is kept. Dropped records are added to dropped, and to the
+                sources of the kept record standing for them.
+        """
+        self.records_before += 1
+        signature = self.deduplicator.signature(record['text'])
+        rows = self.deduplicator.num_perm // self.deduplicator.bands
+        bands = [bytes(signature[band * rows:(band + 1) * rows]) for band in range(self.deduplicator.bands)]
+        # Look for a kept record sharing a bucket and reaching the threshold
+        for band, bucket_key in enumerate(bands):
+            for i in self._buckets[band].get(bucket_key, []):
+                if np.mean(self._signatures[i] == signature) >= self.deduplicator.threshold:
+                    kept = self._kept[i]
+                    self.sources.setdefault(self.key(kept), [_reference(kept)]).append(_reference(record))
+                    self.dropped.append(record)
+                    return False
+        i = len(self._signatures)
+        self._signatures.append(signature)
+        self._kept.append(_reference(record))
+        for band, bucket_key in enumerate(bands):
+            self._buckets[band].setdefault(bucket_key, []).append(i)
+        return True
+
+    def apply(self, records: list[dict]):
+        """
+        Adds the 'sources' key to the kept records standing for duplicates.
+
+        Args:
+            records (list[dict]): The kept records (e.g. after embedding).
+        """
+        for record in records:
+            sources = self.sources.get(self.key(record))
+            if sources is not None:
+                record['sources'] = sources
+
+    def report(self) -> dict:
+        """
+        Returns the statistics of the records seen so far, like ChunkDeduplicator.last_report.
+        """
+        after = self.records_before - len(self.dropped)
+        return {
+            'records_before': self.records_before,
+            'records_after': after,
+            'reduction': 1 - after / self.records_before if self.records_before else 0.0
+        }
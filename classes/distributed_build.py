@@ -0,0 +1,159 @@
+"""
+This module builds the vector databases on several hosts at once, through a work queue on a
+shared filesystem (see work_queue.py).
+
+Every manual is a work unit. Each worker process claims manuals from the queue one at a time
+and builds each claimed manual on its own with the streaming build pipeline (OCR, chunking and
+embedding, see build_pipeline.py) into the part folder of the manual, holding its vector
+database(s), records and routing representatives. Workers can run on any number of hosts, and
+several can run on one host for a local test. When every manual is done, merge_parts assembles
+the parts into a new snapshot (see snapshots.py), which can then be published.
+
+The page paths stored in the records are those of the worker that built the manual, so the docs
+folder should be at the same path on every host (e.g. on the shared filesystem as well).
+"""
+
+# Perform necessary imports
+import json
+import logging
+import shutil
+import time
+import traceback
+from pathlib import Path
+from .work_queue import WorkQueue, default_worker_id
+from .task_generator import TaskGenerator
+from .build_pipeline import StreamingBuildPipeline
+from .record_store import RecordStore
+from .manual_router import ManualRouter
+from .resource_plan import ResourcePlan
+
+logger = logging.getLogger(__name__)
+
+# The build settings stored in the queue, shared by all workers
+BUILD_SETTINGS = ('chunking', 'languages', 'route_languages', 'dedup_threshold', 'queue_size', 'batch_size', 'layout')
+
+
+def create_queue(queue: WorkQueue, docs_dir: Path, manuals: list[str] = None, **settings) -> WorkQueue:
+    """
+    Creates a work queue with one unit per manual in the docs folder.
+
+    Args:
+        queue (WorkQueue): The queue to create.
+        docs_dir (Path): The docs folder.
+        manuals (list[str]): The manuals to build. Defaults to all manuals in the docs folder.
+        **settings: The build settings of the workers, see BUILD_SETTINGS.
+
+    Returns:
+        WorkQueue: The created queue.
+    """
+    unknown = set(settings) - set(BUILD_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown build settings: {', '.join(sorted(unknown))}")
+    tasks = TaskGenerator(docs_dir).get_tasks()
+    if manuals is not None:
+        tasks = {manual: tasks[manual] for manual in manuals}
+    settings = {key: value for key, value in settings.items() if value is not None}
+    return queue.create({manual: len(paths) for manual, paths in tasks.items()}, {'docs': str(docs_dir), **settings})
+
+
+def run_worker(
+    queue: WorkQueue,
+    worker: str = None,
+    docs_dir: Path = None,
+    plan: ResourcePlan = None,
+    wait: bool = True,
+    poll_seconds: float = 10.0
+) -> list[str]:
+    """
+    Claims and builds manuals until the queue is finished.
+
+    Args:
+        queue (WorkQueue): The work queue.
+        worker (str): The id of the worker. Defaults to a new unique id.
+        docs_dir (Path): The docs folder on this host. Defaults to the one the queue was created from.
+        plan (ResourcePlan): Sizes the process pools of the builds.
+        wait (bool): Whether to keep polling while other workers hold the remaining manuals, so that
+            their manuals are taken over if they die. Otherwise the worker stops when nothing is left to claim.
+        poll_seconds (float): The polling interval while waiting.
+
+    Returns:
+        list[str]: The manuals built by this worker.
+    """
+    worker = worker or default_worker_id()
+    settings = queue.settings()
+    tasks = TaskGenerator(docs_dir or settings['docs']).get_tasks()
+    options = {key: settings[key] for key in BUILD_SETTINGS if key in settings}
+    built = []
+    while True:
+        lease = queue.claim(worker)
+        if lease is None:
+            if not wait or queue.finished():
+                return built
+            time.sleep(poll_seconds)
+            continue
+        manual = lease.unit
+        staging = queue.staging_dir(lease)
+        shutil.rmtree(staging, ignore_errors=True)
+        logger.info('%s is building %s.', worker, manual)
+        start = time.perf_counter()
+        try:
+            if manual not in tasks:
+                raise FileNotFoundError(f'{manual} is not in the docs folder of this worker.')
+            pipeline = StreamingBuildPipeline({manual: tasks[manual]}, staging, plan=plan, **options).run()
+            (staging / 'dedup_report.json').write_text(json.dumps(pipeline.dedup_reports, indent=2))
+        except Exception:
+            if not queue.holds(lease):
+                # The lease expired and another worker took the manual over
+                queue.discard(lease)
+                continue
+            logger.exception('%s failed to build %s.', worker, manual)
+            queue.fail(lease, traceback.format_exc())
+            continue
+        if queue.complete(lease, {'seconds': time.perf_counter() - start, 'pages': len(tasks[manual])}):
+            built.append(manual)
+
+
+def merge_parts(queue: WorkQueue, snapshot_dir: Path, allow_missing: bool = False) -> dict:
+    """
+    Assembles the parts of a finished queue into a snapshot folder: the vector database
+    folders are copied, and the records and routing representatives are merged into one
+    record store and one routing index.
+
+    Args:
+        queue (WorkQueue): The work queue.
+        snapshot_dir (Path): The new snapshot folder (see snapshots.new_snapshot_dir).
+        allow_missing (bool): Whether to merge even though some manuals are not done.
+
+    Returns:
+        dict: Maps manual names to their deduplication reports.
+
+    Raises:
+        RuntimeError: If some manuals are not done and allow_missing is not set.
+    """
+    status = queue.status()
+    missing = [unit for unit, state in status.items() if state != 'done']
+    if missing and not allow_missing:
+        raise RuntimeError(f"{len(missing)} manuals are not done: {', '.join(missing[:5])}")
+    snapshot_dir = Path(snapshot_dir)
+    store = RecordStore(snapshot_dir / 'records.sqlite')
+    router = ManualRouter()
+    dedup_reports = {}
+    for unit, state in status.items():
+        if state != 'done':
+            continue
+        part = queue.part_dir(unit)
+        # A part holds the manual, and the manuals its other languages were routed to
+        for manual_dir in sorted(d for d in part.iterdir() if (d / 'vdb.pkl').exists()):
+            shutil.copytree(manual_dir, snapshot_dir / manual_dir.name)
+        part_store = RecordStore(part / 'records.sqlite')
+        for manual in part_store.manual_names():
+            store.add_records(part_store.get_manual(manual))
+        part_router = ManualRouter.load(part / 'router.pkl')
+        if part_router is not None:
+            for i, manual in enumerate(part_router.manuals):
+                router.add_representatives(manual, part_router.vectors[part_router.owners == i])
+        report = part / 'dedup_report.json'
+        if report.exists():
+            dedup_reports.update(json.loads(report.read_text()))
+    router.save(snapshot_dir / 'router.pkl')
+    return dedup_reports
@@ -1,10 +1,35 @@
 """
 A simple wrapper around a SentenceTransformer model for embedding text records.
+
+sentence_transformers (and with it torch) is only imported when the first Embedder is created,
+and the loaded model is shared by all Embedder instances of the process.
 """
 # Perform necessary imports
+import threading
 import numpy as np
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+
+# Cache of loaded models, shared by all embedders in the process
+_models = {}
+_models_lock = threading.Lock()
+
+def load_model(model_path: str):
+    """
+    Loads a SentenceTransformer model, using a process-wide cache.
+
+    Args:
+        model_path (str): The path to the model folder.
+
+    Returns:
+        SentenceTransformer: The loaded model.
+    """
+    with _models_lock:
+        model = _models.get(model_path)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_path)
+            _models[model_path] = model
+        return model
 
 class Embedder:
     """
@@ -18,10 +43,11 @@ class Embedder:
 
         The model is expected to be located at 'models/all-MiniLM-L6-v2' relative to the project root.
         This local model is used to generate text embeddings via the SentenceTransformer library.
+        The model is only loaded once per process.
         """
         # Load the model
         model_path = Path(__file__).resolve().parent.parent/'models'/'all-MiniLM-L6-v2'
-        self.model = SentenceTransformer(str(model_path))
+        self.model = load_model(str(model_path))
 
     def encode(
         self,
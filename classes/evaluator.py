@@ -2,21 +2,26 @@
 Module: evaluator
 
 This module defines the Evaluator class, which facilitates automated testing and evaluation of a
-local question-answering assistant (ManualAssistant) using GPT-4.1 via the OpenAI API as a judge
-and question generator.
+local question-answering assistant (ManualAssistant) using GPT-4.1 via the OpenAI API (or any
+other LLM backend, see llm_backend.py) as a judge and question generator.
 
 The module is intended for evaluating the factual and qualitative performance of local QA systems
-against a trusted language model.
+against a trusted language model. Intermediate results can be checkpointed to disk so that an
+interrupted evaluation resumes where it stopped.
 """
 
 # Perform necessary imports
-import os
 import json
-import joblib
+import os
+import threading
 import pandas as pd
 from pathlib import Path
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 from .manual_assistant import ManualAssistant
+from .batch_scheduler import BatchScheduler
+from .llm_backend import LLMBackend, get_backend
+from .rate_limiter import RateLimiter, retry_with_backoff
+from .record_store import RecordStore
 
 
 class Evaluator:
@@ -34,22 +39,35 @@ class Evaluator:
 
     Attributes:
         manual_name (str): Name of the manual to evaluate.
-        client (OpenAI): OpenAI client for GPT-4.1 communication.
+        backend (LLMBackend): The LLM backend used for GPT-4.1 communication.
         model_name (str): The model identifier used for GPT-based tasks.
         local_ma (ManualAssistant): The local assistant used to generate manual-based answers.
         records (list[dict]): A filtered and sorted list of manual chunks for context.
         questions (dict): A dictionary of generated [question, correct answer] pairs.
+        question_sources (dict): Maps question keys to the 'path' and 'chunk' of the record the
+            question was generated from, or None for unanswerable questions.
         question_and_answers (dict): A dictionary of [question, correct answer, local answer] triples.
         evaluation (dict): A dictionary of full evaluations, including scores and justifications.
         evaluation_df (pd.DataFrame): A DataFrame summarizing the evaluation for analysis or export.
+        checkpoint_path (Path): The checkpoint file of the evaluation, or None if checkpointing is disabled.
     """
-    def __init__(self, manual_name: str):
+    def __init__(
+        self,
+        manual_name: str,
+        backend: LLMBackend = None,
+        local_backend: LLMBackend = None,
+        checkpoint_dir: Path = None,
+        local_workers: int = 1,
+        rate_limiter: RateLimiter = None,
+        retries: int = 3,
+        scheduler: BatchScheduler = None
+    ):
         """
         Initialize the Evaluator for a specific product manual.
 
         This method sets up the evaluation pipeline by:
         - Loading manual content from disk
-        - Initializing the OpenAI client (GPT-4.1)
+        - Initializing the LLM backend (GPT-4.1)
         - Creating a local ManualAssistant for querying manual content
         - Generating synthetic user questions and reference answers using GPT
         - Collecting local model responses to the generated questions
@@ -57,28 +75,102 @@ class Evaluator:
 
         Parameters:
             manual_name (str): The name or identifier of the manual to evaluate.
+            backend (LLMBackend, optional): The backend used for question generation and judging.
+                Defaults to the backend selected by get_backend.
+            local_backend (LLMBackend, optional): The backend used by the local ManualAssistant.
+                Defaults to the backend selected by get_backend.
+            checkpoint_dir (Path, optional): A folder in which the generated questions, local answers
+                and scores are saved as soon as they are produced. If a checkpoint for the manual
+                already exists, the finished steps are loaded instead of being run again.
+            local_workers (int, optional): The number of questions answered concurrently by the
+                local assistant. Defaults to 1.
+            rate_limiter (RateLimiter, optional): A rate limiter, possibly shared between evaluators,
+                acquired before every LLM call.
+            retries (int, optional): The number of retries, with exponential backoff, of failed LLM calls.
+            scheduler (BatchScheduler, optional): A scheduler, possibly shared between evaluators,
+                batching the query embeddings and searches of the local assistant.
+
+        Raises:
+            FileNotFoundError: If there is no record store (see record_store.py).
+            ValueError: If the record store has no records of the manual.
         """
         self.manual_name = manual_name
+        self.local_workers = local_workers
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.checkpoint_path = Path(checkpoint_dir) / f'{manual_name}.json' if checkpoint_dir else None
+        self._checkpoint = self._load_checkpoint()
+        self._checkpoint_lock = threading.RLock()
         
-        # Initialize OpenAI client and choose the model name
-        self.client = OpenAI(api_key=os.getenv('openai_api_key'))
-        self.model_name = "gpt-4.1"
+        # Initialize the llm backend and get the model name
+        self.backend = backend or get_backend("gpt-4.1")
+        self.model_name = self.backend.model_name
 
         # Initialize a manual assistant, fetch records from disk
         # and filter them to appropriate size.
-        self.local_ma = ManualAssistant(manual_name)
-        self.records = joblib.load(Path('vector_databases') / 'records.pkl')
+        self.local_ma = ManualAssistant(manual_name, backend=local_backend, scheduler=scheduler)
         self.records = sorted(
-            [x for x in self.records if x['manual'] == manual_name],
+            RecordStore(read_only=True).get_manual(manual_name),
             key=lambda x: (x['path'], x['chunk'])
         )[:10]
-
-        # Generate questions, answers and perform evaluation
-        self.questions = self._generate_questions()
+        if not self.records:
+            raise ValueError(
+                f"The record store has no records of manual '{manual_name}'. Rebuild the vector "
+                f"databases, or migrate an old records.pkl with: python -m classes.record_store"
+            )
+
+        # Generate questions, answers and perform evaluation, skipping
+        # steps that were finished in an earlier run.
+        self.questions = self._checkpoint.get('questions')
+        self.question_sources = self._checkpoint.get('question_sources', {})
+        if self.questions is None:
+            self.questions = self._generate_questions()
+            self._save_checkpoint('question_sources', self.question_sources)
+            self._save_checkpoint('questions', self.questions)
         self.question_and_answers = self._collect_local_answers(self.questions)
-        self.evaluation = self._evaluate()
+        self.evaluation = self._checkpoint.get('evaluation')
+        if self.evaluation is None:
+            self.evaluation = self._evaluate()
+            self._save_checkpoint('evaluation', self.evaluation)
         self.evaluation_df = self._evaluation_to_df()
 
+    def _load_checkpoint(self) -> dict:
+        """
+        Loads the checkpoint of the evaluation, if checkpointing is enabled and one exists.
+
+        Returns:
+            dict: The checkpoint, with (some of) the keys 'questions', 'local_answers' and
+                'evaluation', or an empty dict.
+        """
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return {}
+        return json.loads(self.checkpoint_path.read_text(encoding='utf-8'))
+
+    def _save_checkpoint(self, key: str, value):
+        """
+        Stores a value in the checkpoint and writes the checkpoint atomically to disk.
+
+        Parameters:
+            key (str): The checkpoint key.
+            value: A JSON serializable value.
+        """
+        with self._checkpoint_lock:
+            self._checkpoint[key] = value
+            if self.checkpoint_path is None:
+                return
+            # Write to a temporary file first so that an interruption never leaves
+            # a half-written checkpoint behind
+            self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.checkpoint_path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(self._checkpoint, indent=2), encoding='utf-8')
+            os.replace(tmp_path, self.checkpoint_path)
+
+    def _call_llm(self, func):
+        """
+        Calls func through the rate limiter, retrying with backoff if it fails.
+        """
+        return retry_with_backoff(func, retries=self.retries, rate_limiter=self.rate_limiter)
+
     def _run_gpt(self, prompt: str) -> str:
         """
         Sends a prompt to the OpenAI GPT model and returns the response.
@@ -89,12 +181,12 @@ class Evaluator:
         Returns:
             str: The model's response as plain text, stripped of leading and trailing whitespace.
         """
-        # Send the request to the model
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return response.choices[0].message.content.strip()
+        # Send the request to the model. Cached replies (see CachedBackend) skip the rate limiter.
+        messages = [{"role": "user", "content": prompt}]
+        if self.backend.is_cached(messages, temperature=1.0):
+            return self.backend.complete(messages, temperature=1.0).strip()
+        response = self._call_llm(lambda: self.backend.complete(messages, temperature=1.0))
+        return response.strip()
 
     def _generate_questions(self, n: int = 5) -> dict:
         """
@@ -104,8 +196,13 @@ class Evaluator:
         and 2 additional questions for which the correct response is:
         "I'm afraid I can't find that in the manual."
 
+        The excerpts are numbered in the prompt, and the model is asked to state which excerpt
+        each answerable question is based on. The source record of each question is stored in
+        question_sources, so that retrieval can be evaluated without LLM calls later on
+        (see retrieval_evaluator.py).
+
         The output is expected to be a JSON dictionary where each key is a stringified integer,
-        and each value is a list of two strings: [question, answer].
+        and each value is a list of three elements: [question, answer, excerpt number].
 
         Parameters:
             n (int): Total number of questions to generate (default is 5).
@@ -122,15 +219,27 @@ class Evaluator:
             For these last two questions, the answer should be: "I'm afraid I can't find that in the manual."
 
             Your output should be a **JSON dictionary**. Each key should be a string integer ("1", "2", ...) and 
-            each value should be a list of two elements: [question_string, answer_string].
+            each value should be a list of three elements: [question_string, answer_string, excerpt_number],
+            where excerpt_number is the number of the excerpt the answer is found in, or 0 for the last two questions.
 
             Don't add any text before or after the JSON. Dont add any ```json or backticks or similar things.
             Here are the manual excerpts:
-        """ + '\n'.join(x['text'] for x in self.records)
-
-        # Send the prompt to the model and return the result as a dict.
-        raw = self._run_gpt(instructions)
-        return json.loads(raw)
+        """ + '\n'.join(f"[Excerpt {i + 1}]\n{x['text']}" for i, x in enumerate(self.records))
+
+        # Send the prompt to the model, store the source record of each question
+        # and return the [question, answer] pairs as a dict.
+        raw = json.loads(self._run_gpt(instructions))
+        questions = {}
+        self.question_sources = {}
+        for key, value in raw.items():
+            questions[key] = value[:2]
+            excerpt = value[2] if len(value) > 2 else 0
+            if isinstance(excerpt, int) and 1 <= excerpt <= len(self.records):
+                record = self.records[excerpt - 1]
+                self.question_sources[key] = {'path': record['path'], 'chunk': record['chunk']}
+            else:
+                self.question_sources[key] = None
+        return questions
 
 
     def _collect_local_answers(self, questions: dict) -> dict:
@@ -139,6 +248,9 @@ class Evaluator:
 
         For each question in the input dictionary, retrieves the corresponding answer from
         the local model and stores it along with the original question and the reference answer.
+        Each question is answered in a fresh conversation, and up to local_workers questions
+        are answered concurrently. Answers are checkpointed as they arrive, and questions that
+        were already answered in an earlier run are skipped.
 
         Parameters:
             questions (dict): A dictionary where each key is a stringified integer and each value
@@ -148,13 +260,24 @@ class Evaluator:
             dict: A dictionary where each key is the same as in the input, and each value is a list:
                 [question, reference_answer, local_model_answer].
         """
-        local_answers = {}
-        # Iterate over the items in the questions dictionary
-        # to get answers from the local manual assistant.
-        for key, (question, correct_answer) in questions.items():
-            local_response = self.local_ma.send_user_query(question)
-            local_answers[key] = [question, correct_answer, local_response]
-        return local_answers
+        local_answers = dict(self._checkpoint.get('local_answers', {}))
+
+        def answer(key: str):
+            # Answer the question in a fresh conversation with a forked assistant. Every
+            # attempt forks again, so that a retry does not resend the prompt of a failed one.
+            question, correct_answer = questions[key]
+            local_response = self._call_llm(lambda: self.local_ma.fork().send_user_query(question))
+            with self._checkpoint_lock:
+                local_answers[key] = [question, correct_answer, local_response]
+                self._save_checkpoint('local_answers', dict(local_answers))
+
+        # Get answers from the local manual assistant for the questions
+        # that have not been answered yet.
+        remaining = [key for key in questions if key not in local_answers]
+        with ThreadPoolExecutor(max_workers=max(1, self.local_workers)) as executor:
+            # Consume the results so that exceptions are raised here
+            list(executor.map(answer, remaining))
+        return {key: local_answers[key] for key in questions}
 
     def _evaluate(self) -> dict:
         """
@@ -211,22 +334,29 @@ class Evaluator:
             - A numerical score (1-5)
             - A textual justification for the score
 
+        The path and chunk number of the record each question was generated from are added as
+        well (None for unanswerable questions).
+
         These are transformed into a DataFrame with corresponding columns, along with the manual name
         to enable identification across evaluations.
 
         Returns:
             pd.DataFrame: A DataFrame with columns:
-                ['Manual', 'Question', 'Reference answer', 'Local answer', 'Score', 'Motivation']
+                ['Manual', 'Question', 'Reference answer', 'Local answer', 'Score', 'Motivation',
+                 'Source path', 'Source chunk']
         """
         # Iterate over the items in the evaluation dict and build a dataframe from it
         records = []
         for key, value in self.evaluation.items():
+            source = self.question_sources.get(key) or {}
             records.append({
                 'Manual': self.manual_name,
                 'Question': value[0],
                 'Reference answer': value[1],
                 'Local answer': value[2],
                 'Score': value[3],
-                'Motivation': value[4]
+                'Motivation': value[4],
+                'Source path': source.get('path'),
+                'Source chunk': source.get('chunk')
             })
         return pd.DataFrame(records)
@@ -0,0 +1,88 @@
+"""
+This module provides the LanguageDetector class, a fast, dependency-free language identifier
+for OCR:ed manual pages.
+
+Latin-script languages are told apart by counting frequent function words (stop words),
+which is robust to OCR noise and takes microseconds per page. Pages dominated by other
+scripts (Cyrillic, Greek, Arabic, Hebrew, Chinese, Japanese, Korean, Thai) are identified by
+their Unicode ranges. Pages with too little text to decide are reported as 'unknown'.
+"""
+
+# Perform necessary imports
+import re
+
+# Frequent function words of the supported Latin-script languages
+STOP_WORDS = {
+    'en': "the and of to in is for with on that this be are it or as you your by from not can if will",
+    'de': "der die das und ist nicht mit sie ein eine den zu von auf für sich des dem im werden wenn oder bitte",
+    'fr': "le la les et des est pour une dans que pas sur vous avec ce qui ne sont par au du votre",
+    'es': "el la los las y de que en para con por una del se su no es al como más o este",
+    'it': "il di che la per non con una sono del della gli le si da nel questo è al dei",
+    'pt': "o a os as de que em para com não uma do da no na se por ao seu é",
+    'nl': "de het een en van is dat op te niet met voor zijn er aan als bij uw ook",
+    'sv': "och att det som en på är för med av den inte till har om du kan eller",
+    'da': "og at det som en på er for med af den ikke til har de du kan eller",
+    'no': "og å det som en på er for med av den ikke til har de du kan eller",
+    'fi': "ja on ei se että tai kun jos voi ole sen tämä myös mukaan laite",
+    'pl': "i w nie na się z że do jest to jak po o przez lub aby może",
+    'tr': "ve bir bu için ile da de değil olarak veya daha çok gibi kadar",
+    'cs': "a v se na je že s z do to jako pro by ve nebo",
+    'hu': "a az és hogy nem is egy ez meg de van el csak",
+    'ro': "și de în la cu nu pe o un este pentru sau mai"
+}
+STOP_WORDS = {language: set(words.split()) for language, words in STOP_WORDS.items()}
+
+# Unicode ranges of non-Latin scripts and the language they are reported as
+SCRIPTS = {
+    'ru': re.compile(r'[Ѐ-ӿ]'),
+    'el': re.compile(r'[Ͱ-Ͽ]'),
+    'ar': re.compile(r'[؀-ۿ]'),
+    'he': re.compile(r'[֐-׿]'),
+    'ja': re.compile(r'[぀-ヿ]'),
+    'zh': re.compile(r'[一-鿿]'),
+    'ko': re.compile(r'[가-힯]'),
+    'th': re.compile(r'[฀-๿]')
+}
+
+_WORD = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+class LanguageDetector:
+    """
+    Identifies the language of a text.
+
+    Attributes:
+        min_words (int): The minimum number of stop word hits needed to decide on a
+            Latin-script language.
+        min_script_share (float): The share of letters a non-Latin script must have to win.
+    """
+    def __init__(self, min_words: int = 3, min_script_share: float = 0.3):
+        self.min_words = min_words
+        self.min_script_share = min_script_share
+
+    def detect(self, text: str) -> str:
+        """
+        Identifies the language of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            str: An ISO 639-1 language code, or 'unknown'.
+        """
+        words = _WORD.findall(text.lower())
+        n_letters = sum(len(word) for word in words)
+        if not n_letters:
+            return 'unknown'
+        # Japanese is checked before Chinese, since Japanese text also holds kanji
+        for language, pattern in SCRIPTS.items():
+            if len(pattern.findall(text)) / n_letters >= self.min_script_share:
+                return language
+        # Count the stop words of each language
+        scores = {language: 0 for language in STOP_WORDS}
+        for word in words:
+            for language, stop_words in STOP_WORDS.items():
+                if word in stop_words:
+                    scores[language] += 1
+        language, score = max(scores.items(), key=lambda item: item[1])
+        return language if score >= self.min_words else 'unknown'
@@ -0,0 +1,426 @@
+"""
+This module provides a small abstraction over the chat completion backends used by the
+manual assistant and the evaluator.
+
+It defines an LLMBackend base class with a streaming and a non-streaming call, both of
+which record timings (time to first token, total time and number of output tokens) and
+pass them on to any registered timing hooks. Three implementations are provided:
+
+- OpenAIBackend: The regular OpenAI API.
+- OpenAICompatibleBackend: Any server exposing an OpenAI-compatible API at a base URL.
+- LocalBackend: A bundled local stand-in server (see local_llm_server.py) that streams
+  deterministic tokens with configurable timing, so that the whole pipeline can be
+  tested and profiled without network access. Local backends with the same timing
+  share one server per process.
+
+Any backend can be wrapped in a CachedBackend, which answers repeated calls from a disk cache
+of responses (see response_cache.py) instead of sending them to the model again.
+
+The get_backend function picks an implementation based on environment variables.
+"""
+
+# Perform necessary imports
+import os
+import threading
+import time
+from typing import Callable, Iterator
+from .response_cache import ResponseCache, cache_key
+
+
+class LLMBackend:
+    """
+    Base class for chat completion backends.
+
+    Subclasses implement _complete and _stream. The public complete and stream methods
+    wrap these with timing, store the result in last_timing and call the timing hooks.
+
+    Attributes:
+        model_name (str): The name of the model used for completions.
+        timing_hooks (list): Callables that receive a timing dictionary after each call.
+        last_timing (dict): The timing dictionary of the most recent call made by the
+            current thread, with the keys 'model', 'stream', 'ttft' (seconds), 'total'
+            (seconds), 'output_tokens' and 'cached'.
+    """
+    def __init__(self, model_name: str, timing_hooks: list[Callable] = None):
+        self.model_name = model_name
+        self.timing_hooks = list(timing_hooks or [])
+        # Timings are kept per thread so that a backend can be shared by threads
+        self._local = threading.local()
+
+    @property
+    def last_timing(self) -> dict:
+        return getattr(self._local, 'last_timing', None)
+
+    def add_timing_hook(self, hook: Callable):
+        """
+        Registers a callable that is called with a timing dictionary after each call.
+
+        Args:
+            hook (Callable): A function accepting a single dict argument.
+        """
+        self.timing_hooks.append(hook)
+
+    def complete(self, messages: list[dict], temperature: float = 0.0, **params) -> str:
+        """
+        Sends a list of chat messages to the model and returns the full reply.
+
+        Args:
+            messages (list[dict]): Chat messages in the OpenAI format.
+            temperature (float): The sampling temperature. Defaults to 0.0.
+            **params: Further parameters passed on to the backend.
+
+        Returns:
+            str: The content of the model's reply.
+        """
+        start = time.perf_counter()
+        reply = self._complete(messages, temperature, **params)
+        elapsed = time.perf_counter() - start
+        # Without streaming, the first token arrives together with the last one
+        self._record_timing(False, elapsed, elapsed, self._count_tokens(reply))
+        return reply
+
+    def stream(self, messages: list[dict], temperature: float = 0.0, **params) -> Iterator[str]:
+        """
+        Sends a list of chat messages to the model and yields the reply token by token.
+
+        Args:
+            messages (list[dict]): Chat messages in the OpenAI format.
+            temperature (float): The sampling temperature. Defaults to 0.0.
+            **params: Further parameters passed on to the backend.
+
+        Yields:
+            str: Tokens (text deltas) of the reply as they arrive.
+        """
+        start = time.perf_counter()
+        ttft = None
+        n_tokens = 0
+        for token in self._stream(messages, temperature, **params):
+            if not token:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            n_tokens += 1
+            yield token
+        total = time.perf_counter() - start
+        self._record_timing(True, ttft if ttft is not None else total, total, n_tokens)
+
+    def is_cached(self, messages: list[dict], temperature: float = 0.0, **params) -> bool:
+        """
+        Returns whether the reply to a call would be answered from a cache, without a request
+        to the model. Backends without a cache always return False.
+        """
+        return False
+
+    def close(self):
+        """
+        Releases the resources held by the backend. Backends without any do nothing.
+        """
+
+    def _complete(self, messages: list[dict], temperature: float, **params) -> str:
+        raise NotImplementedError
+
+    def _stream(self, messages: list[dict], temperature: float, **params) -> Iterator[str]:
+        raise NotImplementedError
+
+    def _count_tokens(self, text: str) -> int:
+        # A rough whitespace based count. Streaming calls count deltas instead.
+        return len(text.split()) if text else 0
+
+    def _record_timing(self, stream: bool, ttft: float, total: float, output_tokens: int):
+        # Store the timing and pass it on to the hooks
+        timing = {
+            'model': self.model_name,
+            'stream': stream,
+            'ttft': ttft,
+            'total': total,
+            'output_tokens': output_tokens,
+            'cached': getattr(self._local, 'cached', False)
+        }
+        self._local.last_timing = timing
+        for hook in self.timing_hooks:
+            hook(dict(timing))
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    A backend using the OpenAI chat completions API.
+
+    Attributes:
+        client (OpenAI): The OpenAI client used for the requests.
+    """
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str = None,
+        base_url: str = None,
+        timing_hooks: list[Callable] = None
+    ):
+        """
+        Initializes the backend and the OpenAI client.
+
+        Args:
+            model_name (str): The name of the model used for completions.
+            api_key (str): The API key. Defaults to the openai_api_key environment variable.
+            base_url (str): An optional base URL for the API. Defaults to the OpenAI API.
+            timing_hooks (list[Callable]): Optional timing hooks.
+        """
+        super().__init__(model_name, timing_hooks)
+        # Import here so that importing this module does not load openai
+        from openai import OpenAI
+        self.client = OpenAI(
+            api_key=api_key or os.getenv('openai_api_key'),
+            base_url=base_url
+        )
+
+    def _complete(self, messages: list[dict], temperature: float, **params) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            **params
+        )
+        return response.choices[0].message.content or ""
+
+    def _stream(self, messages: list[dict], temperature: float, **params) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **params
+        )
+        # Iterate over the chunks in the stream and yield the text deltas
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            yield chunk.choices[0].delta.content or ""
+
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    """
+    A backend for any server exposing an OpenAI-compatible chat completions API,
+    for example vLLM, llama.cpp or Ollama.
+    """
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str,
+        api_key: str = None,
+        timing_hooks: list[Callable] = None
+    ):
+        """
+        Initializes the backend.
+
+        Args:
+            model_name (str): The name of the model used for completions.
+            base_url (str): The base URL of the API, for example http://localhost:8000/v1.
+            api_key (str): The API key. Most local servers accept any value.
+            timing_hooks (list[Callable]): Optional timing hooks.
+        """
+        super().__init__(
+            model_name,
+            api_key=api_key or os.getenv('llm_api_key') or 'not-needed',
+            base_url=base_url,
+            timing_hooks=timing_hooks
+        )
+
+
+# The local servers of the process, keyed by their timing, with the number of backends using them
+_local_servers = {}
+_local_servers_lock = threading.Lock()
+
+
+class LocalBackend(OpenAICompatibleBackend):
+    """
+    A backend that talks to the bundled local stand-in server through the OpenAI-compatible
+    API. The server runs in a background thread and is shared by all local backends of the
+    process with the same timing. It is stopped when the last of them is closed.
+
+    Attributes:
+        server (LocalLLMServer): The running local server.
+    """
+    def __init__(
+        self,
+        model_name: str = 'local-stand-in',
+        ttft: float = 0.2,
+        tokens_per_second: float = 50.0,
+        max_tokens: int = 64,
+        timing_hooks: list[Callable] = None
+    ):
+        """
+        Starts a local stand-in server, or reuses the running one, and initializes the backend.
+
+        Args:
+            model_name (str): The model name reported in the replies.
+            ttft (float): Time to first token in seconds.
+            tokens_per_second (float): The rate at which tokens are streamed.
+            max_tokens (int): The number of tokens in each reply.
+            timing_hooks (list[Callable]): Optional timing hooks.
+        """
+        from .local_llm_server import LocalLLMServer
+        self._server_key = (ttft, tokens_per_second, max_tokens)
+        with _local_servers_lock:
+            if self._server_key not in _local_servers:
+                server = LocalLLMServer(
+                    port=0,
+                    ttft=ttft,
+                    tokens_per_second=tokens_per_second,
+                    max_tokens=max_tokens
+                ).start()
+                _local_servers[self._server_key] = [server, 0]
+            entry = _local_servers[self._server_key]
+            entry[1] += 1
+        self.server = entry[0]
+        self._closed = False
+        super().__init__(
+            model_name,
+            base_url=self.server.base_url,
+            timing_hooks=timing_hooks
+        )
+
+    def close(self):
+        """
+        Releases the local server, and stops it if no other backend uses it.
+        """
+        with _local_servers_lock:
+            if self._closed:
+                return
+            self._closed = True
+            entry = _local_servers[self._server_key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _local_servers[self._server_key]
+                entry[0].stop()
+
+
+class CachedBackend(LLMBackend):
+    """
+    A backend answering repeated calls from a disk cache of responses, and passing all
+    other calls on to another backend.
+
+    Calls are keyed by the model name, the messages, the temperature and the other parameters
+    (see response_cache.cache_key), so any change to a prompt is a cache miss. Calls at a
+    temperature above 0 are cached as well: a rerun replays the reply of the first run
+    rather than sampling a new one.
+
+    A cached streamed reply is replayed with the tokens of the original reply, at once or,
+    with replay_timing, at the pace of the original call. The timing of a cached call has
+    'cached' set to True.
+
+    Attributes:
+        backend (LLMBackend): The backend used for calls that are not cached.
+        cache (ResponseCache): The response cache.
+        replay_timing (bool): Whether cached streams are replayed at the original pace.
+    """
+    def __init__(
+        self,
+        backend: LLMBackend,
+        cache: ResponseCache,
+        replay_timing: bool = False,
+        timing_hooks: list[Callable] = None
+    ):
+        super().__init__(backend.model_name, timing_hooks)
+        self.backend = backend
+        self.cache = cache
+        self.replay_timing = replay_timing
+
+    def close(self):
+        self.backend.close()
+
+    def _key(self, messages: list[dict], temperature: float, params: dict) -> str:
+        return cache_key(self.model_name, messages, temperature, params)
+
+    def is_cached(self, messages: list[dict], temperature: float = 0.0, **params) -> bool:
+        return self.cache.contains(self._key(messages, temperature, params))
+
+    def _complete(self, messages: list[dict], temperature: float, **params) -> str:
+        key = self._key(messages, temperature, params)
+        entry = self.cache.get(key)
+        self._local.cached = entry is not None
+        if entry is not None:
+            return ''.join(entry['tokens'])
+        reply = self.backend.complete(messages, temperature, **params)
+        timing = self.backend.last_timing or {}
+        self.cache.put(key, self.model_name, [reply], timing.get('ttft'), timing.get('total'))
+        return reply
+
+    def _stream(self, messages: list[dict], temperature: float, **params) -> Iterator[str]:
+        key = self._key(messages, temperature, params)
+        entry = self.cache.get(key)
+        self._local.cached = entry is not None
+        if entry is not None:
+            yield from self._replay(entry)
+            return
+        # Keep the tokens, and store the reply only if it was streamed to the end
+        tokens = []
+        for token in self.backend.stream(messages, temperature, **params):
+            tokens.append(token)
+            yield token
+        timing = self.backend.last_timing or {}
+        self.cache.put(key, self.model_name, tokens, timing.get('ttft'), timing.get('total'))
+
+    def _replay(self, entry: dict) -> Iterator[str]:
+        # Yield the cached tokens, optionally at the pace of the original call
+        tokens = entry['tokens']
+        if not self.replay_timing or entry.get('ttft') is None:
+            yield from tokens
+            return
+        start = time.perf_counter()
+        ttft, total = entry['ttft'], entry['total'] or entry['ttft']
+        interval = (total - ttft) / max(len(tokens) - 1, 1)
+        for i, token in enumerate(tokens):
+            delay = start + ttft + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield token
+
+
+def get_backend(model_name: str) -> LLMBackend:
+    """
+    Creates a backend based on environment variables.
+
+    The following environment variables are used:
+        llm_backend: 'openai' (default), 'compatible' or 'local'.
+        llm_base_url: The base URL used by the 'compatible' backend.
+        llm_model: Overrides model_name for the 'compatible' and 'local' backends.
+        llm_ttft, llm_tokens_per_second: Timing of the 'local' backend.
+        llm_cache_dir: If set, the backend is wrapped in a CachedBackend using this folder.
+        llm_cache_mode: 'readwrite' (default), 'readonly' (never write to the cache) or 'off'.
+        llm_cache_max_mb: The size of the cache in megabytes (default 512).
+        llm_cache_replay_timing: '1' to replay cached streams at the pace of the original call.
+
+    Args:
+        model_name (str): The model name to use with the OpenAI backend.
+
+    Returns:
+        LLMBackend: The selected backend.
+    """
+    kind = os.getenv('llm_backend', 'openai').lower()
+    if kind == 'openai':
+        backend = OpenAIBackend(model_name)
+    elif kind == 'compatible':
+        base_url = os.getenv('llm_base_url')
+        if not base_url:
+            raise ValueError("llm_base_url must be set when llm_backend is 'compatible'.")
+        backend = OpenAICompatibleBackend(os.getenv('llm_model', model_name), base_url)
+    elif kind == 'local':
+        backend = LocalBackend(
+            os.getenv('llm_model', 'local-stand-in'),
+            ttft=float(os.getenv('llm_ttft', 0.2)),
+            tokens_per_second=float(os.getenv('llm_tokens_per_second', 50.0))
+        )
+    else:
+        raise ValueError(f"Unknown llm_backend '{kind}'. Use 'openai', 'compatible' or 'local'.")
+    # Answer repeated calls from the response cache, if configured
+    cache_dir = os.getenv('llm_cache_dir')
+    mode = os.getenv('llm_cache_mode', 'readwrite').lower()
+    if mode not in ('readwrite', 'readonly', 'off'):
+        raise ValueError(f"Unknown llm_cache_mode '{mode}'. Use 'readwrite', 'readonly' or 'off'.")
+    if not cache_dir or mode == 'off':
+        return backend
+    cache = ResponseCache(
+        cache_dir,
+        max_bytes=int(float(os.getenv('llm_cache_max_mb', 512)) * 2**20),
+        read_only=mode == 'readonly'
+    )
+    return CachedBackend(backend, cache, replay_timing=os.getenv('llm_cache_replay_timing') == '1')
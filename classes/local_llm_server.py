@@ -0,0 +1,239 @@
+"""
+This module provides a local stand-in for an OpenAI-compatible chat completions server.
+
+The server answers POST requests to /v1/chat/completions, both streaming (server-sent
+events) and non-streaming, with deterministic replies: the same messages always give the
+same tokens. The time to first token and the token rate are configurable, which makes the
+server useful for testing and profiling the pipeline without network access.
+
+The server only depends on the standard library. It can be started from python through
+the LocalLLMServer class or from the command line:
+
+    python -m classes.local_llm_server --port 8001 --ttft 0.3 --tokens-per-second 40
+"""
+
+# Perform necessary imports
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_reply_tokens(messages: list[dict], max_tokens: int) -> list[str]:
+    """
+    Creates a deterministic list of reply tokens for a list of chat messages.
+
+    The tokens are words drawn from the last user message, using a random generator
+    seeded with a hash of all messages, so that replies look roughly like manual text.
+
+    Args:
+        messages (list[dict]): Chat messages in the OpenAI format.
+        max_tokens (int): The number of tokens to create.
+
+    Returns:
+        list[str]: The reply tokens. All but the first start with a space.
+    """
+    # Seed a random generator with a hash of the messages
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).digest()
+    rng = random.Random(digest)
+    # Draw words from the last user message, or from a fixed vocabulary if there is none
+    user_texts = [m.get('content') or '' for m in messages if m.get('role') == 'user']
+    words = user_texts[-1].split() if user_texts else []
+    if not words:
+        words = ['the', 'manual', 'describes', 'this', 'feature', 'in', 'detail']
+    return [(' ' if i else '') + rng.choice(words) for i in range(max_tokens)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Request handler for the local stand-in server. The server settings are read
+    from the server object.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Keep the console quiet
+        pass
+
+    def do_GET(self):
+        # List the single available model
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json({
+                'object': 'list',
+                'data': [{'id': 'local-stand-in', 'object': 'model', 'owned_by': 'local'}]
+            })
+        else:
+            self._send_json({'error': {'message': 'Not found'}}, status=404)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json({'error': {'message': 'Not found'}}, status=404)
+            return
+        # Read the request body
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        messages = request.get('messages', [])
+        model = request.get('model', 'local-stand-in')
+        max_tokens = request.get('max_tokens') or self.server.max_tokens
+        tokens = make_reply_tokens(messages, max_tokens)
+        completion_id = 'chatcmpl-local-' + hashlib.sha1(''.join(tokens).encode('utf-8')).hexdigest()[:12]
+        created = int(time.time())
+        usage = {
+            'prompt_tokens': sum(len((m.get('content') or '').split()) for m in messages),
+            'completion_tokens': len(tokens)
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        if request.get('stream'):
+            self._stream_reply(tokens, completion_id, created, model)
+        else:
+            # Wait as long as the full reply would have taken to stream
+            time.sleep(self.server.ttft + self._token_delay() * max(len(tokens) - 1, 0))
+            self._send_json({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': 'stop'
+                }],
+                'usage': usage
+            })
+
+    def _token_delay(self) -> float:
+        rate = self.server.tokens_per_second
+        return 1.0 / rate if rate > 0 else 0.0
+
+    def _stream_reply(self, tokens: list[str], completion_id: str, created: int, model: str):
+        # Send the headers of a server-sent events response
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta: dict, finish_reason: str = None):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        # Wait for the time to first token, then stream tokens at the configured rate
+        time.sleep(self.server.ttft)
+        send_chunk({'role': 'assistant', 'content': ''})
+        delay = self._token_delay()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(delay)
+            send_chunk({'content': token})
+        send_chunk({}, finish_reason='stop')
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LocalLLMServer:
+    """
+    A local OpenAI-compatible server streaming deterministic tokens.
+
+    Attributes:
+        host (str): The host the server binds to.
+        port (int): The port the server listens on. 0 picks a free port on start.
+        ttft (float): Time to first token in seconds.
+        tokens_per_second (float): The rate at which tokens are streamed. 0 means no delay.
+        max_tokens (int): The default number of tokens in each reply.
+    """
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 8001,
+        ttft: float = 0.2,
+        tokens_per_second: float = 50.0,
+        max_tokens: int = 64
+    ):
+        self.host = host
+        self.port = port
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        """
+        The base URL to pass to an OpenAI client.
+        """
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _create_server(self) -> ThreadingHTTPServer:
+        # Create the http server and attach the settings to it
+        httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        httpd.daemon_threads = True
+        httpd.ttft = self.ttft
+        httpd.tokens_per_second = self.tokens_per_second
+        httpd.max_tokens = self.max_tokens
+        self.port = httpd.server_address[1]
+        return httpd
+
+    def start(self) -> "LocalLLMServer":
+        """
+        Starts the server in a background daemon thread.
+
+        Returns:
+            LocalLLMServer: The instance itself, to allow for method chaining.
+        """
+        self._httpd = self._create_server()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server if it is running.
+        """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def serve_forever(self):
+        """
+        Runs the server in the current thread until interrupted.
+        """
+        self._httpd = self._create_server()
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local OpenAI-compatible stand-in server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--ttft', type=float, default=0.2, help='Time to first token in seconds.')
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--max-tokens', type=int, default=64)
+    args = parser.parse_args()
+    server = LocalLLMServer(args.host, args.port, args.ttft, args.tokens_per_second, args.max_tokens)
+    print(f"Serving on {server.base_url} (ttft={args.ttft}s, {args.tokens_per_second} tokens/s)")
+    server.serve_forever()
@@ -2,21 +2,303 @@
 Module: manual_assistant
 
 This module defines the ManualAssistant class, which facilitates sending user queries to
-a gpt-4o-mini model via the OpenAI API. 
+a gpt-4o-mini model via the OpenAI API, or to any other LLM backend (see llm_backend.py).
+
+Retrieved chunks farther from the query than the manual's relevance threshold (see
+relevance_threshold.py) are dropped. If no chunk is left, the canned "can't find that"
+reply is returned right away, without calling the LLM.
+
+Assistants can share a BatchScheduler (see batch_scheduler.py), which runs the query
+embeddings and searches of concurrent users in batches.
+
+An assistant created for ANY_MANUAL answers questions about any manual: the manual routing
+index (see manual_router.py) picks the few manuals closest to the question, and only their
+vector databases are searched. The loaded vector databases are kept in a process-wide cache of
+the most recently used manuals, bounded by the vector_db_cache_size environment variable
+(default 16), so that routing varied questions does not keep every manual in memory.
+
+The vector databases are read from the published snapshot (see snapshots.py). When a new
+snapshot is published, reload_vector_dbs replaces the cached databases one at a time, while
+queries keep being answered from the databases they started with.
 """
 
 
 # Perform necessary imports
 from .vector_database import VectorDatabase
 from .embedder import Embedder
-from .prompt_builder import PromptBuilder
-import os
-from openai import OpenAI
-from openai.types.chat import ChatCompletionChunk
+from .prompt_builder import PromptBuilder, NO_ANSWER, END_MARKER
+from .llm_backend import LLMBackend, get_backend
+from .metrics import METRICS, QueryTrace
+from .relevance_threshold import get_threshold, reload_thresholds
+from .batch_scheduler import BatchScheduler
+from .manual_router import ManualRouter
+from .snapshots import active_dir, load_manifest, verify_file
+from collections import OrderedDict
+from typing import Iterator
 import joblib
-from pathlib import Path
+import os
+import re
+import threading
 import numpy as np
 
+# The manual name of assistants that search all manuals
+ANY_MANUAL = 'Any manual'
+
+# Cache of loaded vector databases, shared by all assistants in the process, least recently used first
+_vector_db_cache = OrderedDict()
+_vector_db_lock = threading.Lock()
+# The largest number of vector databases kept in the cache
+VECTOR_DB_CACHE_SIZE = max(1, int(os.getenv('vector_db_cache_size', 16)))
+_router = None
+
+def load_vector_db(manual_name: str) -> VectorDatabase:
+    """
+    Loads the vector database of a manual, using a process-wide cache.
+
+    The cache keeps the VECTOR_DB_CACHE_SIZE most recently used databases. Assistants of a
+    single manual hold on to their database, so evicting it only frees it once they are gone.
+    Cache hits, misses and evictions are counted, and the memory used by the faiss index is
+    reported as a gauge, in the metrics registry.
+
+    Args:
+        manual_name (str): The name of the manual.
+
+    Returns:
+        VectorDatabase: The vector database of the manual.
+    """
+    with _vector_db_lock:
+        vector_db = _vector_db_cache.get(manual_name)
+        if vector_db is not None:
+            METRICS.inc('manual_assistant_vector_db_cache_total', help='Vector database cache lookups.', result='hit')
+            _vector_db_cache.move_to_end(manual_name)
+            return vector_db
+        METRICS.inc('manual_assistant_vector_db_cache_total', help='Vector database cache lookups.', result='miss')
+        vector_db = joblib.load(active_dir() / manual_name / 'vdb.pkl')
+        _cache_vector_db(manual_name, vector_db)
+        return vector_db
+
+def _cache_vector_db(manual_name: str, vector_db: VectorDatabase):
+    # Add a database to the cache, evicting the least recently used ones beyond the
+    # cache size. Must be called with _vector_db_lock held.
+    _vector_db_cache[manual_name] = vector_db
+    _vector_db_cache.move_to_end(manual_name)
+    while len(_vector_db_cache) > VECTOR_DB_CACHE_SIZE:
+        evicted, _ = _vector_db_cache.popitem(last=False)
+        METRICS.inc('manual_assistant_vector_db_evictions_total', help='Vector databases evicted from the cache.')
+        for name in ('manual_assistant_index_bytes', 'manual_assistant_metadata_bytes'):
+            METRICS.set(name, 0, manual=evicted)
+    _report_vector_db(manual_name, vector_db)
+
+def _report_vector_db(manual_name: str, vector_db: VectorDatabase):
+    # A flat index stores ntotal vectors of d float32 values
+    METRICS.set(
+        'manual_assistant_index_bytes',
+        vector_db.index.ntotal * vector_db.index.d * 4,
+        help='Memory used by the faiss index of each loaded manual.',
+        manual=manual_name
+    )
+    METRICS.set(
+        'manual_assistant_metadata_bytes',
+        vector_db.metadata.nbytes(),
+        help='Memory used by the compact metadata of each loaded manual.',
+        manual=manual_name
+    )
+    METRICS.set('manual_assistant_loaded_indexes', len(_vector_db_cache), help='Number of loaded vector databases.')
+
+def reload_vector_dbs(snapshot: str = None):
+    """
+    Replaces the cached vector databases, and the routing index, with those of the
+    published snapshot, and reloads the relevance thresholds.
+
+    The databases are loaded one at a time, outside the cache lock, and checked against the
+    snapshot manifest before they replace the old ones. Queries that already hold an old
+    database finish with it, so at most one manual is held twice, plus those of in-flight
+    queries. Manuals missing from the new snapshot are dropped from the cache.
+
+    Args:
+        snapshot (str): The name of the new snapshot, for logging. Unused otherwise.
+
+    Raises:
+        ValueError: If a file of the snapshot does not match its manifest.
+    """
+    global _router
+    directory = active_dir()
+    manifest = load_manifest(directory)
+    with _vector_db_lock:
+        manual_names = list(_vector_db_cache)
+    for manual_name in manual_names:
+        relative_path = f'{manual_name}/vdb.pkl'
+        if not (directory / relative_path).exists():
+            with _vector_db_lock:
+                _vector_db_cache.pop(manual_name, None)
+            continue
+        if not verify_file(directory, relative_path, manifest):
+            raise ValueError(f"{relative_path} of snapshot {directory.name} does not match its manifest.")
+        vector_db = joblib.load(directory / relative_path)
+        with _vector_db_lock:
+            # Only replace databases that are still cached, keeping their place in the cache
+            if manual_name in _vector_db_cache:
+                _vector_db_cache[manual_name] = vector_db
+                _report_vector_db(manual_name, vector_db)
+    with _vector_db_lock:
+        if _router is not None:
+            _router = ManualRouter.load(directory / 'router.pkl')
+    # The thresholds file names the snapshot it was calibrated on (see relevance_threshold.py)
+    reload_thresholds()
+    METRICS.inc('manual_assistant_snapshot_reloads_total', help='Number of vector database snapshot reloads.')
+
+def load_router() -> ManualRouter:
+    """
+    Loads the manual routing index, using a process-wide cache.
+
+    Returns:
+        ManualRouter: The router.
+
+    Raises:
+        FileNotFoundError: If the routing index has not been built.
+    """
+    global _router
+    with _vector_db_lock:
+        if _router is None:
+            _router = ManualRouter.load()
+            if _router is None:
+                raise FileNotFoundError("No manual routing index found. Rebuild the vector databases.")
+        return _router
+
+# The tiktoken encodings used to count tokens, by model name
+_encodings = {}
+
+def count_tokens(text: str, model_name: str) -> int:
+    """
+    Counts the tokens of a text with the tiktoken encoding of a model. Models unknown to
+    tiktoken (e.g. local models) are counted with the cl100k_base encoding.
+
+    Args:
+        text (str): The text.
+        model_name (str): The name of the model.
+
+    Returns:
+        int: The number of tokens.
+    """
+    # Import here so that tiktoken is only loaded when the first query is answered
+    import tiktoken
+    encoding = _encodings.get(model_name)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+        _encodings[model_name] = encoding
+    return len(encoding.encode(text))
+
+def count_prompt_tokens(messages: list[dict], model_name: str) -> int:
+    """
+    Counts the tokens of the chat messages sent to a model (see count_tokens), including the
+    few tokens the chat format adds per message.
+
+    Args:
+        messages (list[dict]): The chat messages.
+        model_name (str): The name of the model.
+
+    Returns:
+        int: The number of prompt tokens.
+    """
+    # Every message is wrapped in 3 tokens, and the reply is primed with 3 more
+    return sum(3 + count_tokens(m['content'], model_name) for m in messages) + 3
+
+# Citation tags like [2] or [1, 3] in the answers
+CITATION = re.compile(r'\[(\d+(?:\s*,\s*\d+)*)\]')
+
+def cited_sources(answer: str, chunks: list[dict]) -> list[dict]:
+    """
+    Returns the sources of an answer, from the metadata of the retrieved chunks.
+
+    The excerpts in the prompt are numbered in retrieval order (see PromptBuilder), so a
+    citation tag like [2] in the answer refers to the second retrieved chunk. If the answer
+    cites no excerpt (e.g. with the older prompt, which asks for a list of paths instead),
+    all retrieved chunks count as sources.
+
+    Args:
+        answer (str): The answer of the model.
+        chunks (list[dict]): The retrieved chunks, in the order they were given to the model.
+
+    Returns:
+        list[dict]: One dictionary per page, with the keys 'manual', 'path', 'numbers' (the
+            citation numbers of the chunks of the page), 'regions' (the packed line boxes of the
+            cited chunks on the page, if their layout was stored, see page_layout.py) and, if known,
+            'page', in the order the pages were first cited (or retrieved), without repeated paths.
+    """
+    numbers = [
+        int(number) for tag in CITATION.findall(answer) for number in tag.split(',')
+        if 1 <= int(number) <= len(chunks)
+    ]
+    if not numbers:
+        numbers = list(range(1, len(chunks) + 1))
+    sources = {}
+    for number in numbers:
+        chunk = chunks[number - 1]
+        # Chunks spanning several pages stand for each of their pages
+        paths = chunk.get('paths', [chunk['path']])
+        layout = list(chunk.get('layout') or [])
+        layout += [None] * (len(paths) - len(layout))
+        for path, packed in zip(paths, layout):
+            source = sources.get(path)
+            if source is None:
+                source = sources[path] = {'manual': chunk['manual'], 'path': path, 'numbers': [], 'regions': []}
+                if path == chunk['path'] and 'page' in chunk:
+                    source['page'] = chunk['page']
+            if number not in source['numbers']:
+                source['numbers'].append(number)
+                if packed is not None:
+                    source['regions'].append(packed)
+    return list(sources.values())
+
+class _AnswerFilter:
+    """
+    Separates the answer from what the model writes after the end marker, for a stream of
+    tokens in which the marker may be split over several tokens.
+
+    Attributes:
+        marker (str): The end marker.
+        text (str): The answer received so far.
+        ended (bool): Whether the marker has been seen.
+    """
+    def __init__(self, marker: str):
+        self.marker = marker
+        self.text = ''
+        self.ended = False
+        self._pending = ''
+
+    def feed(self, token: str) -> str:
+        """
+        Adds a token and returns the part of it that can be shown as answer. Text that
+        might be the start of the marker is held back until the next token.
+        """
+        if self.ended:
+            return ''
+        pending = self._pending + token
+        position = pending.find(self.marker)
+        if position >= 0:
+            self.ended = True
+            self._pending = ''
+            return self._emit(pending[:position])
+        # Hold back the longest end of the text that is a start of the marker
+        keep = next((n for n in range(min(len(self.marker) - 1, len(pending)), 0, -1)
+                     if self.marker.startswith(pending[-n:])), 0)
+        self._pending = pending[len(pending) - keep:]
+        return self._emit(pending[:len(pending) - keep])
+
+    def flush(self) -> str:
+        """
+        Returns the text held back at the end of the stream.
+        """
+        pending, self._pending = self._pending, ''
+        return self._emit(pending)
+
+    def _emit(self, text: str) -> str:
+        self.text += text
+        return text
+
 class ManualAssistant:
     """
     A class for answering user questions based on a specific product manual using 
@@ -29,36 +311,218 @@ class ManualAssistant:
 
     Attributes:
         manual_name (str): The name of the manual this assistant will use.
-        vector_db (VectorDatabase): The loaded vector database for the manual.
+        vector_db (VectorDatabase): The vector database of the manual, from the published
+            snapshot (None for ANY_MANUAL).
         embedder (Embedder): Tool to generate embeddings for queries.
         prompt_builder (PromptBuilder): Constructs prompts with manual context.
-        client (OpenAI): OpenAI client for model inference.
-        model_name (str): Name of the OpenAI model used for completion.
+        backend (LLMBackend): The LLM backend used for model inference.
+        model_name (str): Name of the model used for completion.
+        max_distance (float): The relevance threshold. Chunks farther from the query are not
+            used, and queries without any chunk within it are answered without the LLM.
+            None disables the threshold (or, for ANY_MANUAL, uses the threshold of each manual).
+        router (ManualRouter): The manual routing index of the published snapshot, for
+            ANY_MANUAL, else None.
+        route_manuals (int): The number of manuals searched for ANY_MANUAL.
+        scheduler (BatchScheduler): The scheduler batching the query embeddings and searches,
+            or None to embed and search each query on its own.
         messages (list): Running conversation history for the chat.
+        last_trace (dict): Stage timings and token counts of the most recent query
+            (see metrics.py for details).
     """
-    def __init__(self,manual_name:  str,dim: int = 384):
+    def __init__(
+        self,
+        manual_name: str,
+        dim: int = 384,
+        backend: LLMBackend = None,
+        max_distance: float = None,
+        scheduler: BatchScheduler = None,
+        citations: bool = True
+    ):
         """
         Initializes the ManualAssistant with a given manual.
 
         Loads the corresponding vector database from disk, initializes the embedder 
-        and prompt builder, and sets up the OpenAI client for question-answering.
+        and prompt builder, and sets up the LLM backend for question-answering.
 
         Args:
-            manual_name (str): The name of the manual to associate with this assistant.
+            manual_name (str): The name of the manual to associate with this assistant,
+                or ANY_MANUAL to answer questions about any manual.
             dim (int, optional): Dimensionality of the embeddings used. Defaults to 384.
+            backend (LLMBackend, optional): The LLM backend to use. Defaults to the backend
+                selected by get_backend (gpt-4o-mini via the OpenAI API unless configured otherwise).
+            max_distance (float, optional): The relevance threshold. Defaults to the calibrated
+                threshold of the manual, if any.
+            scheduler (BatchScheduler, optional): A scheduler shared by concurrent assistants.
+                Its embedder is used by this assistant as well.
+            citations (bool, optional): Whether the model cites numbered excerpts (True), or
+                lists the paths of its sources after the end marker (False). Defaults to True.
         """
         
         self.manual_name = manual_name
-        # Load the vector database.
-        db_path = Path(__file__).resolve().parent.parent / 'vector_databases' / manual_name / 'vdb.pkl'
-        self.vector_db = joblib.load(db_path)
-        # Initialize an ebedder, a prompt builder and the openai client.
-        self.embedder = Embedder()
-        self.prompt_builder = PromptBuilder()
-        self.client = OpenAI(api_key=os.getenv('openai_api_key'))
+        # Load the vector database, or the routing index if any manual may be used.
+        self.route_manuals = 3
+        if manual_name == ANY_MANUAL:
+            load_router()
+        else:
+            load_vector_db(manual_name)
+        # Initialize an ebedder, a prompt builder and the llm backend.
+        self.scheduler = scheduler
+        self.embedder = scheduler.embedder if scheduler is not None else Embedder()
+        self.prompt_builder = PromptBuilder(citations=citations)
+        self.backend = backend or get_backend('gpt-4o-mini')
         
-        self.model_name = 'gpt-4o-mini'
+        self.model_name = self.backend.model_name
+        if max_distance is None and manual_name != ANY_MANUAL:
+            max_distance = get_threshold(manual_name)
+        self.max_distance = max_distance
         self.messages = []
+        self.last_trace = None
+
+    @property
+    def vector_db(self) -> VectorDatabase:
+        # Looked up per query, so that reloaded snapshots are picked up
+        return load_vector_db(self.manual_name) if self.manual_name != ANY_MANUAL else None
+
+    @property
+    def router(self) -> ManualRouter:
+        return load_router() if self.manual_name == ANY_MANUAL else None
+
+    def fork(self) -> "ManualAssistant":
+        """
+        Creates a new assistant for the same manual with an empty conversation history.
+
+        The vector database, embedder, prompt builder and backend are shared with this
+        assistant, so forking is cheap. Forked assistants can answer questions in
+        separate threads.
+
+        Returns:
+            ManualAssistant: The new assistant.
+        """
+        forked = object.__new__(ManualAssistant)
+        forked.__dict__.update(self.__dict__)
+        forked.messages = []
+        forked.last_trace = None
+        return forked
+
+    def _prepare_prompt(self, user_query: str, trace: QueryTrace) -> tuple[list[dict], list[dict]]:
+        """
+        Embeds the user query, retrieves the most relevant chunks and builds the prompt.
+        Each step is timed as a stage of the given trace.
+
+        Parameters:
+            user_query (str): The natural language question provided by the user.
+            trace (QueryTrace): The trace of the current query.
+
+        Returns:
+            tuple[list[dict], list[dict]]: The prompt built by the prompt builder, and the
+                retrieved chunks.
+        """
+        # Create the query embedding
+        with trace.span('embed'):
+            if self.scheduler is not None:
+                query_embedding = self.scheduler.embed(user_query)
+            else:
+                query_embedding, _ = self.embedder.encode([{"text": user_query}])
+                query_embedding = np.array(query_embedding, dtype=np.float32)
+        # Get the top five manual text chunks related to the query, within the relevance threshold
+        if self.manual_name == ANY_MANUAL:
+            top_chunks = self._search_any_manual(query_embedding, trace)
+        else:
+            with trace.span('search'):
+                top_chunks = self._search(self.vector_db, query_embedding, self.max_distance)
+        if not top_chunks:
+            METRICS.inc(
+                'manual_assistant_no_context_total',
+                help='Queries answered without an LLM call, since no chunk was within the relevance threshold.'
+            )
+        else:
+            trace.counts['top_distance'] = top_chunks[0]['distance']
+        # Build the prompt
+        with trace.span('prompt'):
+            prompt = self.prompt_builder.build_prompt(user_query, top_chunks, current_manual=self.manual_name)
+        trace.counts['retrieved_chunks'] = len(top_chunks)
+        return prompt, top_chunks
+
+    def _search(self, vector_db: VectorDatabase, query_embedding: np.ndarray, max_distance: float) -> list[dict]:
+        # Search a vector database for the top five chunks, through the scheduler if there is one
+        if self.scheduler is not None:
+            return self.scheduler.search(vector_db, query_embedding, top_k=5, max_distance=max_distance)
+        return vector_db.search_manual(query_embedding, top_k=5, max_distance=max_distance)[0]
+
+    def _search_any_manual(self, query_embedding: np.ndarray, trace: QueryTrace) -> list[dict]:
+        """
+        Routes the query to the closest manuals, searches them and merges the hits.
+
+        Parameters:
+            query_embedding (np.ndarray): The query embedding.
+            trace (QueryTrace): The trace of the current query.
+
+        Returns:
+            list[dict]: The top five chunks of the searched manuals, closest first.
+        """
+        with trace.span('route'):
+            candidates = self.router.route(query_embedding, top_n=self.route_manuals)
+        with trace.span('search'):
+            hits = []
+            for manual_name, _ in candidates:
+                max_distance = self.max_distance if self.max_distance is not None else get_threshold(manual_name)
+                hits.extend(self._search(load_vector_db(manual_name), query_embedding, max_distance))
+        trace.counts['routed_manuals'] = len(candidates)
+        return sorted(hits, key=lambda hit: hit['distance'])[:5]
+
+    def _add_llm_timing(self, trace: QueryTrace):
+        # Copy the timings of the finished llm call to the trace. The generation stage
+        # is the time after the first token, so that the stages add up to the total.
+        timing = self.backend.last_timing
+        if timing:
+            trace.add_stage('ttft', timing['ttft'])
+            trace.add_stage('generation', timing['total'] - timing['ttft'])
+            trace.counts['output_tokens'] = timing['output_tokens']
+
+    def _finish_trace(self, trace: QueryTrace):
+        # Finish the trace. A reply whose stream was closed early has no llm timings.
+        if trace.counts.get('llm_called') and 'ttft' not in trace.stages:
+            trace.counts['cancelled'] = 1
+        self.last_trace = trace.finish()
+
+    def _stream(self, user_query: str, trace: QueryTrace) -> tuple[list[dict], Iterator[str]]:
+        """
+        Prepares the prompt of a query and starts streaming the reply.
+
+        Parameters:
+            user_query (str): The natural language question provided by the user.
+            trace (QueryTrace): The trace of the current query.
+
+        Returns:
+            tuple[list[dict], Iterator[str]]: The retrieved chunks, and an iterator over the
+                tokens of the reply, which adds the full reply to the message history when
+                it is exhausted.
+        """
+        # Embed the query, search the vector database and build the prompt.
+        # Then add the prompt to the messages produced so far
+        new_prompt, top_chunks = self._prepare_prompt(user_query, trace)
+        if not self.messages:
+            self.messages.append(new_prompt[0])
+        self.messages.append(new_prompt[1])
+
+        def tokens():
+            if not len(new_prompt) == 3:
+                # Send the prompt (full message history actually) to the model and make sure it streams the result back.
+                # Iterate over the tokens in the stream and yield them one by one.
+                # Also, save the full text to the messages list.
+                full_text = ""
+                trace.counts['llm_called'] = 1
+                trace.counts['prompt_tokens'] = count_prompt_tokens(self.messages, self.model_name)
+                for token in self.backend.stream(self.messages, temperature=0.0):
+                    full_text += token
+                    yield token
+                self._add_llm_timing(trace)
+                self.messages.append({"role": "assistant", "content": full_text})
+            else:
+                yield new_prompt[2]['content']
+                self.messages.append(new_prompt[2])
+
+        return top_chunks, tokens()
 
     def stream_user_query(self, user_query: str):
         """
@@ -68,51 +532,69 @@ class ManualAssistant:
         1. Encodes the user query into an embedding.
         2. Retrieves the top-k most relevant text chunks from the associated manual using a vector database.
         3. Constructs a prompt using these chunks and appends it to the ongoing message history.
-        4. Sends the prompt to the OpenAI API with streaming enabled.
+        4. Sends the prompt to the LLM backend with streaming enabled.
         5. Yields tokens incrementally as they are received from the model.
         6. Appends the full assistant response to the message history for future context.
 
+        The tokens are yielded as the model writes them, including the end marker and the
+        sources listed by the model. See stream_events for a stream of typed events instead.
+
         Parameters:
             user_query (str): The natural language question provided by the user.
 
         Yields:
             str: Individual tokens from the assistant's streamed response.
         """
-        # Create the query embedding
-        query_embedding, _ = self.embedder.encode([{"text": user_query}])
-        query_embedding = np.array(query_embedding, dtype=np.float32)
-        
-        # Get the top five manual text chunks related to the query 
-        top_chunks = self.vector_db.search_manual(query_embedding,5)[0]
-        # Build the prompt and add it to the messages produced so far
-        new_prompt = self.prompt_builder.build_prompt(user_query, top_chunks, current_manual=self.manual_name)
-        if not self.messages:
-            self.messages.append(new_prompt[0])
-        self.messages.append(new_prompt[1])
-        
-        if not len(new_prompt) == 3:
-            # Send the prompt (full message history actually) to the model and make sure it streams the result back
-            stream = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=self.messages,
-                temperature=0.0,
-                stream=True,
-            )
-            # Iterate over the chunks in the stream and yield them one by one.
-            # Also, save the full text to the messages list.
-            full_text = ""
-            for chunk in stream:
-                if isinstance(chunk, ChatCompletionChunk):
-                    delta = chunk.choices[0].delta
-                    token = delta.content or ""
-                    full_text += token
-                    yield token
+        trace = QueryTrace(self.manual_name)
+        _, tokens = self._stream(user_query, trace)
+        # Record the trace even if the consumer stops early
+        try:
+            yield from tokens
+        finally:
+            self._finish_trace(trace)
+
+    def stream_events(self, user_query: str) -> Iterator[dict]:
+        """
+        Streams the answer to a user query as typed events, so that clients do not have to
+        parse the model output.
+
+        The events are dictionaries with a 'type' key:
+
+        - {'type': 'token', 'text': str}: A piece of the answer. The end marker and the
+          sources listed by the model after it are never part of the tokens, even when the
+          marker is split over several tokens.
+        - {'type': 'answer_end', 'text': str}: The full answer, sent once after the last token.
+        - {'type': 'sources', 'sources': list[dict]}: The pages the answer is based on, taken
+          from the metadata of the retrieved chunks it cites (see cited_sources). Empty if
+          the assistant could not find the answer.
+        - {'type': 'timings', 'trace': dict}: The stage timings and token counts of the
+          query (see last_trace).
+
+        Parameters:
+            user_query (str): The natural language question provided by the user.
+
+        Yields:
+            dict: The events, in the order listed above.
+        """
+        trace = QueryTrace(self.manual_name)
+        top_chunks, tokens = self._stream(user_query, trace)
+        answer = _AnswerFilter(END_MARKER)
+        # Record the trace even if the consumer stops early
+        try:
+            for token in tokens:
+                text = answer.feed(token)
+                if text:
+                    yield {'type': 'token', 'text': text}
+            text = answer.flush()
+            if text:
+                yield {'type': 'token', 'text': text}
+            yield {'type': 'answer_end', 'text': answer.text.strip()}
+            found = top_chunks and NO_ANSWER not in answer.text
+            yield {'type': 'sources', 'sources': cited_sources(answer.text, top_chunks) if found else []}
+        finally:
+            self._finish_trace(trace)
+        yield {'type': 'timings', 'trace': self.last_trace}
 
-            self.messages.append({"role": "assistant", "content": full_text})
-        else:
-            yield new_prompt[2]['content']
-            self.messages.append(new_prompt[2])
-    
     def send_user_query(self,user_query: str) -> str:
         """
         Sends a user query to the model and returns the full assistant response.
@@ -121,7 +603,7 @@ class ManualAssistant:
         1. Encodes the user query into an embedding vector.
         2. Retrieves the top-k most relevant manual chunks using a vector similarity search.
         3. Constructs a prompt using the query and retrieved chunks, and appends it to the conversation history.
-        4. Sends the entire message history to the OpenAI API to get a non-streamed assistant response.
+        4. Sends the entire message history to the LLM backend to get a non-streamed assistant response.
         5. Appends the assistant's reply to the message history.
         
         Parameters:
@@ -130,28 +612,24 @@ class ManualAssistant:
         Returns:
             str: The assistant's full response as a string.
         """
-        # Create the query embedding
-        query_embedding, _ = self.embedder.encode([{"text": user_query}])
-        query_embedding = np.array(query_embedding, dtype=np.float32)
-        # Get the top five manual text chunks related to the query 
-        top_chunks = self.vector_db.search_manual(query_embedding, self.manual_name, top_k=5)[0]
-        # Build the prompt and add it to the messages produced so far
-        prompt = self.prompt_builder.build_prompt(user_query, top_chunks, current_manual=self.manual_name)
+        # Embed the query, search the vector database and build the prompt.
+        # Then add the prompt to the messages produced so far
+        trace = QueryTrace(self.manual_name)
+        prompt, _ = self._prepare_prompt(user_query, trace)
         if not self.messages:
             self.messages.append(prompt[0])
         self.messages.append(prompt[1])
         if not len(prompt) == 3:
-            # Send the prompt (full message history actually) to the model.
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=self.messages,
-                temperature=0.0
-            )
-            # Extract the reply and add it to the messages list
-            assistant_reply = response.choices[0].message.content
+            # Send the prompt (full message history actually) to the model
+            # and add the reply to the messages list
+            trace.counts['llm_called'] = 1
+            trace.counts['prompt_tokens'] = count_prompt_tokens(self.messages, self.model_name)
+            assistant_reply = self.backend.complete(self.messages, temperature=0.0)
+            self._add_llm_timing(trace)
             self.messages.append({"role": "assistant", "content": assistant_reply})
         else:
             assistant_reply = prompt[2]['content']
             self.messages.append(prompt[2])
+        self._finish_trace(trace)
 
         return assistant_reply
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+This module provides the ManualRouter class, a small index of per-manual summary vectors used
+to find the manuals most likely to answer a question without searching every manual.
+
+Each manual is summarized by a few representative vectors: the centroids of a k-means
+clustering of its chunk embeddings, normalized to unit length. With a few hundred manuals
+this amounts to a few thousand vectors, which are searched exhaustively with a single matrix
+product in well under a millisecond. A manual's distance to a query is the distance of its
+closest representative, and the top candidate manuals are then searched in full (see
+ManualAssistant's "any manual" mode).
+
+The router is built together with the vector databases (see db_creator.py and
+build_pipeline.py) and stored as router.pkl next to them (see snapshots.py).
+"""
+
+# Perform necessary imports
+from pathlib import Path
+import joblib
+import numpy as np
+from .snapshots import active_dir
+
+
+def default_router_path() -> Path:
+    """
+    Returns the path of the routing index of the vector databases in use.
+    """
+    return active_dir() / 'router.pkl'
+
+
+def summarize_embeddings(embeddings: np.ndarray, representatives: int = 4, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Summarizes the chunk embeddings of a manual by a few representative vectors.
+
+    Args:
+        embeddings (np.ndarray): The chunk embeddings, of shape (n, dim).
+        representatives (int): The largest number of representatives.
+        iterations (int): The number of k-means iterations.
+        seed (int): The random seed of the initial centroids.
+
+    Returns:
+        np.ndarray: Unit-length float32 representatives, of shape (min(n, representatives), dim).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    k = min(len(embeddings), representatives)
+    if k == 0:
+        return np.empty((0, embeddings.shape[1] if embeddings.ndim == 2 else 0), dtype=np.float32)
+    # Run a few iterations of k-means, starting from randomly chosen embeddings
+    rng = np.random.default_rng(seed)
+    centroids = embeddings[rng.choice(len(embeddings), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (
+            (embeddings ** 2).sum(axis=1, keepdims=True)
+            - 2 * embeddings @ centroids.T
+            + (centroids ** 2).sum(axis=1)
+        )
+        labels = distances.argmin(axis=1)
+        for j in range(k):
+            members = embeddings[labels == j]
+            if len(members):
+                centroids[j] = members.mean(axis=0)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    return centroids / np.maximum(norms, 1e-12)
+
+
+class ManualRouter:
+    """
+    Finds the manuals closest to a query embedding.
+
+    Attributes:
+        dim (int): The dimension of the embeddings.
+        representatives (int): The largest number of representatives per manual.
+        manuals (list[str]): The routed manuals.
+        vectors (np.ndarray): The representatives of all manuals, of shape (n, dim).
+        owners (np.ndarray): The position in manuals of the manual each representative belongs to.
+    """
+    def __init__(self, dim: int = 384, representatives: int = 4):
+        self.dim = dim
+        self.representatives = representatives
+        self.manuals = []
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.owners = np.empty(0, dtype=np.int32)
+
+    def add_manual(self, manual_name: str, embeddings: np.ndarray):
+        """
+        Adds (or replaces) a manual, summarized from its chunk embeddings.
+
+        Args:
+            manual_name (str): The name of the manual.
+            embeddings (np.ndarray): The chunk embeddings of the manual.
+        """
+        self.add_representatives(manual_name, summarize_embeddings(embeddings, self.representatives))
+
+    def add_representatives(self, manual_name: str, vectors: np.ndarray):
+        """
+        Adds (or replaces) a manual from precomputed representatives (see summarize_embeddings).
+
+        Args:
+            manual_name (str): The name of the manual.
+            vectors (np.ndarray): The representatives of the manual.
+        """
+        self.remove_manual(manual_name)
+        if not len(vectors):
+            return
+        self.manuals.append(manual_name)
+        self.vectors = np.concatenate([self.vectors, np.asarray(vectors, dtype=np.float32)])
+        self.owners = np.concatenate([self.owners, np.full(len(vectors), len(self.manuals) - 1, dtype=np.int32)])
+
+    def remove_manual(self, manual_name: str):
+        """
+        Removes a manual, if present.
+
+        Args:
+            manual_name (str): The name of the manual.
+        """
+        if manual_name not in self.manuals:
+            return
+        position = self.manuals.index(manual_name)
+        keep = self.owners != position
+        self.vectors = self.vectors[keep]
+        self.owners = self.owners[keep]
+        self.owners[self.owners > position] -= 1
+        del self.manuals[position]
+
+    def route(self, query_embedding: np.ndarray, top_n: int = 3) -> list[tuple]:
+        """
+        Finds the manuals closest to a query.
+
+        Args:
+            query_embedding (np.ndarray): The query embedding, of shape (dim,) or (1, dim).
+            top_n (int): The number of manuals to return.
+
+        Returns:
+            list[tuple[str, float]]: (manual name, squared L2 distance of its closest
+                representative) pairs, closest first.
+        """
+        if not self.manuals:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        distances = ((self.vectors - query) ** 2).sum(axis=1)
+        # Keep the closest representative of each manual
+        best = np.full(len(self.manuals), np.inf, dtype=np.float32)
+        np.minimum.at(best, self.owners, distances)
+        top = np.argsort(best)[:top_n]
+        return [(self.manuals[i], float(best[i])) for i in top]
+
+    def save(self, path: Path = None):
+        """
+        Saves the router.
+
+        Args:
+            path (Path): The file to save the router to. Defaults to default_router_path().
+        """
+        joblib.dump(self, path or default_router_path())
+
+    @staticmethod
+    def load(path: Path = None) -> "ManualRouter":
+        """
+        Loads a saved router.
+
+        Args:
+            path (Path): The router file. Defaults to default_router_path().
+
+        Returns:
+            ManualRouter: The router, or None if there is no router file.
+        """
+        path = Path(path or default_router_path())
+        return joblib.load(path) if path.exists() else None
+
+    @classmethod
+    def from_vector_databases(cls, base_dir: Path, representatives: int = 4) -> "ManualRouter":
+        """
+        Builds a router from existing vector databases, by reading the vectors back from
+        their flat faiss indexes.
+
+        Args:
+            base_dir (Path): The vector_databases folder.
+            representatives (int): The largest number of representatives per manual.
+
+        Returns:
+            ManualRouter: The router.
+        """
+        router = None
+        for db_path in sorted(Path(base_dir).glob('*/vdb.pkl')):
+            vdb = joblib.load(db_path)
+            if router is None:
+                router = cls(dim=vdb.index.d, representatives=representatives)
+            if vdb.index.ntotal:
+                router.add_manual(db_path.parent.name, vdb.index.reconstruct_n(0, vdb.index.ntotal))
+        return router or cls(representatives=representatives)
@@ -0,0 +1,269 @@
+"""
+This module provides lightweight latency instrumentation and metrics for the query path.
+
+It defines:
+
+- MetricsRegistry: A thread-safe registry of counters, gauges and histograms that can be
+  rendered in the Prometheus text exposition format.
+- QueryTrace: A per-query record of stage timings (spans) and token counts, which is
+  logged as a structured (JSON) log line when the query is finished.
+- start_metrics_server: Starts a small http server exposing the registry at /metrics.
+
+A module-level registry, METRICS, is shared by all assistants in a process.
+"""
+
+# Perform necessary imports
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('manual_assistant.metrics')
+
+# Histogram buckets (seconds) for stage latencies
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    # Labels are stored as sorted tuples so that they can be used as dict keys
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label_value(value) -> str:
+    # Escape backslashes, double quotes and line feeds, as the text exposition format requires
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in items) + '}'
+
+
+class MetricsRegistry:
+    """
+    A thread-safe registry of counters, gauges and histograms.
+
+    Attributes:
+        counters (dict): Maps (name, labels) to a monotonically increasing value.
+        gauges (dict): Maps (name, labels) to the last set value.
+        histograms (dict): Maps (name, labels) to bucket counts, sum and count.
+        help (dict): Maps metric names to help strings.
+    """
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, help: str = None, **labels):
+        """
+        Increases a counter.
+
+        Args:
+            name (str): The metric name.
+            value (float): The amount to increase the counter with. Defaults to 1.
+            help (str): An optional help string for the metric.
+            **labels: Metric labels.
+        """
+        with self._lock:
+            key = (name, _label_key(labels))
+            self.counters[key] = self.counters.get(key, 0.0) + value
+            if help:
+                self.help[name] = help
+
+    def set(self, name: str, value: float, help: str = None, **labels):
+        """
+        Sets a gauge.
+
+        Args:
+            name (str): The metric name.
+            value (float): The new value of the gauge.
+            help (str): An optional help string for the metric.
+            **labels: Metric labels.
+        """
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = float(value)
+            if help:
+                self.help[name] = help
+
+    def observe(self, name: str, value: float, help: str = None, **labels):
+        """
+        Adds an observation to a histogram.
+
+        Args:
+            name (str): The metric name.
+            value (float): The observed value.
+            help (str): An optional help string for the metric.
+            **labels: Metric labels.
+        """
+        with self._lock:
+            key = (name, _label_key(labels))
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = hist
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+            if help:
+                self.help[name] = help
+
+    def to_prometheus(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics as text.
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    if name in self.help:
+                        lines.append(f"# HELP {name} {self.help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric_name, key), value in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append(f"{name}{_format_labels(key)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for (metric_name, key), hist in sorted(self.histograms.items()):
+                    if metric_name != name:
+                        continue
+                    for bound, count in zip(self.buckets, hist['buckets']):
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {hist['count']}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {hist['sum']}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+# The registry shared by all assistants in the process
+METRICS = MetricsRegistry()
+
+
+class QueryTrace:
+    """
+    Collects stage timings and token counts for a single query.
+
+    Stages are timed with the span context manager. When the query is finished, finish
+    records the total time, updates the registry and writes a structured log line.
+
+    Attributes:
+        manual (str): The manual the query was asked about.
+        stages (dict): Maps stage names to durations in seconds.
+        counts (dict): Token counts and other per-query numbers.
+        registry (MetricsRegistry): The registry that is updated.
+    """
+    def __init__(self, manual: str, registry: MetricsRegistry = None):
+        self.manual = manual
+        self.stages = {}
+        self.counts = {}
+        self.registry = registry or METRICS
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Times a stage of the query path.
+
+        Args:
+            stage (str): The name of the stage, for example 'embed' or 'search'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - start)
+
+    def add_stage(self, stage: str, seconds: float):
+        """
+        Records the duration of a stage that was timed elsewhere.
+
+        Args:
+            stage (str): The name of the stage.
+            seconds (float): The duration of the stage in seconds.
+        """
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.registry.observe(
+            'manual_assistant_stage_seconds',
+            seconds,
+            help='Duration of each stage of the query path.',
+            stage=stage
+        )
+
+    def finish(self) -> dict:
+        """
+        Records the total duration, updates token counters and logs the trace.
+
+        Returns:
+            dict: The trace as a dictionary (see to_dict).
+        """
+        self.add_stage('total', time.perf_counter() - self._start)
+        self.registry.inc('manual_assistant_queries_total', help='Number of answered queries.')
+        for name, value in self.counts.items():
+            if name.endswith('_tokens'):
+                self.registry.inc(
+                    'manual_assistant_tokens_total',
+                    value,
+                    help='Number of tokens sent to and received from the LLM.',
+                    kind=name[:-len('_tokens')]
+                )
+        trace = self.to_dict()
+        logger.info(json.dumps({'event': 'query', **trace}))
+        return trace
+
+    def to_dict(self) -> dict:
+        """
+        Returns the trace as a dictionary with the keys 'manual', 'stages' and 'counts'.
+        """
+        return {'manual': self.manual, 'stages': dict(self.stages), 'counts': dict(self.counts)}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the registry of the server at /metrics.
+    """
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.registry.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int = 9100, host: str = '127.0.0.1', registry: MetricsRegistry = None):
+    """
+    Starts an http server exposing the metrics at /metrics in a background thread.
+
+    Args:
+        port (int): The port to listen on. Defaults to 9100.
+        host (str): The host to bind to. Defaults to localhost.
+        registry (MetricsRegistry): The registry to expose. Defaults to METRICS.
+
+    Returns:
+        ThreadingHTTPServer: The running server. Call shutdown() to stop it.
+    """
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.registry = registry or METRICS
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
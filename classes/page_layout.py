@@ -0,0 +1,238 @@
+"""
+This module captures the layout of manual pages, so that the app can show the region of a page
+a chunk was taken from instead of the whole page image.
+
+The layout of a page holds the bounding box, in pixels of the page image, of every word and
+line of its text:
+
+    {'size': [width, height], 'tokens': [word, ...], 'words': [[x0, y0, x1, y1, line], ...], 'lines': [[x0, y0, x1, y1], ...]}
+
+It is read from the word-level output of tesseract (image_to_data, the TSV form of hOCR) for
+page images, and from the text layer of PDF pages (see text_extractor.py). The text of the page
+is rebuilt from the same words, so that the chunks of the page can be located again: locate_chunk
+aligns the words of a chunk with those of its page(s) and returns the boxes of the lines holding
+matched words. The page layouts are only used during the build.
+
+The line boxes of a chunk are stored with its record as its 'layout', one entry per page of the
+chunk ('path', or 'paths' for chunks spanning several pages). Each entry packs the page size and
+the line boxes into an array of 16-bit integers, base64 encoded so that it can be stored as JSON
+in the record store, which keeps the metadata of the vector databases small (see
+compact_metadata.py):
+
+    [width, height, x0, y0, x1, y1, x0, y0, x1, y1, ...]
+
+crop_snippet cuts the lines of one or more chunks out of the page image and highlights them,
+giving a small image to show in place of the full page.
+"""
+
+# Perform necessary imports
+import base64
+import io
+import re
+import sys
+from array import array
+from difflib import SequenceMatcher
+
+# Words are compared without case and surrounding punctuation
+_PUNCTUATION = re.compile(r'^\W+|\W+$')
+
+
+def _normalize(word: str) -> str:
+    # Words of punctuation only are kept as they are
+    return _PUNCTUATION.sub('', word).lower() or word
+
+
+def _build(words: list[tuple], size: tuple) -> tuple[str, dict]:
+    """
+    Builds the text and the layout of a page from its words.
+
+    Args:
+        words (list[tuple]): (x0, y0, x1, y1, text, paragraph key, line key) tuples, in reading order.
+        size (tuple): The width and height of the page image.
+
+    Returns:
+        tuple[str, dict]: The text, with one line per text line and an empty line between
+            paragraphs, and the layout.
+    """
+    layout = {'size': [int(size[0]), int(size[1])], 'tokens': [], 'words': [], 'lines': []}
+    paragraphs = []
+    current_line = current_paragraph = None
+    for x0, y0, x1, y1, text, paragraph, line in words:
+        box = [int(round(x0)), int(round(y0)), int(round(x1)), int(round(y1))]
+        if (paragraph, line) != current_line:
+            # Start a new line, and a new paragraph if needed
+            if paragraph != current_paragraph:
+                paragraphs.append([])
+                current_paragraph = paragraph
+            paragraphs[-1].append([])
+            layout['lines'].append(list(box))
+            current_line = (paragraph, line)
+        paragraphs[-1][-1].append(text)
+        line_box = layout['lines'][-1]
+        line_box[:] = [min(line_box[0], box[0]), min(line_box[1], box[1]), max(line_box[2], box[2]), max(line_box[3], box[3])]
+        layout['tokens'].append(text)
+        layout['words'].append(box + [len(layout['lines']) - 1])
+    text = '\n\n'.join('\n'.join(' '.join(line) for line in paragraph) for paragraph in paragraphs)
+    return text, layout
+
+
+def tesseract_layout(image) -> tuple[str, dict]:
+    """
+    Runs tesseract on a page image and returns its text and layout.
+
+    Args:
+        image (Image): The page image.
+
+    Returns:
+        tuple[str, dict]: The text and the layout of the page.
+    """
+    import pytesseract
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    words = [
+        (
+            data['left'][i], data['top'][i], data['left'][i] + data['width'][i], data['top'][i] + data['height'][i],
+            data['text'][i], (data['block_num'][i], data['par_num'][i]), data['line_num'][i]
+        )
+        for i in range(len(data['text']))
+        # Level 5 rows are words. Empty words are layout elements without text.
+        if data['level'][i] == 5 and data['text'][i].strip()
+    ]
+    return _build(words, image.size)
+
+
+def pdf_layout(pdf_page, image_size: tuple) -> tuple[str, dict]:
+    """
+    Reads the words of the text layer of a PDF page and returns its text and layout, with the
+    boxes scaled from PDF points to the pixels of the rendered page image.
+
+    Args:
+        pdf_page (fitz.Page): The PDF page.
+        image_size (tuple): The width and height of the rendered page image.
+
+    Returns:
+        tuple[str, dict]: The text and the layout of the page.
+    """
+    scale_x = image_size[0] / pdf_page.rect.width
+    scale_y = image_size[1] / pdf_page.rect.height
+    # get_text('words') gives (x0, y0, x1, y1, word, block, line, word number) tuples
+    words = [
+        (x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y, text, block, line)
+        for x0, y0, x1, y1, text, block, line, _ in sorted(pdf_page.get_text('words'), key=lambda w: (w[5], w[6], w[7]))
+    ]
+    return _build(words, image_size)
+
+
+def pack_boxes(size: tuple, boxes: list) -> str:
+    """
+    Packs a page size and boxes into a base64 encoded array of 16-bit integers.
+
+    Args:
+        size (tuple): The width and height of the page image.
+        boxes (list): The (x0, y0, x1, y1) boxes.
+
+    Returns:
+        str: The packed boxes.
+    """
+    values = array('H', [min(max(int(v), 0), 0xFFFF) for v in (*size[:2], *(v for box in boxes for v in box[:4]))])
+    # Store little-endian on every platform
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def unpack_boxes(packed: str) -> tuple[tuple, list]:
+    """
+    Unpacks boxes packed by pack_boxes.
+
+    Args:
+        packed (str): The packed boxes.
+
+    Returns:
+        tuple[tuple, list]: The page size and the list of (x0, y0, x1, y1) boxes.
+    """
+    values = array('H')
+    values.frombytes(base64.b64decode(packed))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    boxes = [tuple(values[i:i + 4]) for i in range(2, len(values) - 3, 4)]
+    return (values[0], values[1]), boxes
+
+
+def locate_chunk(chunk: str, layouts: list[dict]) -> list:
+    """
+    Finds the lines of a chunk on its page(s).
+
+    The words of the chunk are aligned with the words of the pages, so that small differences
+    (e.g. sentences joined across a page break, or words split by the sentence segmenter) do
+    not prevent the chunk from being found.
+
+    Args:
+        chunk (str): The text of the chunk.
+        layouts (list[dict]): The layouts of the pages the chunk was taken from, in page order.
+            Pages without a layout are None.
+
+    Returns:
+        list: For each page, the packed boxes (see pack_boxes) of the lines holding matched
+            words, or None if no words of the chunk were found on the page.
+    """
+    chunk_words = [_normalize(word) for word in chunk.split()]
+    page_words, owners = [], []
+    for position, layout in enumerate(layouts):
+        if layout is None:
+            continue
+        page_words.extend(_normalize(token) for token in layout['tokens'])
+        owners.extend((position, i) for i in range(len(layout['tokens'])))
+    matcher = SequenceMatcher(None, page_words, chunk_words, autojunk=False)
+    lines = [set() for _ in layouts]
+    for block in matcher.get_matching_blocks():
+        # Single common words matched far from the chunk would stretch its region
+        if block.size < 2 and len(chunk_words) > 3:
+            continue
+        for offset in range(block.size):
+            position, i = owners[block.a + offset]
+            lines[position].add(layouts[position]['words'][i][4])
+    return [
+        pack_boxes(layout['size'], [layout['lines'][line] for line in sorted(page_lines)]) if page_lines else None
+        for layout, page_lines in zip(layouts, lines)
+    ]
+
+
+def crop_snippet(image_path: str, regions: list[str], padding: int = 20, max_width: int = 900, quality: int = 80) -> bytes:
+    """
+    Cuts the lines of one or more chunks out of a page image and highlights them.
+
+    Args:
+        image_path (str): The path to the page image.
+        regions (list[str]): The packed line boxes of the chunks on this page (see locate_chunk).
+        padding (int): The margin around the lines, in pixels of the page image.
+        max_width (int): The largest width of the snippet. Wider crops are scaled down.
+        quality (int): The JPEG quality.
+
+    Returns:
+        bytes: The snippet as a JPEG image.
+    """
+    from PIL import Image, ImageDraw
+    with Image.open(image_path) as page:
+        page = page.convert('RGB')
+    # The layout may have been captured at another resolution than that of the image
+    lines = []
+    for packed in regions:
+        (width, height), boxes = unpack_boxes(packed)
+        scale_x, scale_y = page.width / width, page.height / height
+        lines.extend((x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y) for x0, y0, x1, y1 in boxes)
+    left = max(0, int(min(line[0] for line in lines)) - padding)
+    top = max(0, int(min(line[1] for line in lines)) - padding)
+    right = min(page.width, int(max(line[2] for line in lines)) + padding)
+    bottom = min(page.height, int(max(line[3] for line in lines)) + padding)
+    # Crop, and highlight the lines on a transparent overlay
+    snippet = page.crop((left, top, right, bottom)).convert('RGBA')
+    overlay = Image.new('RGBA', snippet.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for x0, y0, x1, y1 in lines:
+        draw.rectangle((x0 - left - 2, y0 - top - 2, x1 - left + 2, y1 - top + 2), fill=(255, 230, 0, 90))
+    snippet = Image.alpha_composite(snippet, overlay).convert('RGB')
+    if snippet.width > max_width:
+        snippet = snippet.resize((max_width, max(1, round(snippet.height * max_width / snippet.width))))
+    buffer = io.BytesIO()
+    snippet.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
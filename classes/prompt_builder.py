@@ -10,10 +10,23 @@ The prompt construction logic includes:
 - A system prompt defining assistant behavior.
 - Context filtering to include only relevant chunks from a specified manual.
 - A fallback response when no relevant context is available.
+- Numbered excerpts, which the model cites with short tags like [2]. The sources of an
+  answer are then looked up from the retrieved chunks (see manual_assistant.cited_sources)
+  instead of being written out by the model, which saves output tokens. The older prompt,
+  in which the model lists the path of every source after an end marker, is still
+  available with citations=False.
 
 This builder ensures consistent, rule-following prompts for question-answering tasks 
 over segmented technical documentation or user manuals.
 """
+
+# The reply when the excerpts do not contain the answer
+NO_ANSWER = "I'm afraid I can't find that information in the manual."
+# The marker the model inserts between the answer and its list of sources.
+# Naturally, a giraffe was chosen to be the end marker.
+END_MARKER = '🦒'
+
+
 class PromptBuilder:
     """
         Constructs chat prompts for a retrieval-augmented assistant that answers questions
@@ -28,16 +41,21 @@ class PromptBuilder:
 
         The build_prompt method accepts a user query and a list of contextual chunks, 
         and returns a formatted message list compatible with OpenAI chat API calls.
+
+        Attributes:
+            citations (bool): Whether the excerpts are numbered and cited by the model with
+                tags like [2] (True), or listed by path after the end marker (False).
         """
-    def __init__(self):
+    def __init__(self, citations: bool = True):
+        self.citations = citations
         # Define the system prompt
-        self.system_template = """
+        self.system_template = f"""
             You are a strict and professional assistant answering questions based only on the provided product manual excerpts.
 
             Your rules:
             - You MUST only use the information from the excerpts.
             - You MUST NOT use any outside or common knowledge.
-            - If the answer is not found in the excerpts, you MUST reply with: "I'm afraid I can't find that information in the manual."
+            - If the answer is not found in the excerpts, you MUST reply with: "{NO_ANSWER}"
             - You MAY rephrase, explain, or repeat previous answers, but only using information already given.
             - You MUST repeat answers word-for-word when explicitly asked.
             - You MAY respond politely to phrases like "thank you", but NEVER add extra information.
@@ -70,24 +88,36 @@ class PromptBuilder:
             return [
                 {"role": "system", "content": self.system_template},
                 {"role": "user", "content": query},
-                {"role": "assistant", "content": "I'm afraid I can't find that information in the manual."}
+                {"role": "assistant", "content": NO_ANSWER}
             ]
-        # build the context string
-        context_string = ""
-        for chunk in context_chunks:
-            context_string += f"[Source: {chunk['path']}]\n{chunk['text']}\n\n"
-        # build the user prompt
-        user_prompt = (
-            f"Answer the following question:\n" 
-            f"Context:\n{context_string.strip()}\n\n"
-            f"Question: {query}"
-            f"after the answer to the question is given insert '🦒' on a new line"
-            f"Then, on a new line provide the sources for the answer as follows:"
-            f"Source 1: path1\n"
-            f"Soruce 2: path2"
-            f"etc"
-            f"Don't repeat a source if they have the same path." 
-        )
+        # Number the excerpts and ask the model to cite them, or
+        # ask it to list the paths of its sources after the end marker
+        if self.citations:
+            context_string = ""
+            for number, chunk in enumerate(context_chunks, start=1):
+                context_string += f"[{number}] {chunk['text']}\n\n"
+            user_prompt = (
+                f"Answer the following question:\n"
+                f"Context:\n{context_string.strip()}\n\n"
+                f"Question: {query}\n"
+                f"Cite the excerpts your answer is based on by their number in square brackets, "
+                f"like [2], after the sentences that use them. Do not list the sources."
+            )
+        else:
+            context_string = ""
+            for chunk in context_chunks:
+                context_string += f"[Source: {chunk['path']}]\n{chunk['text']}\n\n"
+            user_prompt = (
+                f"Answer the following question:\n" 
+                f"Context:\n{context_string.strip()}\n\n"
+                f"Question: {query}"
+                f"after the answer to the question is given insert '{END_MARKER}' on a new line"
+                f"Then, on a new line provide the sources for the answer as follows:"
+                f"Source 1: path1\n"
+                f"Soruce 2: path2"
+                f"etc"
+                f"Don't repeat a source if they have the same path." 
+            )
         
         return [
             {"role": "system", "content": self.system_template},
@@ -0,0 +1,87 @@
+"""
+This module provides tools for calling rate limited and unreliable services, such as
+the OpenAI API, from several threads at once.
+
+It defines a thread-safe RateLimiter (a token bucket limiting the number of calls per
+minute) and a retry_with_backoff function that retries a call with exponentially
+increasing, jittered delays.
+"""
+
+# Perform necessary imports
+import random
+import threading
+import time
+from typing import Callable
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket limiting the number of calls per minute.
+
+    Attributes:
+        calls_per_minute (float): The sustained number of calls allowed per minute.
+        burst (int): The number of calls that may be made at once after a quiet period.
+    """
+    def __init__(self, calls_per_minute: float, burst: int = 1):
+        if calls_per_minute <= 0:
+            raise ValueError("calls_per_minute must be greater than 0.")
+        self.calls_per_minute = calls_per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call may be made.
+        """
+        rate = self.calls_per_minute / 60.0
+        while True:
+            with self._lock:
+                # Refill the bucket according to the time passed
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / rate
+            time.sleep(wait)
+
+
+def retry_with_backoff(
+    func: Callable,
+    retries: int = 3,
+    base_delay: float = 2.0,
+    max_delay: float = 60.0,
+    rate_limiter: RateLimiter = None,
+    retry_on: tuple = (Exception,)
+):
+    """
+    Calls func, retrying with exponential backoff if it raises.
+
+    Args:
+        func (Callable): The function to call, without arguments.
+        retries (int): The number of retries after the first attempt. Defaults to 3.
+        base_delay (float): The delay before the first retry in seconds. Doubled for each retry.
+        max_delay (float): The maximum delay between attempts in seconds.
+        rate_limiter (RateLimiter): An optional rate limiter acquired before each attempt.
+        retry_on (tuple): The exception types that trigger a retry.
+
+    Returns:
+        The return value of func.
+
+    Raises:
+        The exception of the last attempt, if all attempts fail.
+    """
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func()
+        except retry_on:
+            if attempt == retries:
+                raise
+            # Wait with exponential backoff and full jitter
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
@@ -4,54 +4,203 @@ This module provides tools for creating structured records from document pages.
 It defines a RecordCreator class that takes as a parameter a dictionary mapping manual names to lists of file paths.
 Each file is processed to extract text and semantically chunk it using TextExtractor and SemanticChunker.
 
-The result is a list of records with manual name, file path, chunk index, and chunk text.
-Processing is parallelized with ProcessPoolExecutor for efficiency.
+The language of each page is identified before chunking (see language_detector.py). Pages in languages
+other than the target languages can be skipped, or routed to separate manuals named '<manual>__<language>',
+so that they neither slow down the build nor crowd the index of the manual.
+
+The result is a list of records with manual name, file path, page index, chunk index, language and chunk text.
+Processing is parallelized with ProcessPoolExecutor for efficiency. The number of processes and the threads
+per process are taken from a ResourcePlan (see resource_plan.py), so that Tesseract does not start a thread per
+core in every process.
+
+By default every page is chunked on its own. With chunking='manual', the pages of a manual are streamed in
+order through the chunker instead, so that sentences running across a page break stay in one chunk and short
+pages do not produce tiny chunks of their own. The records of chunks spanning several pages have the index of
+their last page ('last_page') and the paths of all their pages ('paths').
+
+With layout=True, the word and line boxes of every page are captured as well (see page_layout.py), and
+each record gets the packed boxes of the lines of its chunk, per page ('layout'), so that the app can
+show a cropped snippet of the page instead of the full page. The boxes of whole pages are not stored.
 """
 
 #Perform necessary imports
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor
 from functools import partial
-from .text_extractor import TextExtractor
+from .text_extractor import TextExtractor, PdfTextExtractor, PdfPage
 from .semantic_chunker import SemanticChunker
+from .language_detector import LanguageDetector
+from .build_profile import stage
+from .resource_plan import ResourcePlan, limit_threads
+from .page_layout import locate_chunk
 from pathlib import Path
 
-def _process_page(task: str, path: Path) -> list[dict]:
+def _extract_page(
+    task: str,
+    path: Path,
+    page: int = None,
+    languages: tuple = None,
+    route_languages: bool = False,
+    layout: bool = False
+) -> dict:
+    """
+    Given the path of a manual page image, this function extracts the text from
+    the image. For pages of PDF documents, the text layer is used instead, and OCR
+    is only run for pages without text.
+
+    The language of the page is identified as well. Pages in a language outside
+    languages are skipped, or, if route_languages is set, assigned to the manual
+    '<task>__<language>'. Pages whose language cannot be identified are kept.
+
+    Args:
+        task: (str): A manual name
+        path: (Path or PdfPage): A path to a manual page image, or a PDF page
+        page: (int): The index of the page in the manual
+        languages: (tuple): The target language codes, e.g. ('en',). None keeps all languages.
+        route_languages: (bool): Whether to route other languages to separate manuals instead of skipping them
+        layout: (bool): Whether to capture the word and line boxes of the page
+
+    Returns:
+        dict: The page, with the keys 'manual', 'path', 'page', 'language', 'text' and
+            'layout' (the boxes of the page, or None), or None if the page is skipped.
+    """
+    # Extract the text from the PDF page or the image at the given path
+    with stage('ocr'):
+        if isinstance(path, PdfPage):
+            extractor = PdfTextExtractor(path, layout=layout)
+        else:
+            extractor = TextExtractor(path, layout=layout)
+        text = extractor.text
+    # Identify the language and skip or route pages in other languages
+    with stage('language'):
+        language = LanguageDetector().detect(text)
+    manual = task
+    if languages is not None and language != 'unknown' and language not in languages:
+        if not route_languages:
+            return None
+        manual = f'{task}__{language}'
+    return {'manual': manual, 'path': str(path), 'page': page, 'language': language, 'text': text, 'layout': extractor.layout}
+
+def _process_page(
+    task: str,
+    path: Path,
+    page: int = None,
+    languages: tuple = None,
+    route_languages: bool = False,
+    layout: bool = False
+) -> list[dict]:
     """
     Given the path of a manual page image, this function extracts
-    the text from the image and splits the text into chunks using 
-    semantic chunking.
+    the text from the image (see _extract_page) and splits the text
+    into chunks using semantic chunking.
 
     Args:
         task: (str): A manual name
-        path: (Path): A path to a manual page image
+        path: (Path or PdfPage): A path to a manual page image, or a PDF page
+        page: (int): The index of the page in the manual
+        languages: (tuple): The target language codes, e.g. ('en',). None keeps all languages.
+        route_languages: (bool): Whether to route other languages to separate manuals instead of skipping them
+        layout: (bool): Whether to capture the word and line boxes of the page
 
     Returns:
         list[dict]: A list of chunk records, each with the following keys:
             - 'manual' (str): The name of the manual.
             - 'path' (str): The file path of the manual page as a string.
+            - 'page' (int): The index of the page in the manual.
             - 'chunk' (int): The index of the chunk in the document.
+            - 'language' (str): The language code of the page, or 'unknown'.
             - 'text' (str): The content of the chunk.
+            With layout, the records also have the key:
+            - 'layout' (list[str]): The packed line boxes of the chunk on its page, in a list of one
+              (see page_layout.locate_chunk).
     """
-    # Extract the text from the image at the given path
-    extractor = TextExtractor(path)
-    text = extractor.text
+    extracted = _extract_page(task, path, page, languages, route_languages, layout)
+    if extracted is None:
+        return []
     # Create chunks using semantic chunking
-    chunker = SemanticChunker()
-    chunks = chunker.chunk(text)
+    with stage('chunker_init'):
+        chunker = SemanticChunker()
+    chunks = chunker.chunk(extracted['text'])
     # return a list a list of record dicts
-    return [
+    records = [
         {
-            'manual': task,
-            'path': str(path),
+            'manual': extracted['manual'],
+            'path': extracted['path'],
+            'page': page,
             'chunk': i,
+            'language': extracted['language'],
             'text': chunk
         }
         for i, chunk in enumerate(chunks)
     ]
+    # Locate every chunk on the page
+    if extracted['layout'] is not None:
+        with stage('layout'):
+            for record in records:
+                located = locate_chunk(record['text'], [extracted['layout']])
+                if located[0] is not None:
+                    record['layout'] = located
+    return records
+
+def _process_page_star(args, **kwargs):
+    return _process_page(*args, **kwargs)
+
+def _extract_page_star(args, **kwargs):
+    return _extract_page(*args, **kwargs)
 
-def _process_page_star(args):
-    return _process_page(*args)
+def _chunk_manual(pages: list[dict]) -> list[dict]:
+    """
+    Chunks the extracted pages of a manual as one text, so that chunks may cross page
+    breaks (see SemanticChunker.chunk_pages).
+
+    Pages routed to other manuals (see _extract_page) are chunked separately, per manual.
+
+    Args:
+        pages (list[dict]): The extracted pages of the manual, in page order. Skipped pages are None.
+
+    Returns:
+        list[dict]: A list of chunk records, with the same keys as those of _process_page.
+            'path', 'page' and 'language' are those of the first page of the chunk. Chunks
+            spanning several pages also have the keys:
+            - 'last_page' (int): The index of the last page of the chunk.
+            - 'paths' (list[str]): The file paths of all pages of the chunk.
+            If the layout of the pages was captured, the records also have the key 'layout',
+            the packed line boxes of the chunk for each of its pages, in the order of 'paths'
+            (see page_layout.locate_chunk).
+    """
+    with stage('chunker_init'):
+        chunker = SemanticChunker()
+    # Group the pages by the manual they were assigned to
+    manuals = {}
+    for extracted in pages:
+        if extracted is not None:
+            manuals.setdefault(extracted['manual'], []).append(extracted)
+    records = []
+    for manual, manual_pages in manuals.items():
+        by_page = {extracted['page']: extracted for extracted in manual_pages}
+        spans = chunker.chunk_pages((extracted['page'], extracted['text']) for extracted in manual_pages)
+        for i, (chunk, first_page, last_page) in enumerate(spans):
+            first = by_page[first_page]
+            record = {
+                'manual': manual,
+                'path': first['path'],
+                'page': first_page,
+                'chunk': i,
+                'language': first['language'],
+                'text': chunk
+            }
+            if last_page != first_page:
+                record['last_page'] = last_page
+                record['paths'] = [by_page[p]['path'] for p in sorted(by_page) if first_page <= p <= last_page]
+            # Locate the chunk on its pages, in the order of its paths
+            layouts = [by_page[p].get('layout') for p in sorted(by_page) if first_page <= p <= last_page]
+            if any(layout is not None for layout in layouts):
+                with stage('layout'):
+                    located = locate_chunk(chunk, layouts)
+                if any(packed is not None for packed in located):
+                    record['layout'] = located
+            records.append(record)
+    return records
 
 
 class RecordCreator:
@@ -61,10 +210,33 @@ class RecordCreator:
 
     Attributes:
         tasks - a dictionary of record creation tasks
+        languages - the target language codes, or None to keep all languages
+        route_languages - whether pages in other languages are routed to separate
+            manuals ('<manual>__<language>') instead of being skipped
+        chunking - 'page' to chunk every page on its own, or 'manual' to chunk the
+            pages of a manual in order as one text, so that chunks may cross page breaks
+        plan - the ResourcePlan sizing the process pool, by default planned from the usable cores
+        layout - whether to capture the word and line boxes of the pages and store the region
+            of every chunk with its record
 
     """
-    def __init__(self, tasks: dict):
+    def __init__(
+        self,
+        tasks: dict,
+        languages: tuple = None,
+        route_languages: bool = False,
+        chunking: str = 'page',
+        plan: ResourcePlan = None,
+        layout: bool = False
+    ):
+        if chunking not in ('page', 'manual'):
+            raise ValueError(f"Unknown chunking mode {chunking}. Use 'page' or 'manual'.")
         self.tasks = tasks
+        self.languages = tuple(languages) if languages is not None else None
+        self.route_languages = route_languages
+        self.chunking = chunking
+        self.plan = plan or ResourcePlan('phased')
+        self.layout = layout
 
     def create_records(self):
         """
@@ -74,15 +246,33 @@ class RecordCreator:
         Returns:
             list - a list of records.
         """
-        # Gather all (task,path) pairs in a long list and initialize the records list
-        all_args = [(task, path) for task in self.tasks for path in self.tasks[task]]
+        # Gather all (task,path,page) triples in a long list and initialize the records list
+        all_args = [(task, path, page) for task in self.tasks for page, path in enumerate(self.tasks[task])]
         records = []
 
-        # Parallelize the processing of each (task,path) pair in all_args
-        # and add the results to records
-        with ProcessPoolExecutor() as executor:
-            futures = executor.map(_process_page_star, all_args)
-            for result in tqdm(futures, total=len(all_args)):
-                records.extend(result)
+        # Parallelize the processing of each (task,path,page) triple in all_args
+        # and add the results to records, with the pool sized by the plan
+        pool = {
+            'max_workers': self.plan.ocr_workers,
+            'initializer': limit_threads,
+            'initargs': (self.plan.ocr_threads,)
+        }
+        if self.chunking == 'page':
+            process = partial(_process_page_star, languages=self.languages, route_languages=self.route_languages, layout=self.layout)
+            with ProcessPoolExecutor(**pool) as executor:
+                futures = executor.map(process, all_args)
+                for result in tqdm(futures, total=len(all_args)):
+                    records.extend(result)
+        else:
+            # Extract the text of all pages in parallel, then chunk each manual in page order
+            process = partial(_extract_page_star, languages=self.languages, route_languages=self.route_languages, layout=self.layout)
+            with ProcessPoolExecutor(**pool) as executor:
+                pages = list(tqdm(executor.map(process, all_args), total=len(all_args)))
+                manual_pages, offset = [], 0
+                for task in self.tasks:
+                    manual_pages.append(pages[offset:offset + len(self.tasks[task])])
+                    offset += len(self.tasks[task])
+                for result in executor.map(_chunk_manual, manual_pages):
+                    records.extend(result)
         # Return the records list, sorted by manual name
         return sorted(records,key = lambda record: record['manual'])
\ No newline at end of file
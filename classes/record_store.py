@@ -0,0 +1,207 @@
+"""
+This module provides the RecordStore class, a record store indexed by manual.
+
+Records (see record_creator.py) are stored in an SQLite database with an index on manual,
+page and chunk, so that the records of a single manual, or a range of its pages, can be
+fetched without deserializing the records of all other manuals. Keys beyond the standard
+'manual', 'path', 'page', 'chunk' and 'text' keys are kept as JSON.
+
+The store can be created from an old records.pkl file with:
+
+    python -m classes.record_store vector_databases/records.pkl
+"""
+
+# Perform necessary imports
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from .snapshots import active_dir
+
+# The standard record keys, stored in their own columns
+_COLUMNS = ('manual', 'path', 'page', 'chunk', 'text')
+
+def default_store_path() -> Path:
+    """
+    Returns the path of the record store of the vector databases in use: records.sqlite
+    in the published snapshot (see snapshots.py), or in vector_databases/.
+    """
+    return active_dir() / 'records.sqlite'
+
+
+class RecordStore:
+    """
+    A record store backed by SQLite and indexed by manual.
+
+    Attributes:
+        path (Path): The path to the SQLite database file.
+        read_only (bool): Whether the store is opened read-only.
+    """
+    def __init__(self, path: Path = None, read_only: bool = False):
+        """
+        Opens the store, creating the database if needed.
+
+        Args:
+            path (Path): The path to the SQLite database file. Defaults to default_store_path().
+            read_only (bool): Opens an existing database read-only instead, without creating
+                any file or directory.
+
+        Raises:
+            FileNotFoundError: If read_only is set and the database does not exist.
+        """
+        self.path = Path(path) if path else default_store_path()
+        self.read_only = read_only
+        if read_only:
+            if not self.path.is_file():
+                raise FileNotFoundError(
+                    f"No record store at {self.path}. Build the vector databases, or migrate "
+                    f"an old records.pkl with: python -m classes.record_store"
+                )
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS records (
+                    manual TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    page INTEGER,
+                    chunk INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    extra TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_records_manual ON records (manual, page, path, chunk)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A new connection per operation keeps the store safe to use from
+        # several threads and picklable for worker processes
+        if self.read_only:
+            return sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, timeout=60)
+        return sqlite3.connect(self.path, timeout=60)
+
+    def add_records(self, records: list[dict]):
+        """
+        Adds records to the store.
+
+        Records without a 'page' key get the position of their path among the sorted
+        paths of their manual in the given list.
+
+        Args:
+            records (list[dict]): The records to add.
+        """
+        # Number the pages of records that lack a page number
+        page_numbers = {}
+        for record in records:
+            if record.get('page') is None:
+                page_numbers.setdefault(record['manual'], set()).add(record['path'])
+        page_numbers = {
+            manual: {path: i for i, path in enumerate(sorted(paths))}
+            for manual, paths in page_numbers.items()
+        }
+        rows = []
+        for record in records:
+            page = record.get('page')
+            if page is None:
+                page = page_numbers[record['manual']][record['path']]
+            extra = {k: v for k, v in record.items() if k not in _COLUMNS}
+            rows.append((
+                record['manual'],
+                record['path'],
+                page,
+                record['chunk'],
+                record['text'],
+                json.dumps(extra) if extra else None
+            ))
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO records (manual, path, page, chunk, text, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def delete_manual(self, manual_name: str):
+        """
+        Deletes all records of a manual.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM records WHERE manual = ?", (manual_name,))
+
+    def manual_names(self) -> list[str]:
+        """
+        Returns the sorted names of all manuals in the store.
+        """
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT manual FROM records ORDER BY manual")]
+
+    def count(self, manual_name: str = None) -> int:
+        """
+        Returns the number of records of a manual, or of all manuals if manual_name is None.
+        """
+        with closing(self._connect()) as conn:
+            if manual_name is None:
+                return conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM records WHERE manual = ?", (manual_name,)).fetchone()[0]
+
+    def get_manual(self, manual_name: str, first_page: int = None, last_page: int = None) -> list[dict]:
+        """
+        Returns the records of a manual, optionally restricted to a range of pages,
+        sorted by page, path and chunk.
+
+        Args:
+            manual_name (str): The name of the manual.
+            first_page (int): The first page (0-based, inclusive) to return. Defaults to the first page.
+            last_page (int): The last page (0-based, inclusive) to return. Defaults to the last page.
+
+        Returns:
+            list[dict]: The records.
+        """
+        query = "SELECT manual, path, page, chunk, text, extra FROM records WHERE manual = ?"
+        params = [manual_name]
+        if first_page is not None:
+            query += " AND page >= ?"
+            params.append(first_page)
+        if last_page is not None:
+            query += " AND page <= ?"
+            params.append(last_page)
+        query += " ORDER BY page, path, chunk"
+        with closing(self._connect()) as conn:
+            return [self._to_record(row) for row in conn.execute(query, params)]
+
+    def iter_records(self):
+        """
+        Iterates over all records, one manual at a time.
+
+        Yields:
+            dict: The records.
+        """
+        for manual_name in self.manual_names():
+            yield from self.get_manual(manual_name)
+
+    def import_pickle(self, pickle_path: Path) -> "RecordStore":
+        """
+        Adds the records of an old records.pkl file to the store.
+
+        Args:
+            pickle_path (Path): The path to the pickled list of records.
+
+        Returns:
+            RecordStore: The instance itself, to allow for method chaining.
+        """
+        import joblib
+        self.add_records(joblib.load(pickle_path))
+        return self
+
+    @staticmethod
+    def _to_record(row: tuple) -> dict:
+        record = dict(zip(_COLUMNS, row[:5]))
+        if row[5]:
+            record.update(json.loads(row[5]))
+        return record
+
+
+if __name__ == '__main__':
+    import sys
+    pickle_path = Path(sys.argv[1]) if len(sys.argv) > 1 else default_store_path().with_name('records.pkl')
+    store = RecordStore(pickle_path.with_name('records.sqlite')).import_pickle(pickle_path)
+    print(f"Imported {store.count()} records of {len(store.manual_names())} manuals into {store.path}")
@@ -0,0 +1,145 @@
+"""
+This module provides the relevance thresholds used to decide whether a manual holds anything
+relevant to a question at all.
+
+A threshold is the largest (squared L2) distance between a question embedding and a chunk
+embedding at which the chunk still counts as relevant. Questions without any chunk within the
+threshold are answered with the canned "can't find that" reply, without calling the LLM.
+
+Thresholds are stored in vector_databases/thresholds.json as
+
+    {"snapshot": "<snapshot>", "default": 1.2, "manuals": {"<manual>": 1.1, ...}}
+
+The distances depend on the indexes they were calibrated on, so the file records the snapshot
+(see snapshots.py) it belongs to, and is ignored once another snapshot is published, until the
+thresholds are calibrated again.
+
+and are calibrated offline against the stored evaluation questions (see evaluate_retrieval.py
+and RetrievalEvaluator.calibrate): the threshold is set as low as possible while keeping a
+chosen share of the answerable questions above it, which rejects as many of the unanswerable
+questions as possible.
+"""
+
+# Perform necessary imports
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+import numpy as np
+from .snapshots import current_snapshot
+
+THRESHOLDS_PATH = Path(__file__).resolve().parent.parent / 'vector_databases' / 'thresholds.json'
+
+logger = logging.getLogger(__name__)
+
+# The loaded thresholds by file path, so that queries do not read the file
+_thresholds_cache = {}
+_thresholds_lock = threading.Lock()
+
+
+def load_thresholds(path: Path = THRESHOLDS_PATH) -> dict:
+    """
+    Loads the relevance thresholds of the published snapshot.
+
+    Args:
+        path (Path): The thresholds file, in the vector_databases folder.
+
+    Returns:
+        dict: The thresholds, with the keys 'snapshot', 'default' (float or None) and 'manuals'
+            (a dictionary mapping manual names to thresholds). Empty if there is no file, or
+            if it was calibrated on another snapshot than the published one.
+    """
+    path = Path(path)
+    snapshot = current_snapshot(path.parent)
+    if not path.exists():
+        return {'snapshot': snapshot, 'default': None, 'manuals': {}}
+    thresholds = json.loads(path.read_text())
+    if thresholds.get('snapshot') != snapshot:
+        logger.warning(
+            "Ignoring %s, calibrated on snapshot %s instead of %s. Run evaluate_retrieval.py --calibrate.",
+            path, thresholds.get('snapshot'), snapshot
+        )
+        return {'snapshot': snapshot, 'default': None, 'manuals': {}}
+    thresholds.setdefault('default', None)
+    thresholds.setdefault('manuals', {})
+    return thresholds
+
+
+def save_thresholds(thresholds: dict, path: Path = THRESHOLDS_PATH):
+    """
+    Saves the relevance thresholds, replacing the file atomically.
+
+    Args:
+        thresholds (dict): The thresholds (see load_thresholds), with the snapshot they
+            were calibrated on.
+        path (Path): The thresholds file, in the vector_databases folder.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(thresholds, indent=2))
+    os.replace(temporary, path)
+    reload_thresholds()
+
+
+def reload_thresholds():
+    """
+    Clears the process-wide cache of get_threshold, so that the thresholds are read again
+    on the next query. Called when a new snapshot is published (see
+    manual_assistant.reload_vector_dbs).
+    """
+    with _thresholds_lock:
+        _thresholds_cache.clear()
+
+
+def get_threshold(manual_name: str, path: Path = THRESHOLDS_PATH) -> float:
+    """
+    Returns the relevance threshold of a manual.
+
+    The environment variable relevance_threshold overrides the stored thresholds. The file is
+    read once per process and kept until reload_thresholds is called.
+
+    Args:
+        manual_name (str): The name of the manual.
+        path (Path): The thresholds file.
+
+    Returns:
+        float: The manual's own threshold, else the default threshold, else None
+            (no threshold: the top chunks are always used).
+    """
+    if os.getenv('relevance_threshold'):
+        return float(os.getenv('relevance_threshold'))
+    path = Path(path)
+    with _thresholds_lock:
+        thresholds = _thresholds_cache.get(path)
+        if thresholds is None:
+            thresholds = _thresholds_cache[path] = load_thresholds(path)
+    return thresholds['manuals'].get(manual_name, thresholds['default'])
+
+
+def calibrate_threshold(answerable: list[float], unanswerable: list[float], keep: float = 0.98) -> dict:
+    """
+    Chooses a threshold from the distances of the closest chunk to each evaluation question.
+
+    Args:
+        answerable (list[float]): The distance of the closest chunk for each answerable question.
+        unanswerable (list[float]): The distance of the closest chunk for each unanswerable question.
+        keep (float): The share of answerable questions that must stay within the threshold.
+
+    Returns:
+        dict: The 'threshold' and, at that threshold, the share of answerable questions
+            kept ('answerable_kept') and of unanswerable questions rejected ('unanswerable_rejected').
+    """
+    answerable = np.asarray(answerable, dtype=np.float64)
+    unanswerable = np.asarray(unanswerable, dtype=np.float64)
+    if not len(answerable):
+        raise ValueError("At least one answerable question is needed to calibrate a threshold.")
+    threshold = float(np.quantile(answerable, keep, method='higher'))
+    return {
+        'threshold': threshold,
+        'answerable_kept': float((answerable <= threshold).mean()),
+        'unanswerable_rejected': float((unanswerable > threshold).mean()) if len(unanswerable) else None,
+        'answerable': len(answerable),
+        'unanswerable': len(unanswerable)
+    }
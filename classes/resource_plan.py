@@ -0,0 +1,177 @@
+"""
+This module sizes the process pools and per-process thread counts of the vector database build.
+
+Without limits, every build process sizes its own thread pools from the number of cores of the
+machine: Tesseract starts an OpenMP thread per core for every page it reads, and torch and FAISS
+use every core for their intra-op threads. With one process per core, the machine then runs many
+times more threads than it has cores, and the processes mostly wait for each other.
+
+A ResourcePlan divides the usable cores between the stages of a build, based on how each stage
+uses them:
+    - OCR and chunking: Tesseract gains little from its own threads on single pages, so it is run
+      single-threaded, with one process per usable (logical) core.
+    - Embedding: the matrix products of the embedding model scale with the number of physical
+      cores, up to a few threads per process, beyond which more processes work better.
+
+The thread counts are applied in each worker process by limit_threads, through the environment
+variables read by OpenMP, MKL, OpenBLAS and Tesseract, and by torch.set_num_threads and
+faiss.omp_set_num_threads if those modules are loaded.
+"""
+
+# Perform necessary imports
+import os
+import sys
+
+import psutil
+
+# The environment variables limiting the threads of OpenMP (and Tesseract), MKL and OpenBLAS
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OMP_THREAD_LIMIT', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+# The most intra-op threads worth giving to one embedding process
+MAX_EMBED_THREADS = 4
+
+def usable_cores() -> int:
+    """
+    Returns the number of logical cores the process may run on, taking the CPU affinity
+    and a cgroup (container) CPU quota into account.
+
+    Returns:
+        int: The number of usable logical cores, at least 1.
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    # A container may be limited to fewer cores than it can see
+    try:
+        quota, period = (_read_text('/sys/fs/cgroup/cpu.max') or 'max').split()[:2]
+        if quota != 'max':
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    except (ValueError, OSError):
+        pass
+    return max(1, cores)
+
+def _read_text(path: str) -> str:
+    # Returns the content of a text file, or None if it cannot be read
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def physical_cores(cores: int = None) -> int:
+    """
+    Returns the number of physical cores among the usable cores. If the operating system
+    does not report its physical cores, all usable cores are assumed to be physical cores.
+
+    Args:
+        cores (int): The number of usable logical cores. Defaults to usable_cores().
+
+    Returns:
+        int: The number of usable physical cores, at least 1.
+    """
+    cores = cores or usable_cores()
+    physical = psutil.cpu_count(logical=False)
+    logical = os.cpu_count() or cores
+    if not physical:
+        return cores
+    # Scale down by the number of hardware threads per core
+    return max(1, min(cores, cores * physical // logical))
+
+def limit_threads(threads: int):
+    """
+    Limits the threads of the current process. Used as the initializer of worker processes,
+    before torch, faiss or Tesseract are loaded, so that they size their thread pools from
+    the environment. Modules that are loaded already are limited directly.
+
+    Args:
+        threads (int): The number of threads. None leaves the process unlimited.
+    """
+    if threads is None:
+        return
+    threads = max(1, int(threads))
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    # The tokenizers of the embedding model start their own thread pool otherwise
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    if 'faiss' in sys.modules:
+        sys.modules['faiss'].omp_set_num_threads(threads)
+
+
+class ResourcePlan:
+    """
+    Divides the usable cores between the process pools of a vector database build.
+
+    In the streaming build, OCR and embedding run at the same time, so the embedding process
+    gets a share of the physical cores and the OCR processes the remaining cores. In the phased
+    build, each phase uses all cores in turn.
+
+    Attributes:
+        mode (str): 'streaming' or 'phased', see create_vector_databases.py.
+        cores (int): The number of usable logical cores.
+        physical (int): The number of usable physical cores.
+        ocr_workers (int): The number of OCR and chunking processes.
+        ocr_threads (int): The number of threads per OCR process.
+        embed_workers (int): The number of embedding processes.
+        embed_threads (int): The number of threads per embedding process.
+    """
+    def __init__(
+        self,
+        mode: str = 'streaming',
+        cores: int = None,
+        ocr_workers: int = None,
+        ocr_threads: int = 1,
+        embed_workers: int = None,
+        embed_threads: int = None
+    ):
+        """
+        Plans the pools. Any worker or thread count given is used as is, and the
+        others are derived from it and the number of cores.
+
+        Args:
+            mode (str): 'streaming' or 'phased'.
+            cores (int): The number of logical cores to use. Defaults to usable_cores().
+            ocr_workers (int): The number of OCR processes.
+            ocr_threads (int): The number of threads per OCR process.
+            embed_workers (int): The number of embedding processes. Always 1 in the streaming build.
+            embed_threads (int): The number of threads per embedding process.
+        """
+        if mode not in ('streaming', 'phased'):
+            raise ValueError(f"Unknown build mode {mode}. Use 'streaming' or 'phased'.")
+        self.mode = mode
+        self.cores = max(1, cores or usable_cores())
+        self.physical = physical_cores(self.cores)
+        self.ocr_threads = max(1, ocr_threads)
+        if mode == 'streaming':
+            # One embedding process next to the OCR processes, with about a quarter of the cores
+            self.embed_workers = 1
+            self.embed_threads = embed_threads or max(1, min(MAX_EMBED_THREADS, self.physical // 4))
+            self.ocr_workers = ocr_workers or max(1, (self.cores - self.embed_threads) // self.ocr_threads)
+        else:
+            # The phases run one after the other, so each gets all cores
+            self.ocr_workers = ocr_workers or max(1, self.cores // self.ocr_threads)
+            self.embed_threads = embed_threads or max(1, min(MAX_EMBED_THREADS, self.physical))
+            self.embed_workers = embed_workers or max(1, self.physical // self.embed_threads)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the plan as a dictionary, e.g. for the snapshot manifest.
+        """
+        return {
+            'mode': self.mode,
+            'cores': self.cores,
+            'physical': self.physical,
+            'ocr_workers': self.ocr_workers,
+            'ocr_threads': self.ocr_threads,
+            'embed_workers': self.embed_workers,
+            'embed_threads': self.embed_threads
+        }
+
+    def __str__(self) -> str:
+        return (
+            f'{self.cores} cores ({self.physical} physical): '
+            f'{self.ocr_workers} OCR processes x {self.ocr_threads} threads, '
+            f'{self.embed_workers} embedding processes x {self.embed_threads} threads'
+        )
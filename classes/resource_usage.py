@@ -0,0 +1,56 @@
+"""
+This module provides small helpers for measuring the resource usage of the current process,
+used by the benchmarks and the build profiling.
+
+The memory is measured with psutil, which also works on windows, where the resource module
+does not exist.
+"""
+
+# Perform necessary imports
+import sys
+import time
+
+import psutil
+
+try:
+    import resource
+except ImportError:
+    # Not available on windows, where psutil reports the peak working set instead
+    resource = None
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns the peak resident set size of the current process in bytes.
+
+    Returns:
+        int: The peak RSS in bytes.
+    """
+    info = psutil.Process().memory_info()
+    # peak_wset is the peak working set on windows
+    return getattr(info, 'peak_wset', None) or _unix_peak_rss() or info.rss
+
+
+def current_rss_bytes() -> int:
+    """
+    Returns the current resident set size of the current process in bytes.
+
+    Returns:
+        int: The RSS in bytes.
+    """
+    return psutil.Process().memory_info().rss
+
+
+def cpu_seconds() -> float:
+    """
+    Returns the CPU time (user + system) used by the current process in seconds.
+    """
+    return time.process_time()
+
+
+def _unix_peak_rss() -> int:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on linux
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,191 @@
+"""
+This module provides a content-addressed disk cache of LLM responses, used by CachedBackend
+(see llm_backend.py) so that reruns of evaluations and benchmarks do not send unchanged
+prompts over the network again.
+
+Each response is stored in its own JSON file, named by the sha256 hash of the model name, the
+messages, the temperature and the other call parameters:
+
+    <cache>/<first two hex digits>/<hash>.json
+
+A response holds the tokens (text deltas) of the reply as they were received, so that a cached
+streamed reply is replayed with the same token boundaries, together with the time to first
+token and the total time of the original call.
+
+The cache is bounded in size: when it grows beyond max_bytes, the least recently used responses
+are deleted. The modification time of a file is updated on every hit and serves as its last
+use. In read-only mode, responses are read but never written, touched or evicted, e.g. to
+share a cache folder that must not change between benchmark runs.
+"""
+
+# Perform necessary imports
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+
+def cache_key(model: str, messages: list[dict], temperature: float, params: dict = None) -> str:
+    """
+    Returns the key of a call: the sha256 hash of its canonical JSON form.
+
+    Args:
+        model (str): The model name.
+        messages (list[dict]): The chat messages.
+        temperature (float): The sampling temperature.
+        params (dict): Further call parameters.
+
+    Returns:
+        str: The hex digest.
+    """
+    canonical = json.dumps(
+        {'model': model, 'messages': messages, 'temperature': temperature, 'params': params or {}},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    A size-bounded disk cache of LLM responses.
+
+    Attributes:
+        directory (Path): The cache folder.
+        max_bytes (int): The size beyond which the least recently used responses are evicted.
+        read_only (bool): Whether the cache is only read.
+        hits (int): The number of lookups that found a response.
+        misses (int): The number of lookups that did not.
+    """
+    def __init__(self, directory: Path, max_bytes: int = 512 * 2**20, read_only: bool = False):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The size of the cache, counted on the first write
+        self._size = None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f'{key}.json'
+
+    def contains(self, key: str) -> bool:
+        """
+        Returns whether a response is stored for key, without counting a lookup.
+        """
+        return self._path(key).exists()
+
+    def get(self, key: str) -> dict:
+        """
+        Looks up a response.
+
+        Args:
+            key (str): The key of the call (see cache_key).
+
+        Returns:
+            dict: The response, with the keys 'model', 'tokens', 'ttft', 'total' and 'created',
+                or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            # Missing, or a partial file of an interrupted write
+            with self._lock:
+                self.misses += 1
+            return None
+        if not self.read_only:
+            # Mark the response as recently used
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, model: str, tokens: list[str], ttft: float, total: float):
+        """
+        Stores a response and evicts the least recently used responses if the cache is full.
+        Does nothing in read-only mode.
+
+        Args:
+            key (str): The key of the call (see cache_key).
+            model (str): The model name.
+            tokens (list[str]): The tokens of the reply.
+            ttft (float): The time to first token of the original call, in seconds.
+            total (float): The total time of the original call, in seconds.
+        """
+        if self.read_only:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({
+            'model': model,
+            'tokens': tokens,
+            'ttft': ttft,
+            'total': total,
+            'created': datetime.now().isoformat(timespec='seconds')
+        }, ensure_ascii=False).encode('utf-8')
+        # Write to a temporary file and rename it, so that readers never see a partial file
+        temporary = path.with_name(f'.{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+        temporary.write_bytes(data)
+        # The replaced response, if any, no longer counts towards the size
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temporary, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _files(self) -> list[Path]:
+        return list(self.directory.glob('*/*.json'))
+
+    def size(self) -> int:
+        """
+        Returns the size of the stored responses in bytes.
+        """
+        total = 0
+        for path in self._files():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _evict(self) -> int:
+        # Delete the least recently used responses until the cache is at 90% of max_bytes,
+        # so that eviction does not run again on every write
+        entries = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, path in entries:
+            if size <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            size -= file_size
+        return size
+
+    def clear(self):
+        """
+        Deletes all stored responses.
+        """
+        for path in self._files():
+            path.unlink(missing_ok=True)
+        with self._lock:
+            self._size = 0
@@ -0,0 +1,316 @@
+"""
+Module: retrieval_evaluator
+
+This module defines the RetrievalEvaluator class, which measures the quality and speed of the
+retrieval step alone (embedding and vector search), without any LLM calls.
+
+It reuses the question sets produced by Evaluator._generate_questions and stored in the
+evaluation/ folder. A retrieved chunk counts as relevant if it comes from the page the question
+was generated from. For older evaluations, where the source of each question was not stored,
+all pages of the excerpts the questions were generated from count as relevant.
+
+For each manual, the following is computed over the answerable questions:
+- recall@k: The share of questions with a relevant chunk among the top k results.
+- MRR: The mean reciprocal rank of the first relevant chunk.
+- Search latency percentiles.
+
+This makes it cheap to compare chunkers, embedders and index options. evaluate_dedup compares
+deduplicated vector databases with full indexes of all records of the record store, to measure
+the retrieval impact of collapsing near duplicates (see deduplicator.py).
+
+The evaluator also calibrates the relevance thresholds (see relevance_threshold.py) from the
+distances of the closest chunk to the answerable and the unanswerable questions, and measures
+how often the manual routing index (see manual_router.py) puts the manual a question was
+generated from among its top candidates.
+"""
+
+# Perform necessary imports
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from .embedder import Embedder
+from .vector_database import VectorDatabase
+from .record_store import RecordStore
+from .relevance_threshold import calibrate_threshold
+from .manual_router import ManualRouter
+from .snapshots import active_dir
+
+# The reference answer of questions that cannot be answered from the manual
+UNANSWERABLE = "I'm afraid I can't find that in the manual."
+
+
+class RetrievalEvaluator:
+    """
+    Evaluates retrieval quality (recall@k, MRR) and search latency from stored question sets.
+
+    Attributes:
+        k_values (tuple): The values of k for which recall@k is computed.
+        base_dir (Path): The project root.
+        db_dir (Path): The folder of the vector databases to evaluate. Defaults to those in
+            use (see snapshots.py).
+        embedder (Embedder): The embedder used for the questions.
+        store (RecordStore): The record store the question excerpts are read from.
+        results_df (pd.DataFrame): One row per evaluated question, with the rank of the first
+            relevant result (None if not found) and the search latency.
+    """
+    def __init__(
+        self,
+        k_values: tuple = (1, 3, 5, 10),
+        base_dir: Path = None,
+        embedder: Embedder = None,
+        db_dir: Path = None
+    ):
+        self.k_values = tuple(sorted(k_values))
+        self.base_dir = Path(base_dir) if base_dir else Path(__file__).resolve().parent.parent
+        self.embedder = embedder or Embedder()
+        self.db_dir = Path(db_dir) if db_dir else active_dir(self.base_dir / 'vector_databases')
+        self.store = RecordStore(self.db_dir / 'records.sqlite', read_only=True)
+        self.results_df = None
+
+    def _context_pages(self, manual_name: str) -> set:
+        """
+        Returns the pages of the excerpts the questions of a manual were generated from,
+        using the same selection as Evaluator.
+        """
+        records = sorted(
+            self.store.get_manual(manual_name),
+            key=lambda x: (x['path'], x['chunk'])
+        )[:10]
+        return {record['path'] for record in records}
+
+    def load_questions(self, manual_names: list[str] = None, include_unanswerable: bool = False) -> pd.DataFrame:
+        """
+        Loads the answerable questions from the stored evaluations.
+
+        Args:
+            manual_names (list[str]): The manuals to load. Defaults to all evaluated manuals.
+            include_unanswerable (bool): Whether to include the unanswerable questions as well.
+
+        Returns:
+            pd.DataFrame: The evaluation rows of the questions.
+        """
+        eval_dir = self.base_dir / 'evaluation'
+        paths = sorted(eval_dir.glob('*.pkl'))
+        if manual_names is not None:
+            paths = [path for path in paths if path.stem in set(manual_names)]
+        df = pd.concat([joblib.load(path) for path in paths], axis=0).reset_index(drop=True)
+        if include_unanswerable:
+            return df
+        return df[df['Reference answer'] != UNANSWERABLE]
+
+    def _load_db(self, manual_name: str) -> VectorDatabase:
+        # The vector database of a manual in db_dir, or None if it was not built
+        db_path = self.db_dir / manual_name / 'vdb.pkl'
+        return joblib.load(db_path) if db_path.exists() else None
+
+    def _full_db(self, manual_name: str) -> VectorDatabase:
+        # An index of all records of a manual in the record store, duplicates included
+        records = self.store.get_manual(manual_name)
+        if not records:
+            return None
+        embeddings, records = self.embedder.encode(records)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        vdb = VectorDatabase(dim=embeddings.shape[1])
+        vdb.add(embeddings, records)
+        return vdb
+
+    def evaluate(self, manual_names: list[str] = None, load_db=None) -> dict:
+        """
+        Runs the retrieval evaluation.
+
+        Args:
+            manual_names (list[str]): The manuals to evaluate. Defaults to all evaluated manuals.
+            load_db (Callable): Returns the vector database of a manual name, or None to skip
+                the manual. Defaults to loading the vector databases in db_dir.
+
+        Returns:
+            dict: The summary, with recall@k for each k, MRR, the number of questions and the
+                embedding and search latency percentiles in milliseconds.
+        """
+        questions = self.load_questions(manual_names)
+        max_k = self.k_values[-1]
+        rows = []
+        embed_seconds = 0.0
+        # Evaluate the questions one manual at a time, so that only one vector database
+        # is loaded at a time
+        for manual_name, manual_df in questions.groupby('Manual'):
+            vdb = (load_db or self._load_db)(manual_name)
+            if vdb is None:
+                continue
+            # Embed all questions of the manual in one batch
+            start = time.perf_counter()
+            embeddings, _ = self.embedder.encode([{'text': q} for q in manual_df['Question']])
+            embed_seconds += time.perf_counter() - start
+            context_pages = None
+            for (_, row), embedding in zip(manual_df.iterrows(), embeddings):
+                # Find the relevant pages of the question
+                source_path = row.get('Source path')
+                if isinstance(source_path, str):
+                    relevant = {source_path}
+                else:
+                    if context_pages is None:
+                        context_pages = self._context_pages(manual_name)
+                    relevant = context_pages
+                # Search the vector database, one question at a time
+                start = time.perf_counter()
+                hits = vdb.search_manual(np.asarray([embedding], dtype=np.float32), top_k=max_k)[0]
+                latency = time.perf_counter() - start
+                # Deduplicated hits also count for every page they stand for,
+                # and chunks spanning several pages for each of their pages
+                rank = next(
+                    (
+                        i + 1 for i, hit in enumerate(hits)
+                        if relevant & (
+                            {hit['path'], *hit.get('paths', [])} | {s['path'] for s in hit.get('sources', [])}
+                        )
+                    ),
+                    None
+                )
+                rows.append({
+                    'Manual': manual_name,
+                    'Question': row['Question'],
+                    'Exact source': isinstance(source_path, str),
+                    'Rank': rank,
+                    'Distance': hits[0]['distance'] if hits else None,
+                    'Latency': latency
+                })
+        self.results_df = pd.DataFrame(rows)
+        return self.summary(embed_seconds)
+
+    def summary(self, embed_seconds: float = 0.0) -> dict:
+        """
+        Summarizes results_df.
+
+        Args:
+            embed_seconds (float): The total time spent embedding questions.
+
+        Returns:
+            dict: recall@k for each k, MRR, counts and latency percentiles in milliseconds.
+        """
+        df = self.results_df
+        if df is None or df.empty:
+            return {'questions': 0}
+        # float64 so that the comparisons work when no question found its manual (all ranks None)
+        ranks = pd.Series(df['Rank'], dtype='float64')
+        latencies_ms = df['Latency'] * 1000
+        result = {
+            'questions': len(df),
+            'questions_with_exact_source': int(df['Exact source'].sum()),
+            'manuals': df['Manual'].nunique()
+        }
+        for k in self.k_values:
+            result[f'recall@{k}'] = float((ranks.notna() & (ranks <= k)).mean())
+        result['mrr'] = float(ranks.map(lambda r: 1.0 / r if pd.notna(r) else 0.0).mean())
+        result['embed_ms_per_question'] = embed_seconds / len(df) * 1000
+        result['search_p50_ms'] = float(latencies_ms.quantile(0.50))
+        result['search_p95_ms'] = float(latencies_ms.quantile(0.95))
+        result['search_p99_ms'] = float(latencies_ms.quantile(0.99))
+        return result
+
+    def evaluate_dedup(self, manual_names: list[str] = None) -> dict:
+        """
+        Measures the retrieval impact of deduplication: the deduplicated vector databases in
+        db_dir are evaluated, and so are indexes of all records of the same manuals, which are
+        embedded from the record store for the comparison.
+
+        Args:
+            manual_names (list[str]): The manuals to evaluate. Defaults to all evaluated manuals.
+
+        Returns:
+            dict: The summaries (see summary) of the 'deduplicated' and the 'full' indexes.
+        """
+        deduplicated = self.evaluate(manual_names)
+        full = self.evaluate(manual_names, load_db=self._full_db)
+        return {'deduplicated': deduplicated, 'full': full}
+
+    def calibrate(self, manual_names: list[str] = None, keep: float = 0.98, min_questions: int = 20) -> dict:
+        """
+        Calibrates the relevance thresholds on the stored evaluation questions.
+
+        For every question, the distance to the closest chunk of its manual is computed. A
+        default threshold is calibrated on the questions of all manuals, and manuals with at
+        least min_questions answerable questions get a threshold of their own.
+
+        Args:
+            manual_names (list[str]): The manuals to use. Defaults to all evaluated manuals.
+            keep (float): The share of answerable questions that must stay within the threshold.
+            min_questions (int): The number of answerable questions needed for a manual threshold.
+
+        Returns:
+            dict: The thresholds, in the format of relevance_threshold.load_thresholds and tagged
+                with the snapshot they were calibrated on, plus a 'report' with the calibration
+                statistics of the default and each manual threshold.
+        """
+        # The snapshot the databases belong to, or None for the old layout
+        snapshot = self.db_dir.name if self.db_dir.parent.name == 'snapshots' else None
+        questions = self.load_questions(manual_names, include_unanswerable=True)
+        distances = {}
+        for manual_name, manual_df in questions.groupby('Manual'):
+            db_path = self.db_dir / manual_name / 'vdb.pkl'
+            if not db_path.exists():
+                continue
+            vdb: VectorDatabase = joblib.load(db_path)
+            embeddings, _ = self.embedder.encode([{'text': q} for q in manual_df['Question']])
+            hits = vdb.search_manual(np.asarray(embeddings, dtype=np.float32), top_k=1)
+            answerable = (manual_df['Reference answer'] != UNANSWERABLE).to_numpy()
+            closest = np.array([h[0]['distance'] if h else np.inf for h in hits])
+            distances[manual_name] = (closest[answerable], closest[~answerable])
+        if not distances:
+            return {'snapshot': snapshot, 'default': None, 'manuals': {}, 'report': {}}
+        # Calibrate the default threshold on all manuals, then the manual thresholds
+        default = calibrate_threshold(
+            np.concatenate([a for a, _ in distances.values()]),
+            np.concatenate([u for _, u in distances.values()]),
+            keep=keep
+        )
+        thresholds = {
+            'snapshot': snapshot,
+            'default': default['threshold'],
+            'manuals': {},
+            'report': {'default': default}
+        }
+        for manual_name, (answerable, unanswerable) in distances.items():
+            if len(answerable) >= min_questions:
+                calibration = calibrate_threshold(answerable, unanswerable, keep=keep)
+                thresholds['manuals'][manual_name] = calibration['threshold']
+                thresholds['report'][manual_name] = calibration
+        return thresholds
+
+    def evaluate_routing(self, router: ManualRouter, manual_names: list[str] = None, top_n_values: tuple = (1, 3, 5)) -> dict:
+        """
+        Measures how often the manual routing index puts the manual of a question among its
+        top candidates.
+
+        Args:
+            router (ManualRouter): The routing index.
+            manual_names (list[str]): The manuals whose questions are used. Defaults to all evaluated manuals.
+            top_n_values (tuple): The numbers of candidates to evaluate.
+
+        Returns:
+            dict: routing_recall@n for each n, the number of questions and routing latency
+                percentiles in milliseconds.
+        """
+        questions = self.load_questions(manual_names)
+        questions = questions[questions['Manual'].isin(set(router.manuals))]
+        if questions.empty:
+            return {'questions': 0}
+        embeddings, _ = self.embedder.encode([{'text': q} for q in questions['Question']])
+        max_n = max(top_n_values)
+        ranks = []
+        latencies = []
+        for manual_name, embedding in zip(questions['Manual'], embeddings):
+            start = time.perf_counter()
+            candidates = router.route(embedding, top_n=max_n)
+            latencies.append(time.perf_counter() - start)
+            names = [name for name, _ in candidates]
+            ranks.append(names.index(manual_name) + 1 if manual_name in names else None)
+        ranks = pd.Series(ranks, dtype='float64')
+        latencies_ms = pd.Series(latencies) * 1000
+        result = {'questions': len(ranks), 'routed_manuals': len(router.manuals)}
+        for n in top_n_values:
+            result[f'routing_recall@{n}'] = float((ranks.notna() & (ranks <= n)).mean())
+        result['route_p50_ms'] = float(latencies_ms.quantile(0.50))
+        result['route_p99_ms'] = float(latencies_ms.quantile(0.99))
+        return result
@@ -6,10 +6,18 @@ OpenAI model. Sentences are grouped into overlapping chunks that do not exceed a
 making them suitable for embedding or LLM input.
 
 The chunking logic ensures that chunks are contextually meaningful and overlap slightly to preserve continuity.
+
+Pages can be chunked one at a time (chunk), or streamed in order as one text (chunk_pages), in which
+case chunks may cross page breaks and the page span of each chunk is returned with it.
 """
 
 import spacy
 import tiktoken
+from typing import Iterable, Iterator
+from .build_profile import stage
+
+# How sentences end. A page whose last sentence ends otherwise continues on the next page.
+_SENTENCE_ENDS = ('.', '!', '?', ':', ';', '"', "'", ')')
 
 class SemanticChunker:
     def __init__(
@@ -53,16 +61,83 @@ class SemanticChunker:
                        or input into a language model.
         """
         # Split into sentences
-        doc = self.nlp(text)
+        with stage('spacy'):
+            doc = self.nlp(text)
         sentences = [sent.text.strip() for sent in doc.sents if sent.text.strip()]
-        # Initialize chunks list, current chunk list and current_tokens int.
-        chunks = []
+        return [chunk for chunk, _, _ in self._group((sentence, None, None) for sentence in sentences)]
+
+    def chunk_pages(self, pages: Iterable[tuple[int, str]]) -> Iterator[tuple[str, int, int]]:
+        """
+        Splits the text of consecutive pages into chunks that may cross page breaks.
+
+        The pages are streamed in order. A sentence that is not finished at the end of a page
+        (no closing punctuation) is joined with the start of the next page before the
+        sentences are segmented, so that it is not split by the page break, and sentences of
+        consecutive pages are grouped into chunks exactly like those of a single text by the
+        chunk method. Short pages thus no longer produce tiny chunks of their own.
+
+        Args:
+            pages (Iterable[tuple[int, str]]): (page number, text) pairs, in page order.
+
+        Yields:
+            tuple[str, int, int]: The text of each chunk, and the first and last page it covers.
+        """
+        yield from self._group(self._page_sentences(pages))
+
+    def _page_sentences(self, pages: Iterable[tuple[int, str]]) -> Iterator[tuple[str, int, int]]:
+        """
+        Segments the text of consecutive pages into sentences, carrying an unfinished last
+        sentence over to the next page.
+
+        Yields:
+            tuple[str, int, int]: Each sentence, and the first and last page it is on.
+        """
+        # The unfinished sentence at the end of the previous page, with its first and last page
+        carry, carry_first, carry_last = '', None, None
+        for page, text in pages:
+            # Text before boundary belongs to the carried sentence
+            boundary = len(carry) + 1 if carry else 0
+            if carry:
+                text = carry + ' ' + text
+            carry = ''
+            with stage('spacy'):
+                sentences = [
+                    (sent.text.strip(), carry_first if sent.start_char < boundary else page,
+                     page if sent.end_char > boundary else carry_last)
+                    for sent in self.nlp(text).sents if sent.text.strip()
+                ]
+            # Hold back the last sentence if it does not end the way sentences do,
+            # unless it is too long to be chunked anyway
+            if sentences and not sentences[-1][0].endswith(_SENTENCE_ENDS):
+                last = sentences[-1]
+                with stage('tiktoken'):
+                    last_tokens = len(self.enc.encode(last[0]))
+                if last_tokens < self.max_tokens:
+                    carry, carry_first, carry_last = sentences.pop()
+            yield from sentences
+        if carry:
+            yield carry, carry_first, carry_last
+
+    def _group(self, sentences: Iterable[tuple[str, int, int]]) -> Iterator[tuple[str, int, int]]:
+        """
+        Groups sentences into overlapping chunks of at most max_tokens tokens.
+
+        Args:
+            sentences (Iterable[tuple[str, int, int]]): Each sentence, with the first and last
+                page it is on (None if unknown).
+
+        Yields:
+            tuple[str, int, int]: The text of each chunk, and the first and last page it covers.
+        """
+        # Initialize the current chunk list (of (sentence, tokens, first page, last page) tuples)
+        # and current_tokens int.
         current_chunk = []
         current_tokens = 0
         # Iterate over the sentences
-        for sentence in sentences:
+        for sentence, first_page, last_page in sentences:
             # Get the number of tokens of the encoding of the current sentence
-            sentence_tokens = len(self.enc.encode(sentence))
+            with stage('tiktoken'):
+                sentence_tokens = len(self.enc.encode(sentence))
             # If this number is larger than max_tokens, we skip the sentence altogether.
             if sentence_tokens > self.max_tokens:
                 continue
@@ -70,8 +145,7 @@ class SemanticChunker:
             # the (encoding of) the current sentence exceeds max_tokens, we
             # join all sentences collected so far into a single string 
             if current_tokens + sentence_tokens > self.max_tokens:
-                chunk = " ".join(current_chunk)
-                chunks.append(chunk)
+                yield self._join(current_chunk)
                 # if overlap has been specified, we do the following:
                 # 1. Initialize an overlap chunk and an overlap token counter
                 # 2. Iterate in reversed order over the sentences in the 
@@ -97,7 +171,7 @@ class SemanticChunker:
                     overlap_chunk = []
                     overlap_tokens = 0
                     for prev_sentence in reversed(current_chunk):
-                        prev_tokens = len(self.enc.encode(prev_sentence))
+                        prev_tokens = prev_sentence[1]
                         if overlap_tokens + prev_tokens <= self.overlap:
                             overlap_chunk.insert(0, prev_sentence)
                             overlap_tokens += prev_tokens
@@ -109,12 +183,20 @@ class SemanticChunker:
                 else:
                     current_chunk = []
                     current_tokens = 0
-            # append the current chunk to the current_chunk list
+            # append the current sentence to the current_chunk list
             # and update current_tokens
-            current_chunk.append(sentence)
+            current_chunk.append((sentence, sentence_tokens, first_page, last_page))
             current_tokens += sentence_tokens
-        # If current_chunk is not empty add it to the chunks list
+        # If current_chunk is not empty yield it as the last chunk
         if current_chunk:
-            chunks.append(" ".join(current_chunk))
+            yield self._join(current_chunk)
 
-        return chunks
\ No newline at end of file
+    @staticmethod
+    def _join(current_chunk: list[tuple]) -> tuple[str, int, int]:
+        # Join the sentences of a chunk and find the pages it covers
+        pages = [page for _, _, first, last in current_chunk for page in (first, last) if page is not None]
+        return (
+            " ".join(sentence for sentence, _, _, _ in current_chunk),
+            min(pages) if pages else None,
+            max(pages) if pages else None
+        )
@@ -0,0 +1,307 @@
+"""
+This module manages versioned snapshots of the vector databases.
+
+Every build is written to its own snapshot folder, and published by atomically replacing a
+small pointer file, so that readers never see a half-written build:
+
+    vector_databases/
+        CURRENT                     # the name of the published snapshot
+        snapshots/
+            20250101_120000_ab12cd/
+                manifest.json       # size and sha256 checksum of every file
+                records.sqlite
+                router.pkl
+                <manual>/vdb.pkl
+                ...
+        thresholds.json             # calibration data of the snapshot it names
+
+Installations without a CURRENT file use the old layout, with the manual folders directly in
+vector_databases/.
+
+A SnapshotWatcher polls the pointer file, so that running servers can reload the indexes in
+the background when a new snapshot is published (see manual_assistant.reload_vector_dbs).
+
+Snapshots can be listed, published and rolled back with:
+
+    python -m classes.snapshots list
+    python -m classes.snapshots publish <name>
+    python -m classes.snapshots rollback
+"""
+
+# Perform necessary imports
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+VECTOR_DB_ROOT = Path(__file__).resolve().parent.parent / 'vector_databases'
+MANIFEST = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+
+def current_snapshot(root: Path = VECTOR_DB_ROOT) -> str:
+    """
+    Returns the name of the published snapshot, or None if the old layout is in use.
+    """
+    pointer = Path(root) / 'CURRENT'
+    if not pointer.exists():
+        return None
+    return pointer.read_text(encoding='utf-8').strip() or None
+
+
+def active_dir(root: Path = VECTOR_DB_ROOT) -> Path:
+    """
+    Returns the folder holding the vector databases that are in use: the published snapshot,
+    or the root itself for the old layout.
+    """
+    name = current_snapshot(root)
+    return Path(root) / 'snapshots' / name if name else Path(root)
+
+
+def list_snapshots(root: Path = VECTOR_DB_ROOT) -> list[str]:
+    """
+    Returns the names of all complete snapshots (those with a manifest), oldest first.
+    """
+    snapshots_dir = Path(root) / 'snapshots'
+    if not snapshots_dir.exists():
+        return []
+    return sorted(d.name for d in snapshots_dir.iterdir() if (d / MANIFEST).exists())
+
+
+def new_snapshot_dir(root: Path = VECTOR_DB_ROOT) -> Path:
+    """
+    Creates the folder of a new snapshot. The snapshot is not used until it is published.
+
+    Returns:
+        Path: The new, empty snapshot folder.
+    """
+    name = f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}"
+    snapshot_dir = Path(root) / 'snapshots' / name
+    snapshot_dir.mkdir(parents=True)
+    return snapshot_dir
+
+
+def derive_snapshot(source_dir: Path, root: Path = VECTOR_DB_ROOT, exclude: tuple = ()) -> Path:
+    """
+    Creates a new snapshot folder holding the files of another snapshot, to change some of
+    them without touching the published one. Files are hard linked where possible, as
+    published files are never modified in place, and copied otherwise. Files to be replaced
+    must be excluded, so that writing them does not write through a hard link.
+
+    Args:
+        source_dir (Path): The snapshot to start from.
+        root (Path): The vector_databases folder.
+        exclude (tuple): Relative paths of files not to take over. The manifest is never taken over.
+
+    Returns:
+        Path: The new snapshot folder. Write its manifest and publish it when done.
+    """
+    source_dir = Path(source_dir)
+    snapshot_dir = new_snapshot_dir(root)
+    for path in sorted(source_dir.rglob('*')):
+        relative_path = path.relative_to(source_dir).as_posix()
+        if not path.is_file() or relative_path in exclude or relative_path == MANIFEST:
+            continue
+        target = snapshot_dir / relative_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+    return snapshot_dir
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(snapshot_dir: Path, info: dict = None) -> dict:
+    """
+    Writes the manifest of a finished snapshot, with the size and checksum of every file.
+
+    Args:
+        snapshot_dir (Path): The snapshot folder.
+        info (dict): Extra information to store in the manifest, e.g. build settings.
+
+    Returns:
+        dict: The manifest.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    files = {}
+    for path in sorted(snapshot_dir.rglob('*')):
+        if path.is_file() and path.name != MANIFEST:
+            files[path.relative_to(snapshot_dir).as_posix()] = {'bytes': path.stat().st_size, 'sha256': _sha256(path)}
+    manifest = {
+        'snapshot': snapshot_dir.name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'manuals': sorted(d.name for d in snapshot_dir.iterdir() if (d / 'vdb.pkl').exists()),
+        'files': files,
+        **(info or {})
+    }
+    (snapshot_dir / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    return manifest
+
+
+def load_manifest(snapshot_dir: Path) -> dict:
+    """
+    Loads the manifest of a snapshot, or returns None if it has none.
+    """
+    path = Path(snapshot_dir) / MANIFEST
+    return json.loads(path.read_text(encoding='utf-8')) if path.exists() else None
+
+
+def verify_file(snapshot_dir: Path, relative_path: str, manifest: dict = None) -> bool:
+    """
+    Checks a file of a snapshot against its manifest.
+
+    Args:
+        snapshot_dir (Path): The snapshot folder.
+        relative_path (str): The path of the file within the snapshot, e.g. '<manual>/vdb.pkl'.
+        manifest (dict): The manifest, if already loaded.
+
+    Returns:
+        bool: True if the size and checksum match, or if the snapshot has no manifest
+            (old layout), else False.
+    """
+    manifest = manifest or load_manifest(snapshot_dir)
+    if manifest is None:
+        return True
+    entry = manifest['files'].get(relative_path)
+    path = Path(snapshot_dir) / relative_path
+    return (
+        entry is not None and path.exists()
+        and path.stat().st_size == entry['bytes'] and _sha256(path) == entry['sha256']
+    )
+
+
+def verify_snapshot(snapshot_dir: Path) -> list[str]:
+    """
+    Checks every file of a snapshot against its manifest.
+
+    Returns:
+        list[str]: The files that are missing or do not match. Empty if the snapshot is intact.
+
+    Raises:
+        FileNotFoundError: If the snapshot has no manifest.
+    """
+    manifest = load_manifest(snapshot_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"{snapshot_dir} has no manifest.")
+    return [name for name in manifest['files'] if not verify_file(snapshot_dir, name, manifest)]
+
+
+def publish(snapshot_dir: Path, root: Path = VECTOR_DB_ROOT):
+    """
+    Verifies a snapshot and makes it the one in use by atomically replacing the pointer file.
+
+    Args:
+        snapshot_dir (Path): The snapshot folder, within root/snapshots.
+        root (Path): The vector_databases folder.
+
+    Raises:
+        ValueError: If files of the snapshot are missing or corrupt.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    problems = verify_snapshot(snapshot_dir)
+    if problems:
+        raise ValueError(f"Snapshot {snapshot_dir.name} is corrupt: {', '.join(problems[:5])}")
+    temporary = Path(root) / 'CURRENT.tmp'
+    temporary.write_text(snapshot_dir.name, encoding='utf-8')
+    os.replace(temporary, Path(root) / 'CURRENT')
+
+
+def prune(root: Path = VECTOR_DB_ROOT, keep: int = 2) -> list[str]:
+    """
+    Deletes old snapshots, keeping the published one and the keep most recent ones, so that
+    servers that have not reloaded yet can still read the previous snapshot.
+
+    Returns:
+        list[str]: The names of the deleted snapshots.
+    """
+    current = current_snapshot(root)
+    snapshots = list_snapshots(root)
+    keep_names = set(snapshots[-keep:]) | {current}
+    deleted = [name for name in snapshots if name not in keep_names]
+    for name in deleted:
+        shutil.rmtree(Path(root) / 'snapshots' / name, ignore_errors=True)
+    return deleted
+
+
+class SnapshotWatcher:
+    """
+    Polls the pointer file and calls a function when another snapshot is published.
+
+    Attributes:
+        on_change (Callable): Called with the name of the new snapshot, in the watcher thread.
+        root (Path): The vector_databases folder.
+        interval (float): The polling interval in seconds.
+        snapshot (str): The name of the snapshot in use.
+    """
+    def __init__(self, on_change: Callable[[str], None], root: Path = VECTOR_DB_ROOT, interval: float = 5.0):
+        self.on_change = on_change
+        self.root = Path(root)
+        self.interval = interval
+        self.snapshot = current_snapshot(self.root)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SnapshotWatcher":
+        """
+        Starts the watcher thread.
+
+        Returns:
+            SnapshotWatcher: The instance itself, to allow for method chaining.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True, name='snapshot-watcher')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the watcher thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            snapshot = current_snapshot(self.root)
+            if snapshot != self.snapshot:
+                try:
+                    self.on_change(snapshot)
+                    self.snapshot = snapshot
+                except Exception:
+                    # Try again at the next poll
+                    logger.exception("Reloading snapshot %s failed.", snapshot)
+
+
+if __name__ == '__main__':
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    current = current_snapshot()
+    if command == 'list':
+        for name in list_snapshots():
+            print(f"{'*' if name == current else ' '} {name}")
+    elif command == 'publish':
+        publish(VECTOR_DB_ROOT / 'snapshots' / sys.argv[2])
+        print(f"Published {sys.argv[2]}")
+    elif command == 'rollback':
+        older = [name for name in list_snapshots() if current is None or name < current]
+        if not older:
+            sys.exit("There is no older snapshot to roll back to.")
+        publish(VECTOR_DB_ROOT / 'snapshots' / older[-1])
+        print(f"Published {older[-1]}")
+    else:
+        sys.exit(f"Unknown command {command}. Use list, publish <name> or rollback.")
@@ -0,0 +1,116 @@
+"""
+This module provides the StartupProfile class, which records where the time goes when the app
+starts cold: the import time of each heavy module, the time of each warmup stage, and
+milestones such as the first rendered page and the first answer.
+
+Times of milestones are measured from the moment this module was first imported, which is
+the first thing app.py does. The finished profile is logged as one JSON line (event 'startup')
+to the 'manual_assistant.metrics' logger and exported as gauges, so that cold-start
+regressions can be tracked next to the per-query metrics (see metrics.py).
+"""
+
+# Perform necessary imports
+import importlib
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from .metrics import METRICS, MetricsRegistry, logger
+
+# The time this module was first imported, used as the start of the process
+PROCESS_START = time.perf_counter()
+
+
+class StartupProfile:
+    """
+    Collects import times, stage times and milestones of a cold start.
+
+    Attributes:
+        start (float): The perf_counter value the milestones are measured from.
+        imports (dict): Maps module names to import times in seconds (0 if already imported).
+        stages (dict): Maps stage names to durations in seconds.
+        milestones (dict): Maps milestone names to seconds since start.
+        registry (MetricsRegistry): The registry the profile is exported to.
+    """
+    def __init__(self, start: float = None, registry: MetricsRegistry = None):
+        self.start = PROCESS_START if start is None else start
+        self.imports = {}
+        self.stages = {}
+        self.milestones = {}
+        self.registry = registry or METRICS
+        self._lock = threading.Lock()
+
+    def import_module(self, name: str):
+        """
+        Imports a module and records how long it took.
+
+        Args:
+            name (str): The module name.
+
+        Returns:
+            module: The imported module.
+        """
+        already_imported = name in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        seconds = 0.0 if already_imported else time.perf_counter() - start
+        with self._lock:
+            self.imports[name] = seconds
+        self.registry.set('manual_assistant_startup_import_seconds', seconds,
+                          help='Import time of heavy modules at startup.', module=name)
+        return module
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a block of code as a startup stage.
+
+        Args:
+            name (str): The stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = seconds
+            self.registry.set('manual_assistant_startup_stage_seconds', seconds,
+                              help='Duration of the warmup stages at startup.', stage=name)
+
+    def mark(self, name: str) -> bool:
+        """
+        Records a milestone, unless it has been recorded before.
+
+        Args:
+            name (str): The milestone name, e.g. 'first_render' or 'first_answer'.
+
+        Returns:
+            bool: True if the milestone was recorded now, False if it already had been.
+        """
+        with self._lock:
+            if name in self.milestones:
+                return False
+            self.milestones[name] = time.perf_counter() - self.start
+        self.registry.set('manual_assistant_startup_milestone_seconds', self.milestones[name],
+                          help='Seconds from startup to each milestone.', milestone=name)
+        return True
+
+    def to_dict(self) -> dict:
+        """
+        Returns the profile as a dictionary with the keys 'imports', 'stages' and 'milestones'.
+        """
+        with self._lock:
+            return {'imports': dict(self.imports), 'stages': dict(self.stages), 'milestones': dict(self.milestones)}
+
+    def report(self) -> dict:
+        """
+        Logs the profile as a JSON line.
+
+        Returns:
+            dict: The profile (see to_dict).
+        """
+        profile = self.to_dict()
+        logger.info(json.dumps({'event': 'startup', **profile}))
+        return profile
@@ -3,10 +3,15 @@ This module provides the TaskGenerator class for generating text extraction and
 (refer to text_extractor.py and record_creator.py for details) for the contents of a folder containing 
 subfolders with manual images (the docs folder - only visible after the installation scripts 
 have been run).
+
+A manual folder may either contain page images in an images/ subfolder or one or more PDF
+documents. The pages of PDF documents are returned as PdfPage objects (see text_extractor.py),
+whose text layer is used directly instead of running OCR on a page image.
 """
 
 # Perform necessary imports 
 from pathlib import Path
+from .text_extractor import PdfPage
 
 class TaskGenerator:
     """
@@ -25,8 +30,13 @@ class TaskGenerator:
         """
         Creates and returns the tasks in the form of a dictionary.
 
+        For manuals with PDF documents, each page becomes a PdfPage that is rendered to
+        images/<pdf name>_<page number>.jpg in the manual folder, so that records keep
+        referring to page images.
+
         Returns
-            dict: The dictionary of tasks
+            dict: The dictionary of tasks, mapping manual names to lists of image paths
+                  or PdfPage objects
 
         """
         
@@ -36,5 +46,31 @@ class TaskGenerator:
         for manual_path in self.manual_folders:
             manual_path_str = str(manual_path)
             manual_name = manual_path.stem
-            tasks[manual_name] = sorted((manual_path/Path('images')).glob('*.jpg'))
-        return tasks
\ No newline at end of file
+            pdf_paths = sorted(manual_path.glob('*.pdf'))
+            if pdf_paths:
+                tasks[manual_name] = self._pdf_pages(manual_path, pdf_paths)
+            else:
+                tasks[manual_name] = sorted((manual_path/Path('images')).glob('*.jpg'))
+        return tasks
+
+    def _pdf_pages(self, manual_path: Path, pdf_paths: list[Path]) -> list[PdfPage]:
+        """
+        Creates a PdfPage for each page of the given PDF documents.
+
+        Args:
+            manual_path (Path): The folder of the manual
+            pdf_paths (list[Path]): The PDF documents of the manual
+
+        Returns:
+            list[PdfPage]: The pages, in document and page order
+        """
+        # Import here so that PyMuPDF is only required when PDFs are processed
+        import fitz
+        pages = []
+        for pdf_path in pdf_paths:
+            with fitz.open(pdf_path) as doc:
+                n_pages = doc.page_count
+            for index in range(n_pages):
+                image_path = manual_path / 'images' / f'{pdf_path.stem}_{index + 1:04d}.jpg'
+                pages.append(PdfPage(pdf_path, index, image_path))
+        return pages
\ No newline at end of file
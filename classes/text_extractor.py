@@ -1,12 +1,20 @@
 """
-This module provides the text extractor class for extracting text from an image. Extraction
-is performed using tesseract which requires third party installation.
+This module provides the text extractor classes for extracting text from manual pages.
+
+TextExtractor extracts text from an image using tesseract which requires third party
+installation. PdfTextExtractor extracts the embedded text layer of a PDF page directly
+and only falls back to rendering the page and running tesseract on it when the page
+has no usable text. PDF support requires PyMuPDF.
+
+Both extractors can optionally capture the layout of the page, i.e. the bounding boxes of
+its words and lines (see page_layout.py). The text is then rebuilt from the same words.
 """
 
 # Perform necessary imports
 from PIL import Image
 import pytesseract
 from pathlib import Path
+from .page_layout import tesseract_layout, pdf_layout
 
 # Explicitly set the path to tesseract.exe. This is not required if the user has re-
 # booted after installation of tesseract but better safe than sorry.
@@ -20,16 +28,92 @@ class TextExtractor:
         jpg_path (Path): A path to a jpg image
         image (Image): A PIL Image object
         text (str): The text extracted from the image
+        layout (dict): The word and line boxes of the text (see page_layout.py), or None
+            if the layout is not captured
 
     """
-    def __init__(self,jpg_path: Path):
+    def __init__(self,jpg_path: Path, layout: bool = False):
         # Store the image path, load the image and extract the text
         self.jpg_path = jpg_path
         self.image = Image.open(jpg_path)
-        self.text = self.get_text()
+        self.layout = None
+        if layout:
+            self.text, self.layout = tesseract_layout(self.image)
+        else:
+            self.text = self.get_text()
         
     def get_text(self) -> str:
         # Extract the text from the image.
         return pytesseract.image_to_string(self.image)
 
 
+class PdfPage:
+    """
+    A page of a PDF document, used in place of an image path in record creation tasks
+    (see task_generator.py).
+
+    Attributes:
+        pdf_path (Path): The path to the PDF document
+        index (int): The 0-based index of the page in the document
+        image_path (Path): The path the page is rendered to, so that the app can show it
+    """
+    def __init__(self, pdf_path: Path, index: int, image_path: Path):
+        self.pdf_path = Path(pdf_path)
+        self.index = index
+        self.image_path = Path(image_path)
+
+    def __str__(self) -> str:
+        # Records refer to the rendered page image, just like for image pages
+        return str(self.image_path)
+
+    def __repr__(self) -> str:
+        return f"PdfPage({str(self.pdf_path)!r}, {self.index})"
+
+
+class PdfTextExtractor:
+    """
+    This class implements functionality for extracting the text of a PDF page.
+
+    The embedded text layer is used if it holds at least min_chars non-whitespace
+    characters. The page is always rendered to its image path (unless the image already
+    exists), and tesseract is only run on the rendered image when the text layer is
+    missing or too short.
+
+    Attributes:
+        page (PdfPage): The PDF page
+        used_ocr (bool): Whether tesseract was used
+        text (str): The text of the page
+        layout (dict): The word and line boxes of the text, in pixels of the rendered page
+            (see page_layout.py), or None if the layout is not captured
+    """
+    def __init__(self, page: PdfPage, min_chars: int = 50, dpi: int = 150, layout: bool = False):
+        # Store the page, render it and extract the text
+        self.page = page
+        self.min_chars = min_chars
+        self.dpi = dpi
+        self.used_ocr = False
+        self.capture_layout = layout
+        self.layout = None
+        self.text = self.get_text()
+
+    def get_text(self) -> str:
+        # Import here so that PyMuPDF is only required when PDFs are processed
+        import fitz
+        with fitz.open(self.page.pdf_path) as doc:
+            pdf_page = doc[self.page.index]
+            text = pdf_page.get_text()
+            # Render the page so that the app can show it
+            if not self.page.image_path.exists():
+                self.page.image_path.parent.mkdir(parents=True, exist_ok=True)
+                pdf_page.get_pixmap(dpi=self.dpi).save(str(self.page.image_path))
+            # Use the text layer if it is usable, otherwise OCR the rendered page
+            if len("".join(text.split())) >= self.min_chars:
+                if self.capture_layout:
+                    with Image.open(self.page.image_path) as image:
+                        text, self.layout = pdf_layout(pdf_page, image.size)
+                return text
+        self.used_ocr = True
+        if self.capture_layout:
+            text, self.layout = tesseract_layout(Image.open(self.page.image_path))
+            return text
+        return pytesseract.image_to_string(Image.open(self.page.image_path))
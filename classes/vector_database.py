@@ -1,12 +1,16 @@
 """
 This module provides the VectorDatabase class, which is a simple wrapper
-around a faiss vector database for storage and retreival of vector 
+around a faiss vector database for storage and retreival of vector
 embeddings together with associated metadata.
+
+The metadata is stored compactly (see compact_metadata.py), and only the
+records of the search hits are decoded. faiss is only imported when a database
+is created or loaded.
 """
 
 # Perform necessary imports
-import faiss
 import numpy as np
+from .compact_metadata import CompactMetadata
 
 class VectorDatabase:
     """
@@ -15,11 +19,19 @@ class VectorDatabase:
 
     Attributes:
         index (IndexFlatL2): A faiss index
-        metadata (list): A list of metadata (records - see record_creator.py for details)
+        metadata (CompactMetadata): The metadata (records - see record_creator.py for details),
+            indexable like a list of record dictionaries
     """
-    def __init__(self, dim: int):
+    def __init__(self, dim: int, compress: bool = True):
+        import faiss
         self.index = faiss.IndexFlatL2(dim)
-        self.metadata = []
+        self.metadata = CompactMetadata(compress=compress)
+
+    def __setstate__(self, state: dict):
+        # Convert the list based metadata of databases pickled by older versions
+        if isinstance(state.get('metadata'), list):
+            state['metadata'] = CompactMetadata(state['metadata'])
+        self.__dict__.update(state)
 
     def add(self, embeddings: np.ndarray, records: list[dict]):
         """
@@ -27,33 +39,42 @@ class VectorDatabase:
 
         Args:
             embeddings (ndarray): A numpy array of embeddings
-            records (list[dict]): a list of metadata in dictionary form 
+            records (list[dict]): a list of metadata in dictionary form
         """
         self.index.add(embeddings)
         self.metadata.extend(records)
 
-    def search_manual(self, query_embedding: np.ndarray, top_k: int = 5) -> list:
+    def search_manual(self, query_embedding: np.ndarray, top_k: int = 5, max_distance: float = None) -> list:
         """
         Searches the vector database for indices of text related to a user
         query embedding.
 
         Args:
             query_embedding (ndarray): A numpy array representation of an embedded query
-            top_k (int): 
+            top_k (int): The number of records to return per query
+            max_distance (float): If given, hits farther from the query than this
+                (squared L2) distance are dropped, so fewer than top_k records, or
+                none at all, may be returned
+
+        Returns:
+            list: A list with one list of record dictionaries per query, closest first.
+                Each record has a 'distance' key holding its squared L2 distance to the query.
         """
         if top_k <= 0:
             raise ValueError("top_k must be greater than 0.")
-        # Get all the indices from the metadata
-        indices = [i for i, meta in enumerate(self.metadata)]
         # Search the faiss index for indices with text related to the query
-        # Return the five closest embeddings
         D, I = self.index.search(query_embedding, top_k)
-        # Iterate over the returned indices and collect the corresponding
-        # texts in the metadata.
+        # Iterate over the returned indices and decode the corresponding
+        # records in the metadata. faiss returns -1 when the index holds
+        # fewer than top_k vectors.
         results = []
-        for idx_list in I:
-            batch = [self.metadata[indices[i]] for i in idx_list]
+        for dist_list, idx_list in zip(D, I):
+            batch = []
+            for distance, i in zip(dist_list, idx_list):
+                if i < 0 or (max_distance is not None and distance > max_distance):
+                    continue
+                record = self.metadata[int(i)]
+                record['distance'] = float(distance)
+                batch.append(record)
             results.append(batch)
         return results
-
-
@@ -0,0 +1,140 @@
+"""
+This module provides the Warmup class, which prepares the heavy parts of the assistant in a
+background thread while the app renders its first page.
+
+The warmup imports the heavy modules (torch, sentence_transformers, faiss, openai), loads the
+embedder, into the micro-batching scheduler shared by all sessions, runs a first forward pass,
+and loads the vector databases of the most used manuals. Each step is recorded in a
+StartupProfile (see startup_profile.py).
+
+Manual usage is counted in manual_usage.json in the project root, so that the manuals warmed
+after a deploy are the ones users actually pick.
+"""
+
+# Perform necessary imports
+import json
+import os
+import threading
+from pathlib import Path
+from .startup_profile import StartupProfile
+
+USAGE_PATH = Path(__file__).resolve().parent.parent / 'manual_usage.json'
+_usage_lock = threading.Lock()
+
+# Heavy modules imported by the warmup, in the order they are needed
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'faiss', 'openai')
+
+
+def record_manual_use(manual_name: str, path: Path = USAGE_PATH):
+    """
+    Counts a use of a manual.
+
+    Args:
+        manual_name (str): The name of the manual.
+        path (Path): The usage file.
+    """
+    with _usage_lock:
+        usage = json.loads(path.read_text()) if path.exists() else {}
+        usage[manual_name] = usage.get(manual_name, 0) + 1
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(usage, indent=2))
+        os.replace(temporary, path)
+
+
+def most_used_manuals(n: int, path: Path = USAGE_PATH) -> list[str]:
+    """
+    Returns the names of the n most used manuals.
+
+    Args:
+        n (int): The number of manuals.
+        path (Path): The usage file.
+
+    Returns:
+        list[str]: The manual names, most used first.
+    """
+    with _usage_lock:
+        usage = json.loads(path.read_text()) if path.exists() else {}
+    return sorted(usage, key=usage.get, reverse=True)[:n]
+
+
+class Warmup:
+    """
+    Warms up the embedder and the most used vector databases in a background thread.
+
+    Attributes:
+        profile (StartupProfile): The profile the warmup steps are recorded in.
+        manuals (list[str]): The manuals whose vector databases are loaded.
+        max_latency (float): The batching window of the scheduler, in seconds.
+        max_batch_size (int): The largest batch of the scheduler.
+        ready (threading.Event): Set when the scheduler, and with it the embedder, is ready.
+        done (threading.Event): Set when the whole warmup has finished.
+        error (Exception): The exception that stopped the warmup, if any.
+    """
+    def __init__(
+        self,
+        profile: StartupProfile = None,
+        manuals: list[str] = None,
+        max_latency: float = 0.005,
+        max_batch_size: int = 32
+    ):
+        self.profile = profile or StartupProfile()
+        self.manuals = list(manuals) if manuals is not None else []
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+        self._scheduler = None
+        self._thread = None
+
+    def start(self) -> "Warmup":
+        """
+        Starts the warmup thread.
+
+        Returns:
+            Warmup: The instance itself, to allow for method chaining.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True, name='warmup')
+        self._thread.start()
+        return self
+
+    def scheduler(self):
+        """
+        Returns the shared scheduler, waiting for the warmup to create it if needed.
+
+        Returns:
+            BatchScheduler: The scheduler.
+        """
+        self.ready.wait()
+        if self._scheduler is None:
+            raise RuntimeError("The warmup failed.") from self.error
+        return self._scheduler
+
+    def _run(self):
+        try:
+            # Import the heavy modules. openai is optional with other LLM backends.
+            for name in HEAVY_MODULES:
+                try:
+                    module = self.profile.import_module(name)
+                except ImportError:
+                    continue
+                if name == 'torch':
+                    # Keep streamlit's file watcher from crashing on torch.classes
+                    module.classes.__path__ = []
+            # Load the embedder into the shared scheduler and run a first forward pass
+            from .batch_scheduler import BatchScheduler
+            with self.profile.stage('embedder'):
+                self._scheduler = BatchScheduler(max_latency=self.max_latency, max_batch_size=self.max_batch_size)
+            with self.profile.stage('first_embedding'):
+                self._scheduler.embedder.encode([{'text': 'warm up'}])
+            self.ready.set()
+            # Load the vector databases of the most used manuals
+            from .manual_assistant import load_vector_db
+            for manual_name in self.manuals:
+                with self.profile.stage(f'index:{manual_name}'):
+                    load_vector_db(manual_name)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+            self.done.set()
@@ -0,0 +1,365 @@
+"""
+This module provides a work queue on a shared filesystem, used to spread the vector database
+build over several hosts (see distributed_build.py).
+
+The queue is a folder that every worker can reach, e.g. on a network share:
+
+    <queue>/
+        queue.json                  # the work units (manuals) and the build settings
+        leases/<unit>.lease         # held by the worker building the unit
+        parts/<unit>/               # the finished output of a unit
+        done/<unit>.json            # written when the output of a unit is complete
+        failed/<unit>.json          # the errors of failed attempts
+
+A worker claims a unit by creating its lease file exclusively (O_CREAT | O_EXCL), so that only
+one worker can hold it. While it works, a heartbeat thread touches the lease file. A lease whose
+file has not been touched for lease_seconds, as observed by the claiming worker's own clock, has
+expired: its worker is assumed to have died and another worker takes the unit over. Because
+expiry is judged by watching the modification time change rather than by comparing it to the
+local time, the clocks of the hosts do not need to agree.
+
+A unit is built into a private staging folder, which is renamed to parts/<unit> when it is
+complete, and only if the worker still holds the lease: a slow worker whose lease expired and
+was taken over discards its output instead of publishing it. Only the owning worker ever
+deletes its staging folder, since a worker presumed dead may still be writing to it. The
+staging folders of workers that really died are left behind in parts/ (their names start with
+a dot) and are ignored by the merge.
+"""
+
+# Perform necessary imports
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+QUEUE_FILE = 'queue.json'
+
+
+def _write_json(path: Path, data):
+    # Write to a temporary file and rename it, so that readers never see a partial file
+    temporary = path.with_name(f'.{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    temporary.write_text(json.dumps(data, indent=2, default=str), encoding='utf-8')
+    os.replace(temporary, path)
+
+
+def default_worker_id() -> str:
+    """
+    Returns a worker id that is unique across hosts and processes.
+    """
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}'
+
+
+class Lease:
+    """
+    A claimed work unit, kept alive by a heartbeat thread.
+
+    Attributes:
+        unit (str): The claimed unit.
+        worker (str): The id of the worker holding the lease.
+        path (Path): The lease file.
+        heartbeat_seconds (float): The interval at which the lease file is touched.
+        lost (bool): Whether the lease was taken over by another worker.
+    """
+    def __init__(self, unit: str, worker: str, path: Path, heartbeat_seconds: float):
+        self.unit = unit
+        self.worker = worker
+        self.path = Path(path)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def holder(self) -> str:
+        """
+        Returns the id of the worker named in the lease file, or None if there is no lease file.
+        """
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))['worker']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def start(self) -> "Lease":
+        """
+        Starts the heartbeat thread.
+
+        Returns:
+            Lease: The instance itself, to allow for method chaining.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'lease-{self.unit}')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the heartbeat thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            if self.holder() != self.worker:
+                self.lost = True
+                return
+            try:
+                os.utime(self.path)
+            except OSError:
+                self.lost = True
+                return
+
+
+class WorkQueue:
+    """
+    A queue of work units on a shared filesystem, with leases and heartbeats.
+
+    Attributes:
+        root (Path): The queue folder.
+        lease_seconds (float): The time without a heartbeat after which a lease expires.
+        heartbeat_seconds (float): The interval at which workers touch their lease files.
+        max_attempts (int): The number of failed attempts after which a unit is given up.
+    """
+    def __init__(self, root: Path, lease_seconds: float = 300, heartbeat_seconds: float = None, max_attempts: int = 3):
+        self.root = Path(root)
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds or lease_seconds / 10
+        self.max_attempts = max_attempts
+        # The modification times of other workers' leases, and when they were first seen
+        self._observed = {}
+
+    def create(self, units: dict, settings: dict = None) -> "WorkQueue":
+        """
+        Creates the queue. Units are handed out largest first, so that the last unit
+        to finish is a small one.
+
+        Args:
+            units (dict): Maps unit names (manuals) to their sizes (pages).
+            settings (dict): The build settings every worker uses.
+
+        Returns:
+            WorkQueue: The instance itself, to allow for method chaining.
+
+        Raises:
+            FileExistsError: If the folder already holds a queue.
+        """
+        if (self.root / QUEUE_FILE).exists():
+            raise FileExistsError(f'{self.root} already holds a work queue.')
+        for folder in ('leases', 'parts', 'done', 'failed'):
+            (self.root / folder).mkdir(parents=True, exist_ok=True)
+        ordered = sorted(units, key=lambda unit: (-units[unit], unit))
+        _write_json(self.root / QUEUE_FILE, {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'units': {unit: units[unit] for unit in ordered},
+            'settings': settings or {}
+        })
+        return self
+
+    def _load(self) -> dict:
+        path = self.root / QUEUE_FILE
+        if not path.exists():
+            raise FileNotFoundError(f'{self.root} holds no work queue. Create it first.')
+        return json.loads(path.read_text(encoding='utf-8'))
+
+    def units(self) -> list[str]:
+        """
+        Returns the units of the queue, in the order they are handed out.
+        """
+        return list(self._load()['units'])
+
+    def settings(self) -> dict:
+        """
+        Returns the build settings of the queue.
+        """
+        return self._load()['settings']
+
+    def is_done(self, unit: str) -> bool:
+        return (self.root / 'done' / f'{unit}.json').exists()
+
+    def attempts(self, unit: str) -> list[dict]:
+        """
+        Returns the failed attempts of a unit.
+        """
+        path = self.root / 'failed' / f'{unit}.json'
+        return json.loads(path.read_text(encoding='utf-8')) if path.exists() else []
+
+    def is_failed(self, unit: str) -> bool:
+        return len(self.attempts(unit)) >= self.max_attempts
+
+    def _expired(self, path: Path) -> bool:
+        # A lease has expired when its modification time has not changed for
+        # lease_seconds of this worker's own clock
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        seen = self._observed.get(path.name)
+        now = time.monotonic()
+        if seen is None or seen[0] != mtime:
+            self._observed[path.name] = (mtime, now)
+            return False
+        return now - seen[1] >= self.lease_seconds
+
+    def _try_lease(self, unit: str, worker: str) -> Lease:
+        # Create the lease file exclusively, so that only one worker gets the unit
+        path = self.root / 'leases' / f'{unit}.lease'
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._expired(path):
+                return None
+            # Break the expired lease. Renaming is atomic, so only one worker succeeds.
+            expired = path.with_name(f'{path.name}.{uuid.uuid4().hex[:8]}.expired')
+            try:
+                os.rename(path, expired)
+            except FileNotFoundError:
+                return None
+            self._observed.pop(path.name, None)
+            # Remove the old lease. Its staging folder is left to its worker, which may
+            # still be alive and writing to it.
+            expired.unlink(missing_ok=True)
+            return self._try_lease(unit, worker)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({
+                'worker': worker,
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'claimed': datetime.now().isoformat(timespec='seconds')
+            }, f)
+        return Lease(unit, worker, path, self.heartbeat_seconds).start()
+
+    def claim(self, worker: str) -> Lease:
+        """
+        Claims the next unit that is neither done, given up nor leased by a live worker.
+
+        Args:
+            worker (str): The id of the claiming worker.
+
+        Returns:
+            Lease: The lease on the claimed unit, with a running heartbeat, or None if
+                there is no unit to claim right now.
+        """
+        for unit in self.units():
+            if self.is_done(unit) or self.is_failed(unit):
+                continue
+            lease = self._try_lease(unit, worker)
+            if lease is not None:
+                # The unit may have been finished between the check and the claim
+                if self.is_done(unit):
+                    self.release(lease)
+                    continue
+                return lease
+        return None
+
+    def finished(self) -> bool:
+        """
+        Returns whether every unit is done or has been given up.
+        """
+        return all(self.is_done(unit) or self.is_failed(unit) for unit in self.units())
+
+    def staging_dir(self, lease: Lease) -> Path:
+        """
+        Returns the private folder the worker holding lease builds its unit into.
+        """
+        return self.root / 'parts' / f'.{lease.unit}.{lease.worker}.tmp'
+
+    def part_dir(self, unit: str) -> Path:
+        """
+        Returns the folder holding the finished output of a unit.
+        """
+        return self.root / 'parts' / unit
+
+    def release(self, lease: Lease):
+        """
+        Stops the heartbeat and deletes the lease file, if it is still held by the worker.
+        """
+        lease.stop()
+        if lease.holder() == lease.worker:
+            lease.path.unlink(missing_ok=True)
+
+    def holds(self, lease: Lease) -> bool:
+        """
+        Returns whether the worker of a lease still holds it, checking the lease file itself
+        rather than waiting for the next heartbeat.
+        """
+        if not lease.lost and lease.holder() != lease.worker:
+            lease.lost = True
+        return not lease.lost
+
+    def discard(self, lease: Lease):
+        """
+        Deletes the staging folder of a lease and releases it, e.g. after the lease was lost.
+        """
+        shutil.rmtree(self.staging_dir(lease), ignore_errors=True)
+        self.release(lease)
+
+    def complete(self, lease: Lease, info: dict = None) -> bool:
+        """
+        Publishes the staging folder of a unit as its part and marks the unit as done.
+
+        Args:
+            lease (Lease): The lease on the unit.
+            info (dict): Extra information to store in the done marker, e.g. timings.
+
+        Returns:
+            bool: Whether the output was kept. It is discarded if the lease was lost, i.e.
+                another worker took the unit over, or if the unit was finished by another
+                worker in the meantime.
+        """
+        # The heartbeat keeps running until the part is published, so that the lease
+        # cannot expire between this check and the rename
+        if not self.holds(lease):
+            self.discard(lease)
+            return False
+        staging = self.staging_dir(lease)
+        try:
+            os.rename(staging, self.part_dir(lease.unit))
+        except OSError:
+            # Another worker took the unit over and finished first
+            self.discard(lease)
+            return False
+        _write_json(self.root / 'done' / f'{lease.unit}.json', {
+            'worker': lease.worker,
+            'finished': datetime.now().isoformat(timespec='seconds'),
+            **(info or {})
+        })
+        self.release(lease)
+        return True
+
+    def fail(self, lease: Lease, error: str):
+        """
+        Records a failed attempt and releases the unit, so that it can be retried
+        until max_attempts attempts have failed.
+
+        Args:
+            lease (Lease): The lease on the unit.
+            error (str): A description of the error.
+        """
+        shutil.rmtree(self.staging_dir(lease), ignore_errors=True)
+        attempts = self.attempts(lease.unit) + [{
+            'worker': lease.worker,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'error': error
+        }]
+        _write_json(self.root / 'failed' / f'{lease.unit}.json', attempts)
+        self.release(lease)
+
+    def status(self) -> dict:
+        """
+        Returns the state of every unit: 'done', 'failed', 'leased' or 'pending'.
+        """
+        states = {}
+        for unit in self.units():
+            if self.is_done(unit):
+                states[unit] = 'done'
+            elif self.is_failed(unit):
+                states[unit] = 'failed'
+            elif (self.root / 'leases' / f'{unit}.lease').exists():
+                states[unit] = 'leased'
+            else:
+                states[unit] = 'pending'
+        return states
@@ -5,20 +5,28 @@ This script evaluates the performance of the assistant on a random subset of man
 by generating and saving evaluation DataFrames for each manual using the Evaluator class.
 
 Workflow:
-    1. Retrieves all available manual names from the 'vector_databases/' directory.
-    2. Randomly shuffles the manual list.
-    3. Attempts to evaluate up to 100 manuals:
+    1. Retrieves all available manual names from the vector databases in use.
+    2. Randomly shuffles the manual list, putting manuals with an unfinished checkpoint first.
+    3. Evaluates up to 100 manuals, several at a time:
         - For each manual not yet evaluated (i.e., no .pkl file exists in 'evaluation/'),
           an Evaluator is instantiated.
+        - Generated questions, local answers and scores are checkpointed per manual in
+          'evaluation_checkpoints/', so an interrupted run resumes where it stopped.
+        - LLM calls share a rate limiter and are retried with exponential backoff.
+        - With --llm-cache, repeated LLM calls are answered from a disk cache of responses.
+        - Query embeddings and searches of concurrent questions share a micro-batching scheduler.
         - The resulting evaluation DataFrame is saved as a .pkl file under 'evaluation/'.
+        - Failures are recorded, with their reasons, in 'evaluation_failures.json'.
         - Progress is shown via a tqdm progress bar.
     4. Reports the number of successful evaluations and total attempts at the end.
 
 Usage:
-    python evaluate_manuals.py
+    python evaluate.py [--target 100] [--concurrency 4] [--local-workers 5] [--rpm 120]
+                       [--llm-cache DIR [--llm-cache-readonly]]
 
 Side Effects:
-    - Creates or updates files in the 'evaluation/' directory.
+    - Creates or updates files in the 'evaluation/' and 'evaluation_checkpoints/' directories
+      and the 'evaluation_failures.json' file.
 
 Note:
     The script is designed so that it can be run several times until all 209 manuals have
@@ -27,66 +35,132 @@ Note:
 
 # Perform necessary imports
 from classes.evaluator import Evaluator
+from classes.rate_limiter import RateLimiter
+from classes.batch_scheduler import BatchScheduler
+from classes.snapshots import active_dir
 from tqdm import tqdm
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import argparse
 import joblib
-import pandas as pd
-import os 
+import json
+import os
 import random
+import threading
+import traceback
 
-def evaluate_manual(manual_name):
+CHECKPOINT_DIR = Path('evaluation_checkpoints')
+FAILURES_PATH = Path('evaluation_failures.json')
+_failures_lock = threading.Lock()
+
+def record_failure(manual_name: str, error: Exception):
+    """
+    Records the reason an evaluation failed in the failures file.
+
+    Args:
+        manual_name (str): Name of the manual that failed.
+        error (Exception): The exception that caused the failure.
+    """
+    with _failures_lock:
+        failures = json.loads(FAILURES_PATH.read_text(encoding='utf-8')) if FAILURES_PATH.exists() else {}
+        failures.setdefault(manual_name, []).append({
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'error': repr(error),
+            'traceback': traceback.format_exception(type(error), error, error.__traceback__)[-3:]
+        })
+        FAILURES_PATH.write_text(json.dumps(failures, indent=2), encoding='utf-8')
+
+def evaluate_manual(manual_name, rate_limiter=None, local_workers=1, retries=3, scheduler=None):
     """
     Evaluates a single manual and saves the resulting evaluation DataFrame.
 
     Args:
-        manual_name (str): Name of the manual to evaluate. Must correspond to a 
-            valid subdirectory in 'vector_databases/'.
+        manual_name (str): Name of the manual to evaluate. Must correspond to a
+            manual of the vector databases in use.
+        rate_limiter (RateLimiter): A rate limiter shared by all evaluations.
+        local_workers (int): The number of questions answered concurrently by the local assistant.
+        retries (int): The number of retries of failed LLM calls.
+        scheduler (BatchScheduler): A micro-batching scheduler shared by all evaluations.
 
     Returns:
         bool: True if evaluation and saving succeeded, False if an exception occurred.
 
     Notes:
         - Saves the evaluation result to 'evaluation/<manual_name>.pkl'.
-        - Exceptions are caught and suppressed; failure returns False.
-        - Assumes the 'evaluation/' directory already exists.
-    """    
+        - Exceptions are caught and recorded in 'evaluation_failures.json'; failure returns False.
+        - Intermediate results are kept in 'evaluation_checkpoints/<manual_name>.json'.
+    """
     try:
         # Define an Evaluator object based on the manual_name given
         # This object takes care of the full evaluation for us-
-        ev = Evaluator(manual_name)
+        ev = Evaluator(
+            manual_name,
+            checkpoint_dir=CHECKPOINT_DIR,
+            local_workers=local_workers,
+            rate_limiter=rate_limiter,
+            retries=retries,
+            scheduler=scheduler
+        )
         # Get the evaluation df and save it to disk
         joblib.dump(ev.evaluation_df,f'evaluation/{manual_name}.pkl')
         return True
     except Exception as e:
+        record_failure(manual_name, e)
         return False
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate the assistant on a random subset of manuals.')
+    parser.add_argument('--target', type=int, default=100, help='The number of manuals to evaluate.')
+    parser.add_argument('--concurrency', type=int, default=4, help='The number of manuals evaluated at a time.')
+    parser.add_argument('--local-workers', type=int, default=5, help='Questions answered at a time per manual.')
+    parser.add_argument('--rpm', type=float, default=120, help='Maximum number of LLM calls per minute.')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of failed LLM calls.')
+    parser.add_argument('--llm-cache', type=Path, default=None,
+                        help='Answer repeated LLM calls from a response cache in this folder (see classes/response_cache.py).')
+    parser.add_argument('--llm-cache-readonly', action='store_true', help='Read the response cache, but do not add to it.')
+    args = parser.parse_args()
+    # The backends read the cache settings from the environment (see get_backend)
+    if args.llm_cache is not None:
+        os.environ['llm_cache_dir'] = str(args.llm_cache)
+        os.environ['llm_cache_mode'] = 'readonly' if args.llm_cache_readonly else 'readwrite'
+
     os.system("cls")
-    # Get and shuffle the manual names
-    manual_names = [d.name for d in Path('vector_databases').iterdir() if d.is_dir()]
+    Path('evaluation').mkdir(exist_ok=True)
+    # Get and shuffle the manual names. Manuals that have not been evaluated yet, but
+    # have a checkpoint from an interrupted run, are resumed first.
+    manual_names = [
+        d.name for d in active_dir().iterdir()
+        if (d / 'vdb.pkl').exists() and not (Path('evaluation') / f'{d.name}.pkl').exists()
+    ]
     random.shuffle(manual_names)
+    manual_names.sort(key=lambda name: (CHECKPOINT_DIR / f'{name}.json').exists())
     # A few helper variables
     completed = 0
     attempts = 0
-    target = 100
-    # Iterate over the manual names
-    with tqdm(total=target, desc="Evaluating performance on manuals") as pbar:
-        while manual_names and completed < target:
-            # Get and remove a manual name from the list
-            manual_name = manual_names.pop()
-            # Set the save path
-            path = Path('.')/'evaluation'/f'{manual_name}.pkl'
-            # If the file doesn't already exist, perform an evaluation
-            if not path.exists():
-                success = evaluate_manual(manual_name)
-            else:
-                success = False
-            attempts += 1
-            if success:
-                completed += 1
-                pbar.update(1)
+    target = args.target
+    rate_limiter = RateLimiter(args.rpm, burst=args.concurrency)
+    # Batch the query embeddings and searches when several questions are answered at a time
+    scheduler = BatchScheduler() if args.concurrency * args.local_workers > 1 else None
+    # Evaluate the manuals, keeping at most args.concurrency evaluations
+    # running, until the target has been reached or the manuals run out
+    with tqdm(total=target, desc="Evaluating performance on manuals") as pbar, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        running = set()
+        while (manual_names or running) and completed < target:
+            # Top up the running evaluations
+            while manual_names and len(running) < args.concurrency and completed + len(running) < target:
+                manual_name = manual_names.pop()
+                running.add(executor.submit(
+                    evaluate_manual, manual_name, rate_limiter, args.local_workers, args.retries, scheduler
+                ))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                attempts += 1
+                if future.result():
+                    completed += 1
+                    pbar.update(1)
     print(f"\n🎯 Completed {completed} evaluations in {attempts} attempts.")
-
-
-
+    if FAILURES_PATH.exists():
+        print(f"Failure reasons are recorded in {FAILURES_PATH}.")
@@ -0,0 +1,75 @@
+"""
+Script: evaluate_retrieval.py
+
+This script evaluates the retrieval step of the assistant (embedding and vector search) on the
+question sets stored in 'evaluation/', without any LLM calls. It reports recall@k, MRR and
+search latency, and runs in seconds, which makes it suitable for comparing chunkers, embedders
+and index options.
+
+With --calibrate, the relevance thresholds used to answer off-topic questions without an LLM
+call are calibrated on the answerable and unanswerable questions instead (see
+relevance_threshold.py). With --routing, the manual routing index is evaluated: how often
+the manual a question was generated from is among the top candidate manuals.
+
+Usage:
+    python evaluate_retrieval.py [--manuals NAME ...] [--k 1 3 5 10] [--output results.json]
+    python evaluate_retrieval.py --calibrate [--keep 0.98] [--min-questions 20]
+    python evaluate_retrieval.py --routing
+
+Side Effects:
+    - Writes the summary and per-question results to the given output file, if any.
+    - With --calibrate, writes vector_databases/thresholds.json.
+"""
+
+# Perform necessary imports
+from classes.retrieval_evaluator import RetrievalEvaluator
+from classes.relevance_threshold import save_thresholds
+from classes.manual_router import ManualRouter
+from pathlib import Path
+import argparse
+import json
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline retrieval evaluation (recall@k, MRR).')
+    parser.add_argument('--manuals', nargs='+', default=None, help='Manuals to evaluate. Defaults to all.')
+    parser.add_argument('--k', nargs='+', type=int, default=[1, 3, 5, 10], help='Values of k for recall@k.')
+    parser.add_argument('--output', type=Path, default=None, help='A JSON file to write the results to.')
+    parser.add_argument('--calibrate', action='store_true', help='Calibrate the relevance thresholds.')
+    parser.add_argument('--keep', type=float, default=0.98,
+                        help='Share of answerable questions to keep within the threshold.')
+    parser.add_argument('--min-questions', type=int, default=20,
+                        help='Answerable questions needed for a manual to get its own threshold.')
+    parser.add_argument('--routing', action='store_true', help='Evaluate the manual routing index.')
+    args = parser.parse_args()
+
+    evaluator = RetrievalEvaluator(k_values=tuple(args.k))
+    if args.calibrate:
+        thresholds = evaluator.calibrate(args.manuals, keep=args.keep, min_questions=args.min_questions)
+        report = thresholds.pop('report')
+        for name, calibration in report.items():
+            rejected = calibration['unanswerable_rejected']
+            print(
+                f"{name:<30}threshold {calibration['threshold']:.4f}  "
+                f"answerable kept {calibration['answerable_kept']:.1%}  "
+                f"unanswerable rejected {'n/a' if rejected is None else f'{rejected:.1%}'}"
+            )
+        save_thresholds(thresholds)
+        print("\nThresholds saved to vector_databases/thresholds.json")
+    else:
+        if args.routing:
+            router = ManualRouter.load()
+            if router is None:
+                parser.error('No manual routing index found. Run installation_scripts/create_router.py.')
+            summary = evaluator.evaluate_routing(router, args.manuals)
+        else:
+            summary = evaluator.evaluate(args.manuals)
+        for name, value in summary.items():
+            print(f"{name:<30}{value:.4f}" if isinstance(value, float) else f"{name:<30}{value}")
+
+        if args.output:
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            args.output.write_text(json.dumps({
+                'summary': summary,
+                'questions': [] if args.routing else evaluator.results_df.to_dict(orient='records')
+            }, indent=2, default=str))
+            print(f"\nResults saved to {args.output}")
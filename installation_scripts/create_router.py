@@ -0,0 +1,58 @@
+"""
+Script: create_router.py
+
+This script builds the manual routing index (router.pkl) of the vector databases in use, for
+installations whose vector databases were created before the index was built along with them.
+The vectors are read back from the faiss index of each manual and summarized by a few k-means
+centroids per manual (see classes/manual_router.py).
+
+A published snapshot is never changed in place: the router is written to a new snapshot holding
+the files of the published one (hard linked where possible), which is then published through
+the CURRENT pointer like a new build, so that running apps reload it in the background (see
+classes/snapshots.py). Older snapshots are pruned, keeping the --keep-snapshots most recent ones.
+
+Usage:
+    python create_router.py [--representatives 4] [--keep-snapshots 2]
+
+Side Effects:
+    - Creates and publishes a new snapshot with router.pkl, or, for the old layout without
+      snapshots, creates or replaces router.pkl in vector_databases/.
+"""
+
+if __name__ == '__main__':
+    # Perform necessary imports
+    import sys
+    from pathlib import Path
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the manual routing index.')
+    parser.add_argument('--representatives', type=int, default=4, help='Representative vectors per manual.')
+    parser.add_argument('--keep-snapshots', type=int, default=2, help='Snapshots to keep after publishing.')
+    args = parser.parse_args()
+    base_folder = Path(__file__).resolve().parent.parent
+    sys.path.append(str(base_folder))
+    from classes.manual_router import ManualRouter
+    import os
+    from classes.snapshots import (
+        VECTOR_DB_ROOT, active_dir, current_snapshot, load_manifest, write_manifest, derive_snapshot, publish, prune
+    )
+
+    print('🔄️ Building the manual routing index...')
+    directory = active_dir()
+    router = ManualRouter.from_vector_databases(directory, args.representatives)
+    if current_snapshot() is None:
+        # Old layout: replace the router file atomically
+        temporary = directory / 'router.pkl.tmp'
+        router.save(temporary)
+        os.replace(temporary, directory / 'router.pkl')
+        print(f"\n🎉 Routed {len(router.manuals)} manuals with {len(router.vectors)} vectors, saved to {directory / 'router.pkl'}.")
+    else:
+        # Write the router to a copy of the published snapshot and publish the copy
+        snapshot_dir = derive_snapshot(directory, exclude=('router.pkl',))
+        router.save(snapshot_dir / 'router.pkl')
+        manifest = load_manifest(directory) or {}
+        info = {k: v for k, v in manifest.items() if k not in ('snapshot', 'created', 'manuals', 'files')}
+        write_manifest(snapshot_dir, {**info, 'router': {'from': directory.name, 'representatives': args.representatives}})
+        publish(snapshot_dir, VECTOR_DB_ROOT)
+        pruned = prune(VECTOR_DB_ROOT, keep=args.keep_snapshots)
+        print(f"\n🎉 Routed {len(router.manuals)} manuals with {len(router.vectors)} vectors.")
+        print(f'📦 Published snapshot {snapshot_dir.name}' + (f' and pruned {len(pruned)} old snapshots.' if pruned else '.'))
@@ -4,20 +4,65 @@ Script: create_vector_databases.py
 This script processes pre-extracted manual page records to build faiss-based vector databases
 for semantic search in the manual assistant application.
 
-Workflow:
+Workflow (--mode phased):
 1. Loads and parses manual pages using RecordCreator.
 2. Generates text chunks and metadata records from the input images.
-3. Saves the records to disk for reuse (records.pkl).
-4. Loads the records and splits them by manual.
-5. For each manual:
+3. Saves the records to a record store indexed by manual (records.sqlite).
+4. For each manual, in parallel:
+    - Reads the records of the manual from the record store.
     - Embeds the text chunks using a SentenceTransformer model.
     - Stores the embeddings and associated metadata in a FAISS vector database.
 
+Workflow (--mode streaming, the default):
+    OCR and chunking, embedding and index writing run at the same time, connected by
+    bounded queues (see build_pipeline.py). A manual's vector database is written as
+    soon as its last page has been embedded, and memory use is bounded by the queue
+    sizes rather than by the size of the corpus.
+
+Every build is written to a new snapshot folder, vector_databases/snapshots/<name>/. When the
+build has finished, a manifest with the checksum of every file is written and the snapshot is
+published by atomically replacing vector_databases/CURRENT, so that a running app never sees a
+half-written build and reloads the new indexes in the background (see classes/snapshots.py).
+Older snapshots are pruned, keeping the --keep-snapshots most recent ones.
+
+Pages are tagged with their language before chunking. With --languages, pages in other
+languages are skipped, or with --route-languages written to separate manuals named
+'<manual>__<language>'.
+
+With --dedup-threshold, near-identical chunks within a manual are collapsed before they are
+embedded. The reduction in vectors is reported together with recall@k and MRR of the
+deduplicated and of full indexes on the manuals with stored evaluation questions
+(--skip-dedup-eval to skip this), and saved to dedup_report.json and dedup_retrieval.json.
+
+With --chunking manual, the pages of each manual are chunked in order as one text, so that
+chunks may cross page breaks (see classes/semantic_chunker.py). Each chunk records the pages
+it covers.
+
+With --profile, the wall time, CPU time, item counts, IPC bytes and peak RSS of every build
+stage are recorded per manual in all processes (see classes/build_profile.py), and written to
+build_profile/build_profile.json and build_profile.txt in the snapshot. Add --cprofile to also
+write the cProfile output of every worker process to build_profile/cprofile/.
+
+The process pools and the threads per process (OpenMP/Tesseract, torch, FAISS) are sized from
+the usable cores by a ResourcePlan (see classes/resource_plan.py): OCR runs single-threaded with
+one process per core, and the embedding processes share the physical cores with a few threads
+each. --cores, --ocr-workers, --ocr-threads, --embed-workers and --embed-threads override the plan,
+which is printed before the build and stored in the snapshot manifest.
+
+With --layout, the word and line boxes of every page are captured during OCR (or read from the
+text layer of PDF pages), and every record stores the region of its chunk on its page(s), so that
+the app shows a cropped snippet of the matching region instead of the full page (see
+classes/page_layout.py).
+
 Usage:
-    python create_vector_databases.py
+    python create_vector_databases.py [--mode streaming|phased] [--ocr-workers N] [--queue-size N]
+                                      [--languages en ...] [--route-languages] [--keep-snapshots N]
+                                      [--chunking page|manual] [--profile [--cprofile]]
+                                      [--cores N] [--ocr-threads N] [--embed-workers N] [--embed-threads N]
+                                      [--layout] [--dedup-threshold T [--skip-dedup-eval]]
 
 Side Effects:
-    - Creates or overwrites the vector_databases/ directory.
+    - Creates a new snapshot in vector_databases/snapshots/ and publishes it.
 
 Note:
     This script is designed to be run after setting up the docs/ folder with structured manual images.
@@ -28,6 +73,34 @@ if __name__ == '__main__':
     import sys
     from pathlib import Path
     import os 
+    import argparse
+    parser = argparse.ArgumentParser(description='Create the vector databases.')
+    parser.add_argument('--mode', choices=['streaming', 'phased'], default='streaming')
+    parser.add_argument('--cores', type=int, default=None, help='Cores to plan the build for. Defaults to the usable cores.')
+    parser.add_argument('--ocr-workers', type=int, default=None, help='OCR processes.')
+    parser.add_argument('--ocr-threads', type=int, default=1, help='Threads per OCR process.')
+    parser.add_argument('--embed-workers', type=int, default=None, help='Embedding processes (phased mode).')
+    parser.add_argument('--embed-threads', type=int, default=None, help='Threads per embedding process.')
+    parser.add_argument('--queue-size', type=int, default=64, help='Pages waiting between stages (streaming mode).')
+    parser.add_argument('--dedup-threshold', type=float, default=None,
+                        help='Collapse chunks with at least this estimated Jaccard similarity (e.g. 0.9).')
+    parser.add_argument('--skip-dedup-eval', action='store_true',
+                        help='Do not compare recall@k and MRR with and without deduplication after the build.')
+    parser.add_argument('--languages', nargs='+', default=None,
+                        help='Target language codes (e.g. en). Pages in other languages are skipped.')
+    parser.add_argument('--route-languages', action='store_true',
+                        help='Route pages in other languages to separate <manual>__<language> indexes instead of skipping them.')
+    parser.add_argument('--keep-snapshots', type=int, default=2, help='Snapshots to keep after publishing.')
+    parser.add_argument('--chunking', choices=['page', 'manual'], default='page',
+                        help='Chunk every page on its own, or the pages of a manual as one text so that chunks may cross page breaks.')
+    parser.add_argument('--layout', action='store_true',
+                        help='Store the word and line boxes of every chunk, so that the app can show cropped page snippets.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record the time, CPU time, items, IPC bytes and peak RSS of every stage (streaming mode).')
+    parser.add_argument('--cprofile', action='store_true', help='With --profile, also write cProfile output for every worker process.')
+    args = parser.parse_args()
+    if args.profile and args.mode != 'streaming':
+        parser.error('--profile is only supported in streaming mode.')
     base_folder = Path(__file__).resolve().parent.parent
     sys.path.append(str(base_folder))
     os.system('cls')
@@ -37,31 +110,108 @@ if __name__ == '__main__':
     from classes.embedder import Embedder
     from classes.vector_database import VectorDatabase
     from classes.db_creator import DbCreator
-    import joblib
+    from classes.record_store import RecordStore
+    from classes.build_pipeline import StreamingBuildPipeline
+    from classes.build_profile import BuildProfile
+    from classes.resource_plan import ResourcePlan
+    from classes.snapshots import VECTOR_DB_ROOT, new_snapshot_dir, write_manifest, publish, prune
     from tqdm import tqdm
     import multiprocessing
+    import json
 
     # Make sure a new python process is started for each worker
     # during multiprocessing
     multiprocessing.set_start_method('spawn', force=True)
     
-    # Create the vector_databases folder, create records
-    # and save them to this folder
-    os.mkdir(base_folder / 'vector_databases')
-    os.system('cls')
-    print('🔄️ Creating metadata...')
+    # Divide the cores between the process pools
+    plan = ResourcePlan(
+        args.mode,
+        cores=args.cores,
+        ocr_workers=args.ocr_workers,
+        ocr_threads=args.ocr_threads,
+        embed_workers=args.embed_workers,
+        embed_threads=args.embed_threads
+    )
+
+    # Create a new snapshot folder and the record store
+    snapshot_dir = new_snapshot_dir(VECTOR_DB_ROOT)
+    store = RecordStore(snapshot_dir / 'records.sqlite')
     tasks = TaskGenerator(base_folder / 'docs').get_tasks()
-    rc = RecordCreator(tasks)
-    records = rc.create_records()
-    joblib.dump(records, base_folder / 'vector_databases' / 'records.pkl')
-    
-    # Create the vector databases
-    os.system('cls')
-    print('🔄️ Creating vector databases...')
-    records = joblib.load(base_folder / 'vector_databases'/ 'records.pkl')
-    manual_names = list(set(list([record['manual'] for record in records])))
-    DbCreator(records,manual_names).create_databases()
+
+    if args.mode == 'streaming':
+        # Run OCR, chunking, embedding and index writing as overlapping stages
+        os.system('cls')
+        print('🔄️ Creating metadata and vector databases...')
+        print(f'⚙️ {plan}')
+        profile = None
+        if args.profile:
+            profile = BuildProfile(snapshot_dir / 'build_profile' / 'cprofile' if args.cprofile else None).start()
+        creator = StreamingBuildPipeline(
+            tasks,
+            snapshot_dir,
+            store=store,
+            plan=plan,
+            queue_size=args.queue_size,
+            dedup_threshold=args.dedup_threshold,
+            languages=args.languages,
+            route_languages=args.route_languages,
+            chunking=args.chunking,
+            profile=profile,
+            layout=args.layout
+        ).run()
+        if profile is not None:
+            profile.finish()
+            path = profile.save(snapshot_dir / 'build_profile')
+            print('\n' + profile.summary())
+            print(f'\n⏱️ Build profile saved to {path}')
+    else:
+        # Create records and save them to the record store
+        os.system('cls')
+        print('🔄️ Creating metadata...')
+        print(f'⚙️ {plan}')
+        rc = RecordCreator(
+            tasks,
+            languages=args.languages,
+            route_languages=args.route_languages,
+            chunking=args.chunking,
+            plan=plan,
+            layout=args.layout
+        )
+        store.add_records(rc.create_records())
+        
+        # Create the vector databases
+        os.system('cls')
+        print('🔄️ Creating vector databases...')
+        creator = DbCreator(
+            store, store.manual_names(), dedup_threshold=args.dedup_threshold, output_dir=snapshot_dir, plan=plan
+        ).create_databases()
+
+    # Report the index size reduction of the deduplication
+    if creator.dedup_reports:
+        reports = creator.dedup_reports
+        before = sum(r['records_before'] for r in reports.values())
+        after = sum(r['records_after'] for r in reports.values())
+        (snapshot_dir / 'dedup_report.json').write_text(json.dumps(reports, indent=2))
+        print(f'\n🧹 Deduplication kept {after} of {before} chunks ({1 - after / max(before, 1):.1%} fewer vectors).')
+        # Measure the retrieval impact on the manuals with stored evaluation questions
+        evaluated = sorted(
+            path.stem for path in (base_folder / 'evaluation').glob('*.pkl') if path.stem in reports
+        )
+        if evaluated and not args.skip_dedup_eval:
+            from classes.retrieval_evaluator import RetrievalEvaluator
+            print(f'🔄️ Evaluating retrieval with and without deduplication on {len(evaluated)} manuals...')
+            retrieval = RetrievalEvaluator(base_dir=base_folder, db_dir=snapshot_dir).evaluate_dedup(evaluated)
+            full, deduplicated = retrieval['full'], retrieval['deduplicated']
+            print(f"\n{'':<16}{'full':>10}{'deduplicated':>14}")
+            for metric in [key for key in full if key.startswith('recall@')] + ['mrr']:
+                print(f'{metric:<16}{full[metric]:>10.4f}{deduplicated[metric]:>14.4f}')
+            (snapshot_dir / 'dedup_retrieval.json').write_text(json.dumps(retrieval, indent=2))
     
+    # Write the manifest, publish the snapshot and prune old snapshots
+    write_manifest(snapshot_dir, {'build': {key: value for key, value in vars(args).items()}, 'resources': plan.to_dict()})
+    publish(snapshot_dir, VECTOR_DB_ROOT)
+    pruned = prune(VECTOR_DB_ROOT, keep=args.keep_snapshots)
+    print(f'\n📦 Published snapshot {snapshot_dir.name}' + (f' and pruned {len(pruned)} old snapshots.' if pruned else '.'))
+
     # Celebrate
-    os.system('cls')
     print('\n🎉 All done!')
\ No newline at end of file
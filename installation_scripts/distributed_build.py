@@ -0,0 +1,133 @@
+"""
+Script: distributed_build.py
+
+This script builds the vector databases on several hosts at once, through a work queue in a
+folder every host can reach (see classes/work_queue.py and classes/distributed_build.py).
+
+Workflow:
+1. init: creates the queue, with one work unit per manual in docs/ and the build settings.
+2. worker: run on every host (or several times on one host). Each worker claims manuals from
+   the queue and runs OCR, chunking and embedding for them independently. A worker holds a
+   lease on its manual and touches it every few seconds; if a worker dies, its lease expires
+   after --lease-seconds and another worker takes the manual over. Failed manuals are retried
+   up to --max-attempts times.
+3. status: shows the state of every manual.
+4. merge: when all manuals are done, assembles their parts into a new snapshot in
+   vector_databases/snapshots/, writes its manifest and publishes it.
+
+Use --processes N with worker to run N workers on this host, e.g. to test the build locally
+against one queue folder. The cores of the host are divided between them.
+
+The docs folder should be at the same path on every host, as the page paths are stored in the
+records.
+
+Usage:
+    python distributed_build.py init QUEUE [--manuals NAME ...] [--chunking page|manual]
+                                           [--languages en ...] [--route-languages] [--dedup-threshold T]
+                                           [--layout]
+    python distributed_build.py worker QUEUE [--processes N] [--docs DIR] [--cores N] [--no-wait]
+                                             [--lease-seconds S]
+    python distributed_build.py status QUEUE
+    python distributed_build.py merge QUEUE [--allow-missing] [--keep-snapshots N]
+
+Side Effects:
+    - init and worker write to the queue folder.
+    - merge creates a new snapshot in vector_databases/snapshots/ and publishes it.
+"""
+
+
+def worker_process(queue_root: str, docs: str, cores: int, lease_seconds: float, max_attempts: int, wait: bool) -> list:
+    """
+    Runs one worker. This function is run in its own process with --processes.
+    """
+    import sys
+    from pathlib import Path
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from classes.work_queue import WorkQueue
+    from classes.distributed_build import run_worker
+    from classes.resource_plan import ResourcePlan
+    queue = WorkQueue(queue_root, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    return run_worker(queue, docs_dir=docs, plan=ResourcePlan('streaming', cores=cores), wait=wait)
+
+
+if __name__ == '__main__':
+    # Perform necessary imports
+    import sys
+    from pathlib import Path
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the vector databases on several hosts.')
+    parser.add_argument('command', choices=['init', 'worker', 'status', 'merge'])
+    parser.add_argument('queue', type=Path, help='The queue folder, reachable from every host.')
+    parser.add_argument('--manuals', nargs='+', default=None, help='init: the manuals to build. Defaults to all manuals.')
+    parser.add_argument('--chunking', choices=['page', 'manual'], default='page')
+    parser.add_argument('--languages', nargs='+', default=None)
+    parser.add_argument('--route-languages', action='store_true')
+    parser.add_argument('--dedup-threshold', type=float, default=None)
+    parser.add_argument('--layout', action='store_true', help='init: store the word and line boxes of every chunk.')
+    parser.add_argument('--docs', type=Path, default=None, help='worker: the docs folder. Defaults to the one of init.')
+    parser.add_argument('--processes', type=int, default=1, help='worker: the number of workers to run on this host.')
+    parser.add_argument('--cores', type=int, default=None, help='worker: the cores of this host to use.')
+    parser.add_argument('--lease-seconds', type=float, default=300, help='Time without a heartbeat after which a lease expires.')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Failed attempts after which a manual is given up.')
+    parser.add_argument('--no-wait', action='store_true', help='worker: stop when nothing is left to claim, instead of waiting for the other workers.')
+    parser.add_argument('--allow-missing', action='store_true', help='merge: merge even though some manuals are not done.')
+    parser.add_argument('--keep-snapshots', type=int, default=2, help='merge: snapshots to keep after publishing.')
+    args = parser.parse_args()
+    base_folder = Path(__file__).resolve().parent.parent
+    sys.path.append(str(base_folder))
+    from classes.work_queue import WorkQueue
+    queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+
+    if args.command == 'init':
+        from classes.distributed_build import create_queue
+        create_queue(
+            queue,
+            base_folder / 'docs',
+            manuals=args.manuals,
+            chunking=args.chunking,
+            languages=args.languages,
+            route_languages=args.route_languages,
+            dedup_threshold=args.dedup_threshold,
+            layout=args.layout
+        )
+        print(f'📋 Created a queue of {len(queue.units())} manuals in {args.queue}.')
+
+    elif args.command == 'worker':
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from classes.resource_plan import usable_cores
+        multiprocessing.set_start_method('spawn', force=True)
+        # Divide the cores of the host between its workers
+        cores = max(1, (args.cores or usable_cores()) // args.processes)
+        worker_args = (str(args.queue), args.docs, cores, args.lease_seconds, args.max_attempts, not args.no_wait)
+        if args.processes == 1:
+            built = worker_process(*worker_args)
+        else:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                futures = [executor.submit(worker_process, *worker_args) for _ in range(args.processes)]
+                built = [manual for future in futures for manual in future.result()]
+        print(f'\n🎉 Built {len(built)} manuals.')
+
+    elif args.command == 'status':
+        status = queue.status()
+        for unit, state in status.items():
+            print(f'{state:<8} {unit}')
+        for unit in (unit for unit, state in status.items() if state == 'failed'):
+            print(f"\n❌ {unit}:\n{queue.attempts(unit)[-1]['error']}")
+        counts = {state: list(status.values()).count(state) for state in ('done', 'leased', 'pending', 'failed')}
+        print('\n' + ', '.join(f'{count} {state}' for state, count in counts.items()))
+
+    else:
+        import json
+        from classes.distributed_build import merge_parts
+        from classes.snapshots import VECTOR_DB_ROOT, new_snapshot_dir, write_manifest, publish, prune
+        print('🔄️ Merging the parts...')
+        snapshot_dir = new_snapshot_dir(VECTOR_DB_ROOT)
+        reports = merge_parts(queue, snapshot_dir, allow_missing=args.allow_missing)
+        if reports:
+            (snapshot_dir / 'dedup_report.json').write_text(json.dumps(reports, indent=2))
+        write_manifest(snapshot_dir, {'build': {'distributed': str(args.queue), **queue.settings()}})
+        publish(snapshot_dir, VECTOR_DB_ROOT)
+        pruned = prune(VECTOR_DB_ROOT, keep=args.keep_snapshots)
+        print(f'\n📦 Published snapshot {snapshot_dir.name}' + (f' and pruned {len(pruned)} old snapshots.' if pruned else '.'))
+        print('\n🎉 All done!')